@@ -1,5 +1,40 @@
+import abc
+import argparse
+import bisect
+import heapq
+import json
+import math
+import mmap
+import multiprocessing
+import os
 import random
-import pygame
+import struct
+import sys
+from array import array
+from collections import deque
+from functools import partial
+from time import perf_counter_ns
+
+try:
+    import tomllib # Scénáře v TOML (Python 3.11+), jinak jen JSON
+except ImportError:
+    tomllib = None
+
+try:
+    import numpy as np # Volitelné - potřebuje jen ArrayRoad
+except ImportError:
+    np = None
+
+pygame = None # Pygame se načítá líně, až když se vytváří Visualizer
+
+
+def _load_pygame():
+    # Načte pygame až při prvním použití. Testy a headless běhy se bez něj obejdou.
+    global pygame
+    if pygame is None:
+        import pygame as pygame_module
+        pygame = pygame_module
+    return pygame
 
 # --- KONSTANTY SMĚRŮ ---
 DIR_RIGHT = "RIGHT" # Doprava
@@ -7,25 +42,220 @@ DIR_LEFT  = "LEFT"  # Doleva
 DIR_DOWN  = "DOWN"  # Dolů
 DIR_UP    = "UP"    # Nahoru
 
+# --- ZÁZNAM UDÁLOSTÍ (místo print) ---
+# Úrovně událostí
+DEBUG = 10   # Časté události (nové vozidlo, vozidlo v cíli)
+INFO  = 20   # Přepnutí semaforů a přejezdů
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO"}
+
+# Druhy událostí
+EVENT_SPAWN = "spawn"                    # Generátor přidal vozidlo
+EVENT_EXIT = "exit"                      # Vozidlo dojelo do cíle
+EVENT_LIGHT = "light"                    # Semafor nebo řadič křižovatky přepnul
+EVENT_CROSSING_CLOSE = "crossing_close"  # Přejezd zavřen (blíží se vlak)
+EVENT_CROSSING_OPEN = "crossing_open"    # Přejezd otevřen
+EVENT_LANE_CHANGE = "lane_change"        # Vozidlo přejelo do sousedního pruhu
+
+
+class FileSink:
+    # Zapisuje události do souboru jako JSON řádky - vždy celou dávku najednou.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, events):
+        lines = []
+        for time, level, kind, source, data in events:
+            record = {"time": round(time, 3), "level": LEVEL_NAMES.get(level, level), "kind": kind,
+                      "source": type(source).__name__ if source is not None else None}
+            record.update(data)
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.write("".join(lines))
+
+    def close(self):
+        self.file.close()
+
+
+class EventLog:
+    # Kruhový buffer událostí s pevnou kapacitou (předem alokovaný seznam).
+    # Zápis je jen uložení n-tice - žádné formátování ani výpis na konzoli.
+    # Se sinkem se události po dávkách (flush_every) zapisují do souboru.
+    def __init__(self, capacity=4096, level=DEBUG, sink=None, flush_every=1024):
+        self.capacity = capacity
+        self.level = level               # Události pod touto úrovní se zahodí
+        self.sink = sink                 # Např. FileSink (může chybět)
+        self.flush_every = min(flush_every, capacity) # Dřív, než by je buffer přepsal
+        self.buffer = [None] * capacity  # (čas, úroveň, druh, zdroj, data)
+        self.head = 0                    # Kam se zapíše další událost
+        self.count = 0                   # Kolik událostí buffer drží
+        self.pending = 0                 # Kolik posledních událostí ještě nezná sink
+        self.total = 0                   # Kolik událostí kdy přišlo
+        self.time = 0.0                  # Simulovaný čas (nastavuje Simulation)
+
+    def emit(self, kind, source=None, level=DEBUG, **data):
+        if level < self.level:
+            return
+        self.buffer[self.head] = (self.time, level, kind, source, data)
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+        if self.sink is not None:
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.flush()
+
+    def latest(self, n):
+        # Posledních n událostí (od nejstarší po nejnovější).
+        n = min(n, self.count)
+        start = (self.head - n) % self.capacity
+        return [self.buffer[(start + i) % self.capacity] for i in range(n)]
+
+    def events(self, kind=None):
+        # Všechny události v bufferu od nejstarší po nejnovější (volitelně jen jednoho druhu).
+        events = self.latest(self.count)
+        if kind is not None:
+            events = [e for e in events if e[2] == kind]
+        return events
+
+    @property
+    def dropped(self):
+        # Kolik nejstarších událostí už buffer přepsal
+        return self.total - self.count
+
+    def flush(self):
+        # Předá sinku události, které ještě nemá.
+        if self.sink is not None and self.pending:
+            self.sink.write(self.latest(self.pending))
+        self.pending = 0
+
+    def clear(self):
+        self.buffer = [None] * self.capacity
+        self.head = self.count = self.pending = self.total = 0
+
+    def close(self):
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+    @staticmethod
+    def format(event):
+        # Lidsky čitelný řádek pro výpis (jen když o něj někdo stojí).
+        time, level, kind, source, data = event
+        details = " ".join(f"{key}={value}" for key, value in data.items())
+        return f"[{time:8.2f}] {LEVEL_NAMES.get(level, level):5} {kind:15} {type(source).__name__} {details}"
+
+
+event_log = EventLog() # Společný záznam událostí celé simulace
+
+
+# --- PROFILOVÁNÍ FÁZÍ ---
+class Profiler:
+    # Měří, kolik času zaberou jednotlivé fáze kroku a vykreslování (monotónní hodiny v ns).
+    # Vypnutý profiler stojí jen jednu kontrolu "if profiler.enabled" na fázi.
+    # Použití:  t = profiler.now() ... t = profiler.record("road.lights", t) ...
+    def __init__(self, window=600, trace_limit=200000):
+        self.enabled = False
+        self.window = window                     # Z kolika posledních měření se počítají percentily
+        self.samples = {}                        # Název fáze -> deque posledních délek (ns)
+        self.trace = deque(maxlen=trace_limit)   # (název, začátek, konec) pro export do Chrome trace
+        self.origin = perf_counter_ns()          # Počátek časové osy exportu
+
+    def now(self):
+        return perf_counter_ns()
+
+    def record(self, name, start):
+        # Uloží fázi, která začala v čase start, a vrátí konec (= začátek další fáze).
+        end = perf_counter_ns()
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(end - start)
+        self.trace.append((name, start, end))
+        return end
+
+    def percentiles(self, name, points=(50, 95, 99)):
+        # Klouzavé percentily délky fáze v milisekundách (metoda nejbližšího pořadí).
+        ordered = sorted(self.samples.get(name, ()))
+        if not ordered:
+            return {}
+        n = len(ordered)
+        return {p: ordered[min(n - 1, max(0, -(-p * n // 100) - 1))] / 1e6 for p in points}
+
+    def summary(self):
+        # {fáze: {"count": počet v okně, "p50"/"p95"/"p99": ms}}
+        result = {}
+        for name in self.samples:
+            values = self.percentiles(name)
+            result[name] = {"count": len(self.samples[name]), **{f"p{p}": ms for p, ms in values.items()}}
+        return result
+
+    def reset(self):
+        self.samples = {}
+        self.trace.clear()
+        self.origin = perf_counter_ns()
+
+    def export_chrome_trace(self, path):
+        # Zapíše fáze jako "complete" události formátu Chrome Trace (otevře i speedscope
+        # nebo chrome://tracing). Vnořené fáze se zobrazí jako flame graph.
+        events = [{"name": name, "cat": name.split(".")[0], "ph": "X", "pid": os.getpid(), "tid": 0,
+                   "ts": (start - self.origin) / 1000.0, "dur": (end - start) / 1000.0}
+                  for name, start, end in self.trace]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+profiler = Profiler() # Společný profiler (defaultně vypnutý)
+
+
 # --- 1. RODIČOVSKÉ TŘÍDY (Dědičnost) ---
 class Vehicle:
     # Základní třída pro všechna vozidla.
     # Ostatní auta (Car, Truck, Bus) z ní budou dědit.
+    # Vozidel jsou v simulaci tisíce - instance nemají __dict__, jen sloty pro proměnlivý stav.
+    # Co je pro celý typ stejné (délka, barva, zrychlení), jsou konstanty třídy.
+    __slots__ = ("id", "position", "speed", "max_speed", "acceleration", "direction",
+                 "is_braking", "current_wait", "stopped", "lane", "destination")
+    can_stop = True    # Zda metoda stop() vozidlo opravdu zastaví (vlak ne)
+    next_id = 0        # Další volné číslo vozidla
+    length = 0.0       # Délka v metrech (potomci přepíšou)
+    color = "red"      # Jen pro vizualizaci
+    start_delay = 1.1  # Jak dlouho řidič "kouká", než se rozjede (1.1 vteřiny)
+
     def __init__(self, position, speed, acceleration, direction):
+        self.id = Vehicle.next_id        # Jednoznačné číslo vozidla (pro záznam trajektorií)
+        Vehicle.next_id += 1
         self.position = position         # Pozice v metrech
         self.speed = speed               # Rychlost v m/s
         self.max_speed = speed           # Maximální rychlost pro opětovné rozjetí
-        self.acceleration = acceleration # Zrychlení v m/s²
+        if acceleration != type(self).acceleration:
+            self.acceleration = acceleration # Zrychlení v m/s² (potomci ho mají jako konstantu třídy)
         self.direction = direction       # Směr jízdy
         self.is_braking = False          # Zda auto právě zpomaluje (svítí brzdová světla)
-        self.start_delay = 1.1           # Jak dlouho řidič "kouká", než se rozjede (1.1 vteřiny)
         self.current_wait = 0.0          # Odpočet času
         self.stopped = False             # Zda auto stojí
-        self.color = "red"               # Jen pro vizualizaci
+        self.lane = 0                    # Pruh (0 = u středové čáry; jen u vícepruhových silnic)
+        self.destination = None          # Cílový uzel v síti silnic (None = končí na konci silnice)
+
+    def __getstate__(self):
+        # Pro pickle (paralelní procesy): jen obsazené sloty. Zrychlení potomků je konstanta
+        # třídy, která zakrývá slot - přes deskriptor slotu ho nečteme ani nezapisujeme.
+        state = {}
+        for name in Vehicle.__slots__:
+            try:
+                state[name] = Vehicle.__dict__[name].__get__(self)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            Vehicle.__dict__[name].__set__(self, value)
 
     def get_length(self):
-        # Tuto metodu přepíšeme v potomcích (Car, Truck...).
-        return 0.0
+        # Délka je konstanta třídy; v horké smyčce se čte rovnou jako atribut length.
+        return self.length
 
     def move(self, dt):
         # Fyzika pohybu. Pokud auto nestojí, posuneme ho.
@@ -59,67 +289,90 @@ class Vehicle:
             return 99999.0 # Nekonečno (žádné auto před námi)
             
         # Vzorec: Pozice auta vpředu - Moje pozice - Délka auta vpředu
-        return vehicle_ahead.position - self.position - vehicle_ahead.get_length()        
+        return vehicle_ahead.position - self.position - vehicle_ahead.length        
 
 
 # --- 2. KONKRÉTNÍ VOZIDLA ---
 
 class Car(Vehicle):
+    __slots__ = ()
+    length = 10                # Osobák je nejkratší
+    acceleration = 7.0
+    color = (0, 100, 255)      # Modrá
+
     def __init__(self, speed, position, direction):
         super().__init__(position, speed, acceleration = 7.0, direction = direction)
-        self.color = (0, 100, 255) # Modrá
-
-    def get_length(self):
-        return 10  # Osobák je nejkratší
 
 
 class Bus(Vehicle):
+    __slots__ = ()
+    length = 20                # Autobus je střední délky
+    acceleration = 5
+    color = (255, 255, 0)      # Žlutá
+
     def __init__(self, speed, position, direction):
         super().__init__(position, speed, acceleration = 5, direction = direction)
-        self.color = (255, 255, 0) # Žlutá
-
-    def get_length(self):
-        return 20 # Autobus je střední délky
 
 
 class Truck(Vehicle):
+    __slots__ = ()
+    length = 30                # Kamion je nejdelší
+    acceleration = 3
+    color = (0, 255, 0)        # Zelená
+
     def __init__(self, speed, position, direction):
         super().__init__(position, speed, acceleration = 3, direction = direction)
-        self.color = (0, 255, 0) # Zelená
-
-    def get_length(self):
-        return 30 # Kamion je nejdelší
 
 
 class Train(Vehicle):
+    __slots__ = ()
+    can_stop = False
+    length = 120.0
+    acceleration = 0.0
+    color = (200, 200, 200)    # Šedý/Stříbrný
+
     def __init__(self, speed, position, direction):
         super().__init__(position, speed, acceleration=0.0, direction=direction)
-        self.color = (200, 200, 200) # Šedý/Stříbrný
         self.stopped = False # Pojistka - vlak v simulaci NIKDY nezastaví
 
-    def get_length(self):
-        return 120.0 
-
     def stop(self):
         # Přepsání metody (Polymorfismus): Vlak NIKDY nezastaví
         pass
 
 
+VEHICLE_TYPES = {cls.__name__: cls for cls in (Car, Bus, Truck, Train)} # Typy podle jména (snapshoty)
+
+
 # --- 3. SEMAFORY (Polymorfismus) ---
 
 class TrafficLight:
     # Základní třída pro semafor (Rozhraní).
+    actuated = False # True = mění se jen podle vozidel, na prázdné silnici nemá co dělat
+
     def __init__(self, position):
         self.position = position
         self.is_green = True
 
+    def attach(self, road):
+        # Zavolá se při přidání na silnici. Chytré semafory si tu zaregistrují detekční zónu.
+        pass
+
     def update(self, dt, vehicles):
         # Metoda update přijímá i seznam vozidel, aby 'chytré' semafory mohly reagovat na provoz.
         pass
 
+    def get_state(self):
+        # Proměnlivý stav pro snapshot (poloha a nastavení patří do scénáře).
+        return {"green": self.is_green}
+
+    def set_state(self, state):
+        self.is_green = state["green"]
+
 
 class CyclicTrafficLight(TrafficLight):
     # Klasický semafor - přepíná časově, auta ignoruje.
+    scheduled = False # True = přepíná ho kalendář simulace, silnice ho už volat nemusí
+
     def __init__(self, position, interval):
         super().__init__(position)
         self.interval = interval
@@ -127,81 +380,675 @@ class CyclicTrafficLight(TrafficLight):
 
     def update(self, dt, vehicles):
         # Tento semafor seznam 'vehicles' ignoruje, řídí se jen časem
+        if not self.scheduled:
+            self.tick(dt)
+
+    def next_wakeup(self):
+        # Za kolik sekund semafor přepne (pro kalendář událostí)
+        return self.interval - self.timer
+
+    def tick(self, dt):
         self.timer += dt
         if self.timer >= self.interval:
             self.is_green = not self.is_green
             self.timer = 0.0
-            state = "ZELENÁ" if self.is_green else "ČERVENÁ"
-            print(f"Cyklický semafor ({self.position}m) přepnul na: {state}")
+            event_log.emit(EVENT_LIGHT, self, INFO, position=self.position, green=self.is_green)
+
+    def get_state(self):
+        return dict(super().get_state(), timer=self.timer)
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.timer = state["timer"]
 
 
 class SmartTrafficLight(TrafficLight):
     # Inteligentní semafor. Defaultně je červená. Zelenou pustí jen, když se blíží auto.
+    actuated = True
+
     def __init__(self, position, detection_range=50.0):
         super().__init__(position)
         self.detection_range = detection_range # Jak daleko semafor "vidí"
         self.is_green = False # Šetříme energii, defaultně červená
+        self.zone = None # Detekční zóna (senzor), kterou za nás hlídá silnice
+
+    def attach(self, road):
+        # Zóna "0 < vzdálenost <= detection_range" před semaforem
+        self.zone = road.add_zone(DetectionZone(self.position - self.detection_range, self.position,
+                                                include_start=True))
 
     def update(self, dt, vehicles):
         # 1. Zjistíme, jestli je nějaké auto v zóně před semaforem
-        car_detected = False
-        
-        for vehicle in vehicles:
-            distance = self.position - vehicle.position
-            # Auto je před semaforem (distance > 0) A zároveň v dosahu senzoru
-            if 0 < distance <= self.detection_range:
-                car_detected = True
-                break # Stačí nám jedno auto, abychom pustili zelenou
+        if self.zone is not None:
+            # Silnice počítá auta v zóně průběžně - stačí se podívat na počítadlo
+            car_detected = self.zone.count > 0
+        else:
+            # Semafor mimo silnici - projdeme seznam vozidel ručně
+            car_detected = False
+            for vehicle in vehicles:
+                distance = self.position - vehicle.position
+                # Auto je před semaforem (distance > 0) A zároveň v dosahu senzoru
+                if 0 < distance <= self.detection_range:
+                    car_detected = True
+                    break # Stačí nám jedno auto, abychom pustili zelenou
         
         # 2. Reakce semaforu
         if car_detected and not self.is_green:
             self.is_green = True
-            print(f"SmartSemafor ({self.position}m): Auto detekováno -> ZELENÁ")
+            event_log.emit(EVENT_LIGHT, self, INFO, position=self.position, green=True)
         
         elif not car_detected and self.is_green:
             self.is_green = False
-            print(f"SmartSemafor ({self.position}m): Prázdno -> ČERVENÁ")
+            event_log.emit(EVENT_LIGHT, self, INFO, position=self.position, green=False)
 
 
 # --- 4. SILNICE (Řízení simulace) ---
 
+class DetectionZone:
+    # Detekční zóna (senzor) na úseku silnice mezi start a end (v metrech).
+    # Silnice sama hlídá, kdy vozidla přejedou hranice zóny, a průběžně upravuje
+    # počítadlo 'count' - semafory a řadiče ho pak jen přečtou (O(1)).
+    def __init__(self, start, end, include_start=False):
+        self.start = start
+        self.end = end
+        self.include_start = include_start # Zda patří do zóny i auto přesně na 'start'
+        self.count = 0                     # Počet vozidel v zóně
+
+    def contains(self, position):
+        if self.include_start:
+            return self.start <= position < self.end
+        return self.start < position < self.end
+
+
+LIGHT_RANGE = 100.0 # Na semafory řidiči reagují až do této vzdálenosti (viz Road._lights_ahead)
+SPEED_TOLERANCE = 0.02 # Adaptivní krok: o jaký podíl maximálky smí vozidlo během jednoho kroku zrychlit
+BUSY_RECHECK = 4       # Adaptivní krok: po kolika základních krocích se vytížená silnice znovu změří
+
+
+# --- MODELY SLEDOVÁNÍ VOZIDLA (Car-following) ---
+
+class CarFollowingModel(abc.ABC):
+    # Rozhraní modelu: jak vozidlo reaguje na vozidlo před sebou a na semafory.
+    # Road volá drive() pro seřazený pruh objektů, ArrayRoad drive_arrays() pro celou silnici.
+    # Model musí umět obojí - bez toho ho nejde vytvořit.
+    name = None
+    max_acceleration = None # Zrychlení společné všem vozidlům (None = podle typu vozidla)
+
+    @abc.abstractmethod
+    def drive(self, road, vehicles, dt, has_zones):
+        # Jeden krok pro seřazený seznam vozidel. Vrací index prvního vozidla, které
+        # předjelo vozidlo před sebou (None = pořadí sedí), stejně jako Road._drive.
+        pass
+
+    @abc.abstractmethod
+    def drive_arrays(self, road, dt):
+        # Totéž nad poli ArrayRoad.
+        pass
+
+    def estimate(self, vehicle, leader):
+        # Zrychlení vozidla za daným vozidlem vpředu (pro rozhodování o změně pruhu).
+        # None = model odhad nemá a MultiLaneRoad použije vlastní pravidla.
+        return None
+
+
+class LegacyModel(CarFollowingModel):
+    # Původní pravidla (bezpečná vzdálenost 2 s + 5 m, přizpůsobení rychlosti, zastavení
+    # na červenou do 10 m). Zůstává výchozím modelem - výsledky se nemění.
+    name = "legacy"
+
+    def drive(self, road, vehicles, dt, has_zones):
+        return road._drive(vehicles, dt, has_zones)
+
+    def drive_arrays(self, road, dt):
+        road._step(dt)
+
+
+class IDMModel(CarFollowingModel):
+    # Intelligent Driver Model (Treiber). Zrychlení je spojitá funkce rychlosti, mezery
+    # a rychlosti přibližování:
+    #   a = a_max * (1 - (v/v0)^delta - (s*/s)^2),   s* = s0 + max(0, v*T + v*dv / (2*sqrt(a_max*b)))
+    # Červený semafor je pro model stojící "vozidlo" na stop čáře. Pozice se počítá
+    # balisticky (x += v*dt + a*dt²/2, rychlost nikdy pod nulu), takže model zůstává
+    # stabilní i při dt v desetinách sekundy. Brzdění za vozidlem vpředu se neomezuje -
+    # IDM pak nedovolí srážku ani vozidlu, které generátor vypustí těsně za pomalý kamion.
+    name = "idm"
+
+    def __init__(self, time_headway=1.5, min_gap=2.0, comfortable_deceleration=3.0, max_deceleration=9.0,
+                 delta=4, max_acceleration=None, brake_light_threshold=1.0, stop_speed=0.1, restart_fraction=0.5):
+        self.time_headway = time_headway                         # T - požadovaný časový odstup (s)
+        self.min_gap = min_gap                                   # s0 - mezera v koloně (m)
+        self.comfortable_deceleration = comfortable_deceleration # b - pohodlné brzdění (m/s²)
+        self.max_deceleration = max_deceleration                 # Nejprudší brzdění, kterým ještě zastavíme na červenou
+        self.delta = delta                                       # Exponent volné jízdy
+        self.max_acceleration = max_acceleration                 # a_max (None = zrychlení typu vozidla, vlak b)
+        self.brake_light_threshold = brake_light_threshold       # Od jakého zpomalení svítí brzdová světla
+        self.stop_speed = stop_speed                             # Pod touto rychlostí brzdící vozidlo zastaví
+        self.restart_fraction = restart_fraction                 # Stojící se rozjede až při zrychlení nad tímto podílem a_max
+
+    def acceleration(self, speed, max_speed, max_acceleration, gap, closing):
+        # Zrychlení podle IDM (gap = mezera k překážce, closing = o kolik jsme rychlejší než ona).
+        free = 1.0 - (speed / max_speed) ** self.delta if max_speed > 0 else -1.0
+        desired = self.min_gap + max(0.0, speed * self.time_headway + speed * closing /
+                                     (2.0 * math.sqrt(max_acceleration * self.comfortable_deceleration)))
+        return max_acceleration * (free - (desired / max(gap, 0.01)) ** 2)
+
+    def estimate(self, vehicle, leader):
+        a_max = self.max_acceleration or vehicle.acceleration or self.comfortable_deceleration
+        if leader is None:
+            return self.acceleration(vehicle.speed, vehicle.max_speed, a_max, 99999.0, 0.0)
+        return self.acceleration(vehicle.speed, vehicle.max_speed, a_max, vehicle.get_distance_to(leader),
+                                 vehicle.speed - leader.speed)
+
+    def drive(self, road, vehicles, dt, has_zones):
+        # Vozidlo i čte stav vozidla i+1 ještě z minulého kroku (smyčka jde od konce kolony),
+        # takže výsledek je stejný, jako kdyby se všechna zrychlení spočítala najednou.
+        last_index = len(vehicles) - 1
+        first_disorder = None
+        for i in range(len(vehicles)):
+            vehicle = vehicles[i]
+            speed = vehicle.speed
+            a_max = self.max_acceleration or vehicle.acceleration or self.comfortable_deceleration
+
+            # Vozidlo před námi
+            if i < last_index:
+                vehicle_ahead = vehicles[i + 1]
+                gap = vehicle.get_distance_to(vehicle_ahead)
+                acc = self.acceleration(speed, vehicle.max_speed, a_max, gap, speed - vehicle_ahead.speed)
+            else:
+                vehicle_ahead = None
+                acc = self.acceleration(speed, vehicle.max_speed, a_max, 99999.0, 0.0)
+
+            # Semafory jako stojící překážka na stop čáře
+            if vehicle.can_stop:
+                for light in road._lights_ahead(vehicle.position):
+                    distance = light.position - vehicle.position
+                    if not light.is_green:
+                        # Když už zastavit nestihneme ani na plné brzdy, projedeme (dilema na žlutou)
+                        blocked = speed * speed / (2.0 * distance) <= self.max_deceleration
+                    else:
+                        # Anti-Gridlock: na zelenou nevjedeme, pokud za křižovatkou není místo
+                        blocked = (distance < 10 and vehicle_ahead is not None and gap < 60 + vehicle.length
+                                   and (vehicle_ahead.speed < 10.0 or (speed > vehicle_ahead.speed and
+                                        (vehicle_ahead.max_speed / vehicle_ahead.speed > 1.5
+                                         and vehicle_ahead.is_braking))))
+                    if blocked:
+                        acc = min(acc, self.acceleration(speed, vehicle.max_speed, a_max, distance, speed))
+
+            # Rozjezd z místa až po reakční době řidiče (a jen když je před námi místo)
+            if vehicle.stopped:
+                if acc > self.restart_fraction * a_max:
+                    vehicle.current_wait -= dt
+                    if vehicle.current_wait <= 0:
+                        vehicle.stopped = False
+                else:
+                    vehicle.current_wait = vehicle.start_delay
+            vehicle.is_braking = acc < -self.brake_light_threshold
+
+            # Balistický pohyb
+            old_position = vehicle.position
+            if not vehicle.stopped:
+                new_speed = speed + acc * dt
+                if acc > 0 and new_speed > vehicle.max_speed:
+                    new_speed = vehicle.max_speed # Při dlouhém kroku by zrychlení přestřelilo maximálku
+                if acc < 0 and new_speed < self.stop_speed:
+                    # Zastavíme (IDM by se k překážce jinak jen nekonečně pomalu blížil).
+                    # Když by rychlost klesla pod nulu, dojedeme jen brzdnou dráhu.
+                    if new_speed < 0:
+                        vehicle.position -= 0.5 * speed * speed / acc
+                    else:
+                        vehicle.position += speed * dt + 0.5 * acc * dt * dt
+                    vehicle.speed = 0.0
+                    if vehicle.can_stop:
+                        vehicle.stopped = True
+                        vehicle.current_wait = vehicle.start_delay
+                else:
+                    vehicle.position += speed * dt + 0.5 * acc * dt * dt
+                    vehicle.speed = new_speed
+            if has_zones:
+                road._cross_zones(vehicle, old_position)
+
+            if i > 0 and first_disorder is None and vehicles[i-1].position > vehicle.position:
+                first_disorder = i
+        return first_disorder
+
+    def drive_arrays(self, road, dt):
+        # Vektorová verze drive(): zrychlení všech vozidel silnice jedním průchodem.
+        pos = road._pos
+        speed = road._speed
+        max_speed = road._max_speed
+        length = road._length
+        if self.max_acceleration:
+            a_max = np.full(len(pos), float(self.max_acceleration))
+        else:
+            a_max = np.where(road._acc > 0, road._acc, self.comfortable_deceleration)
+        n = len(pos)
+        root = 2.0 * np.sqrt(a_max * self.comfortable_deceleration)
+
+        def acceleration(gap, closing):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                free = np.where(max_speed > 0, 1.0 - (speed / max_speed) ** self.delta, -1.0)
+            desired = self.min_gap + np.maximum(0.0, speed * self.time_headway + speed * closing / root)
+            return a_max * (free - (desired / np.maximum(gap, 0.01)) ** 2)
+
+        gap = np.full(n, 99999.0)
+        gap[:-1] = pos[1:] - pos[:-1] - length[1:]
+        closing = np.zeros(n)
+        closing[:-1] = speed[:-1] - speed[1:]
+        acc = acceleration(gap, closing)
+
+        # Semafory: vzdálenost k nejbližší blokující stop čáře (inf = žádná)
+        obstacle = np.full(n, np.inf)
+        has_ahead = np.arange(n) < n - 1
+        ahead_speed = np.append(speed[1:], 0.0)
+        ahead_max = np.append(max_speed[1:], 0.0)
+        ahead_braking = np.append(road._braking[1:], False)
+        for light in road.traffic_lights:
+            lo = int(np.searchsorted(pos, light.position - 101.0, side="left"))
+            hi = int(np.searchsorted(pos, light.position, side="left"))
+            if lo == hi:
+                continue
+            w = slice(lo, hi)
+            distance = light.position - pos[w]
+            ahead = (distance > 0) & (distance < 100) & road._can_stop[w]
+            if not light.is_green:
+                with np.errstate(divide="ignore"):
+                    blocked = ahead & (speed[w] * speed[w] / (2.0 * distance) <= self.max_deceleration)
+            else:
+                a_speed = ahead_speed[w]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    ahead_is_blocking = (a_speed < 10.0) | (
+                        (speed[w] > a_speed) & (ahead_max[w] / a_speed > 1.5) & ahead_braking[w])
+                blocked = (ahead & (distance < 10) & has_ahead[w] & (gap[w] < 60 + length[w])
+                           & ahead_is_blocking)
+            obstacle[w] = np.where(blocked, np.minimum(obstacle[w], distance), obstacle[w])
+        at_light = np.isfinite(obstacle)
+        if at_light.any():
+            acc = np.where(at_light, np.minimum(acc, acceleration(np.where(at_light, obstacle, 1.0), speed)), acc)
+
+        # Rozjezd z místa až po reakční době řidiče (a jen když je před námi místo)
+        stopped = road._stopped.copy()
+        wait = road._wait
+        can_go = acc > self.restart_fraction * a_max
+        wait = np.where(stopped & can_go, wait - dt, np.where(stopped, road._start_delay, wait))
+        stopped &= ~(can_go & (wait <= 0))
+        road._braking = acc < -self.brake_light_threshold
+
+        # Balistický pohyb
+        moving = ~stopped
+        new_speed = speed + acc * dt
+        new_speed = np.where((acc > 0) & (new_speed > max_speed), max_speed, new_speed)
+        halting = moving & (acc < 0) & (new_speed < self.stop_speed)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            halt_position = pos - 0.5 * speed * speed / acc
+        cruise_position = pos + speed * dt + 0.5 * acc * dt * dt
+        road._pos = np.where(halting & (new_speed < 0), halt_position, np.where(moving, cruise_position, pos))
+        road._speed = np.where(halting, 0.0, np.where(moving, new_speed, speed))
+        newly_stopped = halting & road._can_stop
+        road._stopped = stopped | newly_stopped
+        road._wait = np.where(newly_stopped, road._start_delay, wait)
+
+
+CAR_FOLLOWING_MODELS = {cls.name: cls for cls in (LegacyModel, IDMModel)} # Modely podle jména (CLI)
+
+
 class Road:
-    def __init__(self, length, direction = 'H', start_x=0, start_y=0, reverse=False, road_type="road"):
+    remote = None # Při paralelním běhu: zástupce stavu silnice, která žije v jiném procesu
+    lane_count = 1 # Počet pruhů v jednom směru (viz MultiLaneRoad)
+    routes = None  # V síti: cílový uzel -> index další silnice na trase (nastaví RoadNetwork)
+    outbox = None  # V síti: vozidla, která opustila silnici a čekají na předání (index, vozidlo)
+    model = LegacyModel() # Model sledování vozidla (viz CarFollowingModel)
+    listeners = ()        # Kdo chce vědět o každém novém vozidle (viz add_listener)
+    idle = False          # Prázdná silnice, na které se nic neděje - simulace ji přeskakuje (viz advance)
+    free_dt = 0.0         # Jak dlouhý vlastní krok silnice snese (viz free_step); 0 = jen základní dt
+    boundary_dt = 0.0     # Za jak dlouho se změna silnice projeví navenek (viz boundary_step)
+    busy_steps = 0        # Kolik vlastních kroků ještě jet základním dt, než se znovu ptát free_step
+
+    def __init__(self, length, direction = 'H', start_x=0, start_y=0, reverse=False, road_type="road", model=None):
+        if model is not None:
+            self.model = model
         self.length = length
         self.direction = direction      # 'H' = Horizontal, 'V' = Vertical
         self.reverse = reverse          # Reverzní směr (doleva / nahoru)
         self.start_x = start_x
         self.start_y = start_y
-        self.vehicles = []              # Seznam vozidel
-        self.traffic_lights = []        # Seznam semaforů
+        self.vehicles = []              # Vozidla seřazená podle pozice (deque, viz vehicles)
+        self.traffic_lights = []        # Seznam semaforů (v pořadí přidání)
+        self._light_positions = []      # Pozice semaforů seřazené vzestupně (pro bisect)
+        self._lights_by_position = []   # Semafory ve stejném pořadí jako _light_positions
+        self._light_orders = []         # Pořadí přidání semaforu (index v traffic_lights), taky podle pozice
+        self._polled_lights = []        # Semafory, které je potřeba volat v každém kroku
+        self._lights_idle = True        # Žádný z nich nepočítá čas (viz refresh_lights)
+        self.zones = []                 # Detekční zóny (senzory) na silnici
+        self._zone_bounds = []          # Seřazené hranice všech zón (pro bisect)
+        self._zone_bound_owners = []    # Zóna, které daná hranice patří
+        self._zone_members = {}         # Zóna -> množina vozidel uvnitř
         self.road_type = road_type      # "road" nebo "rail" (pro vlaky)
         self.stats_cars_finished = 0    # Počet aut, co dojela do cíle
         self.stats_avg_speed = 0.0      # Průměrná rychlost aut na silnici
 
-    def add_vehicle(self, vehicle):
-        self.vehicles.append(vehicle)
+    @property
+    def vehicles(self):
+        # Vozidla seřazená podle pozice, vehicles[0] je nejzadnější. Je to deque: nová vozidla
+        # přibývají vzadu (appendleft) a dojetá ubývají vpředu (pop), obojí v O(1).
+        return self._vehicles
+
+    @vehicles.setter
+    def vehicles(self, value):
+        self._vehicles = deque(value)
+
+    def vehicle_count(self):
+        # Počet vozidel na silnici (ArrayRoad kvůli tomu nemusí vytvářet pohledy).
+        return len(self.vehicles)
+
+    def travel_direction(self):
+        # Směr jízdy vozidel na této silnici (podle orientace a reverse).
+        if self.direction == 'H':
+            # Pokud je silnice reverzní, jede doleva, jinak doprava
+            return DIR_LEFT if self.reverse else DIR_RIGHT
+        # Pokud je silnice reverzní, jede nahoru, jinak dolů
+        return DIR_UP if self.reverse else DIR_DOWN
+
+    def get_state(self):
+        # Statistiky pro snapshot. Vozidla ukládá snapshot zvlášť po sloupcích.
+        return {"finished": self.stats_cars_finished, "avg_speed": self.stats_avg_speed,
+                "idle": self.idle, "free_dt": self.free_dt, "boundary_dt": self.boundary_dt,
+                "busy_steps": self.busy_steps}
+
+    def set_state(self, state):
+        self.stats_cars_finished = state["finished"]
+        self.stats_avg_speed = state["avg_speed"]
+        self.idle = state.get("idle", False)
+        self.free_dt = state.get("free_dt", 0.0)
+        self.boundary_dt = state.get("boundary_dt", 0.0)
+        self.busy_steps = state.get("busy_steps", 0)
+
+    def __getstate__(self):
+        # Do jiného procesu posíláme jen silnici samotnou, ne vazbu na hlavní proces.
+        state = self.__dict__.copy()
+        state.pop("remote", None)
+        state.pop("listeners", None) # Posluchači (řadiče) žijí v hlavním procesu
+        return state
+
+    def add_listener(self, listener):
+        # listener(silnice, vozidlo) se zavolá pro každé vozidlo, které na silnici vjede
+        # (i když silnice zrovna běží v jiném procesu - ohlásí se v hlavním).
+        if not self.listeners:
+            self.listeners = []
+        self.listeners.append(listener)
+
+    def add_vehicle(self, vehicle, notify=True):
+        # notify=False: vozidlo se jen vrací na silnici, ze které vyjelo (nečekalo na místo v síti)
+        if notify:
+            for listener in self.listeners:
+                listener(self, vehicle)
+            self.free_dt = 0.0 # Nové vozidlo - první krok s ním jde se základním dt
+        if self.remote is not None:
+            self.remote.add_vehicle(vehicle, notify) # Silnice běží v jiném procesu
+            return
+        # Vozidla jsou VŽDY seřazená podle pozice (vehicles[0] je nejzadnější auto).
+        # Nová auta vjíždějí na začátek silnice, takže je stačí přidat na začátek.
+        vehicles = self.vehicles
+        if not vehicles or vehicle.position < vehicles[0].position:
+            vehicles.appendleft(vehicle)
+        elif vehicle.position >= vehicles[-1].position:
+            vehicles.append(vehicle)
+        else:
+            bisect.insort_right(vehicles, vehicle, key=lambda v: v.position)
+        self._enter_zones(vehicle)
+
+    def tail_position(self):
+        # Pozice nejzadnějšího vozidla (None = prázdná silnice). Díky řazení je to vehicles[0].
+        if self.remote is not None:
+            return self.remote.tail
+        return self.vehicles[0].position if self.vehicles else None
+
+    def has_entry_space(self, min_position):
+        # Je na začátku silnice místo pro další vozidlo?
+        tail = self.tail_position()
+        return tail is None or tail >= min_position
 
     def add_traffic_light(self, light):
         self.traffic_lights.append(light)
+        # Prostorový index - semafory seřazené podle pozice
+        index = bisect.bisect_right(self._light_positions, light.position)
+        self._light_positions.insert(index, light.position)
+        self._lights_by_position.insert(index, light)
+        self._light_orders.insert(index, len(self.traffic_lights) - 1)
+        light.attach(self)
+        self.refresh_lights()
+
+    def refresh_lights(self):
+        # Pevné semafory (přepínají je řadiče) a semafory z kalendáře simulace se volat nemusí.
+        self._polled_lights = [light for light in self.traffic_lights
+                               if type(light).update is not TrafficLight.update
+                               and not getattr(light, "scheduled", False)]
+        # Prázdnou silnici jde přeskakovat, jen když žádný volaný semafor nepočítá čas
+        self._lights_idle = all(light.actuated for light in self._polled_lights)
+
+    def advance(self, dt):
+        # update(), které prázdnou silnici v klidu přeskočí (koleje bez vlaku, boční ulice v noci).
+        # Jeden prázdný krok ještě proběhne, aby chytré semafory zhasly zelenou. Probudí ji
+        # až nové vozidlo z generátoru nebo ze sítě. Vrací False, když se nic nepočítalo.
+        empty = self.vehicle_count() == 0
+        if empty and self.idle:
+            return False
+        self.idle = empty and self._lights_idle
+        self.update(dt)
+        return True
+
+    def advance_substeps(self, dt, base_dt, max_dt):
+        # Adaptivní krok: posune silnici o dt po vlastních krocích (celé násobky base_dt). Dokud
+        # vozidla jen jedou, stačí jeden dlouhý krok; jakmile některé s něčím interaguje, silnice
+        # jede po base_dt - jen ona, ostatní silnice tím nebrzdí.
+        # Vytížená silnice se na free_step znovu ptá až po BUSY_RECHECK krocích (ušetří půlku práce).
+        left = dt
+        while left > CALENDAR_EPSILON:
+            step = min(left, base_dt * max(1, int(self.free_dt / base_dt + CALENDAR_EPSILON)))
+            self.advance(step)
+            if self.busy_steps:
+                self.busy_steps -= 1
+            else:
+                self.free_dt = self.free_step(max_dt)
+                if self.free_dt < base_dt:
+                    self.busy_steps = BUSY_RECHECK
+            left -= step
+
+    def _waiting(self, vehicle, index):
+        # Stojí vozidlo na červenou (index = první semafor před ním)? Rozjede ho až přepnutí semaforu.
+        positions = self._light_positions
+        return index < len(positions) and positions[index] - vehicle.position < 10 and \
+            not self._lights_by_position[index].is_green
+
+    def free_step(self, max_dt):
+        # Nejdelší vlastní krok silnice (nejvýš max_dt), během kterého žádné vozidlo nedojede do dosahu
+        # červené (u zelené jen do 10 m, kde se kontroluje místo za křižovatkou) ani na bezpečnou
+        # vzdálenost k vozidlu před sebou - řidiči jen jedou a větší krok na tom nic nezmění. Stejně tak
+        # vozidla, která stojí na červenou nebo ve frontě za stojícím: rozjedou se, až přepne semafor
+        # (událost kalendáře) nebo se pohne vozidlo před nimi.
+        # Zrychlující vozidlo krok omezí tak, aby se jeho rychlost změnila nejvýš o SPEED_TOLERANCE
+        # maximálky. 0 = některé vozidlo právě s něčím interaguje (brzdí, rozjíždí se).
+        step = max_dt
+        positions = self._light_positions
+        rate = self.model.max_acceleration
+        for lane in getattr(self, "lanes", None) or (self.vehicles,):
+            leader = None
+            for vehicle in reversed(lane):
+                i = bisect.bisect_right(positions, vehicle.position)
+                if vehicle.stopped:
+                    queued = leader is not None and leader.stopped and vehicle.get_distance_to(leader) < 5.0
+                    if not (queued or self._waiting(vehicle, i)):
+                        return 0.0
+                    leader = vehicle
+                    continue
+                speed = vehicle.speed
+                acceleration = rate or vehicle.acceleration
+                if speed < vehicle.max_speed * (1.0 - SPEED_TOLERANCE) and acceleration > 0:
+                    step = min(step, SPEED_TOLERANCE * vehicle.max_speed / acceleration)
+                free = math.inf
+                if i < len(positions):
+                    reach = 10.0 if self._lights_by_position[i].is_green else LIGHT_RANGE
+                    free = positions[i] - vehicle.position - reach
+                if leader is not None:
+                    free = min(free, vehicle.get_distance_to(leader) - (speed * 2 + 5.0)) # Bezpečná vzdálenost ACC
+                if free <= 0:
+                    return 0.0
+                if speed > 0:
+                    step = min(step, free / speed)
+                leader = vehicle
+        return step
+
+    def boundary_step(self, max_dt):
+        # Za jak dlouho (nejvýš max_dt) může některé vozidlo dojet na hranici detekční zóny nebo
+        # v síti opustit silnici. Jen tyhle změny vidí zbytek světa (řadiče čtou zóny, síť předává
+        # vozidla), takže je globální krok simulace nesmí přeskočit. Počítá se s nejvyšší možnou
+        # rychlostí. Kolona stojící na červenou se nepočítá - rozjede ji až událost kalendáře.
+        bounds = self._zone_bounds
+        exits = self.routes is not None
+        if not bounds and not exits:
+            return max_dt
+        step = max_dt
+        for lane in getattr(self, "lanes", None) or (self.vehicles,):
+            leader = None # Vozidlo před námi, pokud čeká na červenou (přímo nebo ve frontě)
+            for vehicle in reversed(lane):
+                if vehicle.stopped:
+                    queued = leader is not None and vehicle.get_distance_to(leader) < 5.0
+                    if queued or self._waiting(vehicle, bisect.bisect_right(self._light_positions, vehicle.position)):
+                        leader = vehicle
+                        continue
+                leader = None
+                fastest = max(vehicle.speed, vehicle.max_speed)
+                if fastest <= 0:
+                    continue
+                distance = math.inf
+                i = bisect.bisect_right(bounds, vehicle.position)
+                if i < len(bounds):
+                    distance = bounds[i] - vehicle.position
+                if exits:
+                    distance = min(distance, self.length + vehicle.length - vehicle.position)
+                step = min(step, distance / fastest)
+        return step
+
+    def add_zone(self, zone):
+        # Zaregistruje detekční zónu. Od teď ji silnice průběžně aktualizuje.
+        self.zones.append(zone)
+        self._zone_members[zone] = set()
+        for bound in (zone.start, zone.end):
+            index = bisect.bisect_right(self._zone_bounds, bound)
+            self._zone_bounds.insert(index, bound)
+            self._zone_bound_owners.insert(index, zone)
+        self.rebuild_zones()
+        return zone
+
+    def rebuild_zones(self):
+        # Přepočítá obsazenost všech zón od nuly (např. po ručním přesunu vozidel).
+        for zone in self.zones:
+            members = {v for v in self.vehicles if zone.contains(v.position)}
+            self._zone_members[zone] = members
+            zone.count = len(members)
+
+    def vehicles_changed(self):
+        # Ohlášení ruční změny vozidel. Road čte přímo objekty, takže nic dělat nemusí.
+        pass
+
+    def _enter_zones(self, vehicle):
+        # Nové vozidlo na silnici - mohlo se objevit přímo v nějaké zóně.
+        for zone in self.zones:
+            if zone.contains(vehicle.position):
+                self._zone_members[zone].add(vehicle)
+                zone.count += 1
+
+    def _leave_zones(self, vehicle):
+        # Vozidlo opouští silnici - odebereme ho ze všech zón.
+        for zone in self.zones:
+            members = self._zone_members[zone]
+            if vehicle in members:
+                members.discard(vehicle)
+                zone.count -= 1
+
+    def _cross_zones(self, vehicle, old_position):
+        # Zjistí, jestli vozidlo při pohybu přejelo hranici nějaké zóny (událost vjezd/výjezd).
+        # Bez přejeté hranice se obsazenost zón změnit nemůže - to je běžný případ.
+        new_position = vehicle.position
+        lo, hi = (old_position, new_position) if old_position <= new_position else (new_position, old_position)
+        bounds = self._zone_bounds
+        i = bisect.bisect_left(bounds, lo)
+        if i == len(bounds) or bounds[i] > hi:
+            return
+        j = bisect.bisect_right(bounds, hi)
+        for zone in set(self._zone_bound_owners[i:j]):
+            members = self._zone_members[zone]
+            inside = zone.contains(new_position)
+            if inside and vehicle not in members:
+                members.add(vehicle)
+                zone.count += 1
+            elif not inside and vehicle in members:
+                members.discard(vehicle)
+                zone.count -= 1
+
+    def _lights_ahead(self, position):
+        # Vrátí semafory 0 až 100 m před danou pozicí (jen ty ovlivňují řidiče).
+        # Díky bisectu nezáleží na tom, kolik semaforů silnice celkem má.
+        positions = self._light_positions
+        i = bisect.bisect_right(positions, position) # První semafor PŘED autem
+        if i == len(positions) or positions[i] - position >= LIGHT_RANGE:
+            return ()
+        j = i + 1
+        while j < len(positions) and positions[j] - position < LIGHT_RANGE:
+            j += 1
+        lights = self._lights_by_position[i:j]
+        if len(lights) > 1:
+            # Více semaforů v dosahu - zachováme pořadí přidání, jako dřív (bez hledání v traffic_lights)
+            lights = [light for _, light in sorted(zip(self._light_orders[i:j], lights))]
+        return lights
 
     def update(self, dt):
+        prof = profiler.enabled
+        if prof: t = profiler.now()
+
         # 1. Aktualizace semaforů
-        for light in self.traffic_lights:
+        for light in self._polled_lights:
             light.update(dt, self.vehicles)
+        if prof: t = profiler.record("road.lights", t)
 
-        # DŮLEŽITÉ: Seřadíme vozidla podle pozice (od nejvzdálenějšího po nejbližší)
-        # Díky tomu přesně víme, že vehicles[i+1] je auto PŘED vehicles[i]
-        self.vehicles.sort(key=lambda v: v.position)
+        # 2. Pohyb vozidel
+        vehicles = self.vehicles
+        has_zones = bool(self.zones)
+        first_disorder = self.model.drive(self, vehicles, dt, has_zones)
+        if prof: t = profiler.record("road.vehicles", t)
 
-        # 2. Hlavní smyčka pro každé vozidlo
-        for i in range(len(self.vehicles)):
-            vehicle = self.vehicles[i]
+        if first_disorder is not None:
+            self._repair_order(first_disorder)
+        if prof: t = profiler.record("road.order", t)
+
+        # 3. Odstranění aut a aktualizace statistik
+        self._remove_finished(vehicles, has_zones)
+
+        # Výpočet průměrné rychlosti (pro statistiky)
+        if len(self.vehicles) > 0:
+            total_speed = sum(v.speed for v in self.vehicles)
+            self.stats_avg_speed = (total_speed / len(self.vehicles)) * 3.6 # Převod na km/h
+        else:
+            self.stats_avg_speed = 0.0
+        if prof: profiler.record("road.exit", t)
+
+    def _drive(self, vehicles, dt, has_zones):
+        # Jeden krok fyziky pro seřazený pruh vozidel (ACC, semafory, pohyb).
+        # Vrací index prvního vozidla, které předjelo vozidlo před sebou (None = pořadí sedí).
+        # DŮLEŽITÉ: Vozidla jsou seřazená podle pozice (od nejvzdálenějšího po nejbližší)
+        # Díky tomu přesně víme, že vehicles[i+1] je auto PŘED vehicles[i].
+        # Řazení se nepočítá každý krok znovu - jen se opraví, pokud se pořadí rozbije.
+        last_index = len(vehicles) - 1
+        first_disorder = None # Index prvního auta, které předjelo auto před sebou
+
+        # Hlavní smyčka pro každé vozidlo
+        for i in range(len(vehicles)):
+            vehicle = vehicles[i]
             should_stop = False
 
             # Vzdálenost od vozidla před námi
-            if i < len(self.vehicles) - 1:
+            if i < last_index:
                 vehicle_ahead_exists = True
-                vehicle_ahead = self.vehicles[i+1]
+                vehicle_ahead = vehicles[i+1]
                 gap = vehicle.get_distance_to(vehicle_ahead)
             else:
                 vehicle_ahead_exists = False
@@ -214,7 +1061,7 @@ class Road:
                     vehicle.accelerate(vehicle.acceleration, dt)
 
             # --- B) Reakce na semafory ---
-            for light in self.traffic_lights:
+            for light in self._lights_ahead(vehicle.position):
                 distance = light.position - vehicle.position
                 if 10 < distance < 100:
                     # Přibližujeme se k semaforu - můžeme začít brzdit
@@ -236,7 +1083,7 @@ class Road:
                         # Podíváme se na auto před námi
                         if vehicle_ahead_exists:
                             # Odhad šířky křižovatky + rezerva
-                            intersection_width = 60 + vehicle.get_length() # Základní šířka + délka našeho auta
+                            intersection_width = 60 + vehicle.length # Základní šířka + délka našeho auta
                             if gap < intersection_width and (vehicle_ahead.speed < 10.0 or (vehicle.speed > vehicle_ahead.speed and (vehicle_ahead.max_speed / vehicle_ahead.speed > 1.5 and vehicle_ahead.is_braking))):
                                 should_stop = True # I když je zelená, nemůžeme vjet!
 
@@ -281,25 +1128,722 @@ class Road:
                 if vehicle.current_wait <= 0:
                     vehicle.stopped = False
 
-            # 3. Aplikace pohybu
+            # --- E) Aplikace pohybu ---
             if vehicle.speed < 0:
                 vehicle.stop()
+            old_position = vehicle.position
             vehicle.move(dt)
+            if has_zones:
+                self._cross_zones(vehicle, old_position)
+
+            # Kontrola pořadí: auto za námi (už posunuté) nesmí být před námi
+            if i > 0 and first_disorder is None and vehicles[i-1].position > vehicle.position:
+                first_disorder = i
+        return first_disorder
+
+    def _remove_finished(self, vehicles, has_zones):
+        # Dojet mohou jen auta za koncem silnice, a ta jsou díky řazení na konci seznamu
+        # (odebíráme z konce - funguje pro deque silnice i pro seznamy pruhů)
+        beyond_end = []
+        while vehicles and vehicles[-1].position >= self.length:
+            beyond_end.append(vehicles.pop())
+        if beyond_end:
+            beyond_end.reverse()
+            for v in beyond_end:
+                if (v.position - v.length) >= self.length:
+                    self._exit(v)
+                    if has_zones:
+                        self._leave_zones(v)
+                else:
+                    vehicles.append(v) # Dlouhé vozidlo, které ještě nevyjelo celé
+
+    def _exit(self, vehicle):
+        # Vozidlo celé opustilo silnici. V síti pokračuje po trase na další silnici
+        # (předá se až na bariéře kroku, viz RoadNetwork.transfer), jinak dojelo do cíle.
+        if self.routes is not None:
+            next_road = self.routes.get(vehicle.destination)
+            if next_road is not None:
+                self.outbox.append((next_road, vehicle))
+                return
+        self.stats_cars_finished += 1 # Dojelo do cíle
+        event_log.emit(EVENT_EXIT, self, vehicle=type(vehicle).__name__)
+
+    def _repair_order(self, start, vehicles=None):
+        # Záložní oprava pořadí (insertion sort) - na téměř seřazeném seznamu je lineární.
+        # Je stabilní, takže auta na stejné pozici zůstanou v původním pořadí.
+        if vehicles is None:
+            vehicles = self.vehicles
+        for i in range(max(start, 1), len(vehicles)):
+            vehicle = vehicles[i]
+            j = i - 1
+            while j >= 0 and vehicles[j].position > vehicle.position:
+                vehicles[j + 1] = vehicles[j]
+                j -= 1
+            vehicles[j + 1] = vehicle
+
+
+class ArrayRoad(Road):
+    # Silnice, která drží stav vozidel v polích NumPy (Structure of Arrays).
+    # Fyzika je stejná jako v Road.update, jen se počítá najednou pro celou silnici.
+    # Objekty Car/Bus/Truck/Train zůstávají jako "pohledy": stav se do nich propíše
+    # až ve chvíli, kdy si o seznam road.vehicles někdo řekne (např. Visualizer).
+    # road.vehicles je jen ke čtení (n-tice), čtení tedy pole nezneplatní. Kdo vozidla
+    # upraví ručně, ohlásí to vehicles_changed() (nebo silnici přiřadí nový seznam).
+    def __init__(self, length, direction = 'H', start_x=0, start_y=0, reverse=False, road_type="road", model=None):
+        if np is None:
+            raise ImportError("ArrayRoad vyžaduje knihovnu numpy (pip install numpy)")
+        super().__init__(length, direction, start_x, start_y, reverse, road_type, model)
+
+    @property
+    def vehicles(self):
+        if self._views_stale:
+            self._push_views()
+        return tuple(self._views)
+
+    @vehicles.setter
+    def vehicles(self, value):
+        self._views = list(value)
+        self._views_stale = False # Objekty mají aktuální stav
+        self._arrays_stale = True # Pole je potřeba postavit znovu
+
+    def vehicles_changed(self):
+        # Vozidla se změnila mimo silnici (např. teleport v testu) -> při dalším update pole
+        # přestavíme z objektů.
+        self._arrays_stale = True
+
+    def _push_views(self):
+        # Propíše stav z polí do objektů vozidel (pohledů).
+        rows = zip(self._views, self._pos.tolist(), self._speed.tolist(), self._stopped.tolist(),
+                   self._braking.tolist(), self._wait.tolist())
+        for v, position, speed, stopped, braking, wait in rows:
+            v.position = position
+            v.speed = speed
+            v.stopped = stopped
+            v.is_braking = braking
+            v.current_wait = wait
+        self._views_stale = False
+
+    def _pull_arrays(self):
+        # Postaví pole ze stavu objektů (po add_vehicle nebo ruční změně vozidel).
+        vs = self._views
+        self._pos = np.array([v.position for v in vs], dtype=float)
+        self._speed = np.array([v.speed for v in vs], dtype=float)
+        self._max_speed = np.array([v.max_speed for v in vs], dtype=float)
+        self._acc = np.array([v.acceleration for v in vs], dtype=float)
+        self._length = np.array([v.length for v in vs], dtype=float)
+        self._stopped = np.array([v.stopped for v in vs], dtype=bool)
+        self._braking = np.array([v.is_braking for v in vs], dtype=bool)
+        self._wait = np.array([v.current_wait for v in vs], dtype=float)
+        self._start_delay = np.array([v.start_delay for v in vs], dtype=float)
+        self._can_stop = np.array([v.can_stop for v in vs], dtype=bool)
+        self._arrays_stale = False
+
+    def _columns(self):
+        return ("_pos", "_speed", "_max_speed", "_acc", "_length", "_stopped",
+                "_braking", "_wait", "_start_delay", "_can_stop")
+
+    def _row(self, v):
+        # Hodnoty jednoho vozidla ve stejném pořadí jako _columns().
+        return (v.position, v.speed, v.max_speed, v.acceleration, v.length, v.stopped,
+                v.is_braking, v.current_wait, v.start_delay, v.can_stop)
+
+    def add_vehicle(self, vehicle, notify=True):
+        if self.remote is not None:
+            super().add_vehicle(vehicle, notify) # Jen předá vozidlo pracovnímu procesu
+            return
+        if notify:
+            for listener in self.listeners:
+                listener(self, vehicle)
+            self.free_dt = 0.0
+        if self._arrays_stale:
+            # Aktuální stav mají objekty, pole se stejně postaví znovu
+            bisect.insort_right(self._views, vehicle, key=lambda v: v.position)
+        else:
+            # Vložíme rovnou do polí na správné místo (nové auto je typicky na začátku)
+            index = int(np.searchsorted(self._pos, vehicle.position, side="right"))
+            self._views.insert(index, vehicle)
+            for name, value in zip(self._columns(), self._row(vehicle)):
+                setattr(self, name, np.insert(getattr(self, name), index, value))
+        self.rebuild_zones()
+
+    def _enter_zones(self, vehicle):
+        pass # Zóny přepočítává rebuild_zones() najednou
+
+    def rebuild_zones(self):
+        # Počet vozidel v zóně = rozdíl dvou binárních hledání v seřazených pozicích.
+        if not self.zones:
+            return
+        if self._arrays_stale:
+            # Aktuální stav mají objekty - spočítáme to po staru
+            for zone in self.zones:
+                zone.count = sum(1 for v in self._views if zone.contains(v.position))
+            return
+        pos = self._pos
+        for zone in self.zones:
+            lo = np.searchsorted(pos, zone.start, side="left" if zone.include_start else "right")
+            hi = np.searchsorted(pos, zone.end, side="left")
+            zone.count = max(int(hi - lo), 0)
+
+    def vehicle_count(self):
+        return len(self._views)
+
+    def tail_position(self):
+        if self.remote is not None:
+            return super().tail_position()
+        if self._arrays_stale:
+            return self._views[0].position if self._views else None
+        return float(self._pos[0]) if len(self._pos) > 0 else None
+
+    def free_step(self, max_dt):
+        # Stejné pravidlo jako Road.free_step, jen nad poli najednou.
+        if self._arrays_stale:
+            return super().free_step(max_dt)
+        pos = self._pos
+        if len(pos) == 0:
+            return max_dt
+        speed = self._speed
+        free = np.full(len(pos), np.inf)
+        gap = pos[1:] - pos[:-1] - self._length[1:]
+        free[:-1] = gap - (speed[:-1] * 2 + 5.0)
+        waiting = np.zeros(len(pos), dtype=bool)
+        waiting[:-1] = self._stopped[1:] & (gap < 5.0) # Fronta za stojícím vozidlem
+        if self._light_positions:
+            lights = np.array(self._light_positions)
+            red = np.array([not light.is_green for light in self._lights_by_position])
+            index = np.searchsorted(lights, pos, side="right")
+            ahead = np.flatnonzero(index < len(lights))
+            distance = lights[index[ahead]] - pos[ahead]
+            light_red = red[index[ahead]]
+            free[ahead] = np.minimum(free[ahead], distance - np.where(light_red, LIGHT_RANGE, 10.0))
+            waiting[ahead] |= light_red & (distance < 10)
+        stopped = self._stopped
+        if np.any(stopped & ~waiting):
+            return 0.0
+        moving = ~stopped
+        if np.any(free[moving] <= 0):
+            return 0.0
+        step = max_dt
+        rate = self.model.max_acceleration or self._acc
+        accelerating = moving & (speed < self._max_speed * (1.0 - SPEED_TOLERANCE)) & (rate > 0)
+        if accelerating.any():
+            rate = np.broadcast_to(rate, speed.shape)
+            step = min(step, float(np.min(SPEED_TOLERANCE * self._max_speed[accelerating] / rate[accelerating])))
+        moving &= speed > 0
+        if not moving.any():
+            return step
+        return min(step, float(np.min(free[moving] / speed[moving])))
+
+    def boundary_step(self, max_dt):
+        # Stejné pravidlo jako Road.boundary_step, jen nad poli najednou.
+        exits = self.routes is not None
+        if self._arrays_stale or not (self._zone_bounds or exits):
+            return super().boundary_step(max_dt)
+        pos = self._pos
+        n = len(pos)
+        if n == 0:
+            return max_dt
+        distance = np.full(n, np.inf)
+        if self._zone_bounds:
+            bounds = np.array(self._zone_bounds)
+            index = np.searchsorted(bounds, pos, side="right")
+            ahead = index < len(bounds)
+            distance[ahead] = bounds[index[ahead]] - pos[ahead]
+        if exits:
+            distance = np.minimum(distance, self.length + self._length - pos)
+        # Kdo čeká na červenou: stojí u ní, nebo stojí ve frontě (do 5 m) za někým, kdo čeká
+        stopped = self._stopped
+        at_red = np.zeros(n, dtype=bool)
+        if self._light_positions:
+            lights = np.array(self._light_positions)
+            red = np.array([not light.is_green for light in self._lights_by_position])
+            index = np.searchsorted(lights, pos, side="right")
+            ahead = np.flatnonzero(index < len(lights))
+            at_red[ahead] = red[index[ahead]] & (lights[index[ahead]] - pos[ahead] < 10)
+        at_red &= stopped
+        linked = np.zeros(n, dtype=bool)
+        linked[:-1] = stopped[:-1] & (pos[1:] - pos[:-1] - self._length[1:] < 5.0)
+        # Konec fronty = první vozidlo vpředu, které už na další nenavazuje; čeká celá fronta,
+        # když v ní někdo stojí na červenou
+        ends = np.minimum.accumulate(np.where(linked, n - 1, np.arange(n))[::-1])[::-1]
+        reds = np.concatenate(([0], np.cumsum(at_red)))
+        waiting = stopped & (reds[ends + 1] - reds[np.arange(n)] > 0)
+        fastest = np.maximum(self._speed, self._max_speed)
+        check = ~waiting & (fastest > 0)
+        if not check.any():
+            return max_dt
+        return min(max_dt, float(np.min(distance[check] / fastest[check])))
+
+    def _select(self, index):
+        # Přeuspořádá / vyfiltruje všechna pole i seznam objektů najednou.
+        for name in self._columns():
+            setattr(self, name, getattr(self, name)[index])
+        if index.dtype == bool:
+            self._views = [v for v, keep in zip(self._views, index.tolist()) if keep]
+        else:
+            self._views = [self._views[i] for i in index.tolist()]
+
+    def update(self, dt):
+        prof = profiler.enabled
+        if prof: t = profiler.now()
+
+        # 1. Aktualizace semaforů (chytré semafory čtou auta přes detekční zóny)
+        for light in self._polled_lights:
+            light.update(dt, ())
+        if prof: t = profiler.record("road.lights", t)
+
+        if self._arrays_stale:
+            self._pull_arrays()
+            if prof: t = profiler.record("road.pull", t)
+
+        if len(self._pos) > 0:
+            self.model.drive_arrays(self, dt)
+        if prof: t = profiler.record("road.vehicles", t)
+
+        # Pořadí se opravuje jen tehdy, když ho někdo předjetím rozbil (stabilně, jako v Road)
+        pos = self._pos
+        if len(pos) > 1 and np.any(pos[1:] < pos[:-1]):
+            self._select(np.argsort(pos, kind="stable"))
+        if prof: t = profiler.record("road.order", t)
 
         # --- 4. Odstranění aut a aktualizace statistik ---
-        # Nejdřív zjistíme, kdo dojel
-        finished_cars = [v for v in self.vehicles if (v.position - v.get_length()) >= self.length]
-        self.stats_cars_finished += len(finished_cars)
-        
-        # Ponecháme jen auta, co jsou stále na silnici
-        self.vehicles = [v for v in self.vehicles if (v.position - v.get_length()) < self.length]
-        
-        # Výpočet průměrné rychlosti (pro statistiky)
-        if len(self.vehicles) > 0:
-            total_speed = sum(v.speed for v in self.vehicles)
-            self.stats_avg_speed = (total_speed / len(self.vehicles)) * 3.6 # Převod na km/h
+        finished = (self._pos - self._length) >= self.length
+        finished_count = int(np.count_nonzero(finished))
+        if finished_count:
+            for index in np.flatnonzero(finished).tolist():
+                v = self._views[index]
+                if self.routes is not None:
+                    # Vozidlo může pokračovat na další silnici - potřebuje aktuální stav z polí
+                    v.position, v.speed = float(self._pos[index]), float(self._speed[index])
+                    v.stopped, v.is_braking = bool(self._stopped[index]), bool(self._braking[index])
+                    v.current_wait = float(self._wait[index])
+                self._exit(v)
+            keep = len(finished) - finished_count
+            if finished[keep:].all():
+                # Běžný případ: dojela auta na čele silnice -> stačí je "uříznout"
+                for name in self._columns():
+                    setattr(self, name, getattr(self, name)[:keep])
+                del self._views[keep:]
+            else:
+                self._select(~finished)
+        self.rebuild_zones()
+
+        if len(self._pos) > 0:
+            # Sčítáme po jednom (jako sum() v Road), aby výsledek seděl na poslední bit
+            total_speed = sum(self._speed.tolist())
+            self.stats_avg_speed = (total_speed / len(self._pos)) * 3.6
         else:
             self.stats_avg_speed = 0.0
+        self._views_stale = True
+        if prof: profiler.record("road.exit", t)
+
+    def _step(self, dt):
+        # Vektorová verze hlavní smyčky z Road.update.
+        # Vozidlo i čte jen svůj stav a stav vozidla i+1 z minulého kroku,
+        # proto lze celou silnici spočítat najednou se stejným výsledkem.
+        pos = self._pos
+        speed = self._speed.copy()
+        max_speed = self._max_speed
+        length = self._length
+        n = len(pos)
+
+        # Vozidlo před námi (poslední vozidlo nikoho před sebou nemá)
+        has_ahead = np.arange(n) < n - 1
+        gap = np.full(n, 99999.0)
+        gap[:-1] = pos[1:] - pos[:-1] - length[1:]
+        ahead_speed = np.append(self._speed[1:], 0.0)
+        ahead_max = np.append(max_speed[1:], 0.0)
+        ahead_stopped = np.append(self._stopped[1:], False)
+        ahead_braking = np.append(self._braking[1:], False)
+
+        stopped = self._stopped.copy()
+        braking = self._braking.copy()
+        should_stop = np.zeros(n, dtype=bool)
+
+        # --- A) Resetování stavu a Akcelerace ---
+        moving = ~stopped
+        braking[moving] = False
+        accelerating = moving & (speed < max_speed)
+        faster = speed + self._acc * dt
+        faster = np.where(faster > max_speed, max_speed, faster)
+        speed = np.where(accelerating, faster, speed)
+
+        # --- B) Reakce na semafory ---
+        # Každý semafor ovlivní jen úsek vozidel 0-100 m před sebou - najdeme ho binárním
+        # hledáním v seřazených pozicích (pořadí semaforů zůstává jako v Road)
+        is_sorted = not np.any(pos[1:] < pos[:-1])
+        for light in self.traffic_lights:
+            if is_sorted:
+                lo = int(np.searchsorted(pos, light.position - 101.0, side="left"))
+                hi = int(np.searchsorted(pos, light.position, side="left"))
+                if lo == hi:
+                    continue
+                w = slice(lo, hi)
+            else:
+                w = slice(0, n)
+            distance = light.position - pos[w]
+            if not light.is_green:
+                approaching = (distance > 10) & (distance < 100)
+                if approaching.any():
+                    speed[w] = self._brake(speed[w], braking[w], approaching, distance, dt)
+            near = (distance > 0) & (distance < 10)
+            if not near.any():
+                continue
+            if not light.is_green:
+                should_stop[w] |= near
+            else:
+                # Anti-Gridlock: i na zelenou stojíme, pokud za křižovatkou není místo
+                a_speed = ahead_speed[w]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    ahead_is_blocking = (a_speed < 10.0) | (
+                        (speed[w] > a_speed) & (ahead_max[w] / a_speed > 1.5) & ahead_braking[w])
+                should_stop[w] |= near & has_ahead[w] & (gap[w] < 60 + length[w]) & ahead_is_blocking
+
+        # --- C) Reakce na vozidla (Adaptivní tempomat) ---
+        safe_distance = (speed * 2) + 5.0
+        too_close = has_ahead & (gap < safe_distance)
+        braking |= too_close
+        ahead_standing = ahead_stopped | (ahead_speed == 0)
+        should_stop |= too_close & ahead_standing & (gap < 5.0)
+        must_brake = too_close & ahead_standing & (gap >= 5.0)
+        if must_brake.any():
+            speed = self._brake(speed, braking, must_brake, gap, dt)
+        following = too_close & ~ahead_standing
+        speed = np.where(following, np.minimum(ahead_speed - 2, max_speed), speed)
+
+        # --- D) FINÁLNÍ ROZHODNUTÍ ---
+        wait = self._wait
+        stopping = should_stop & self._can_stop
+        stopped |= stopping
+        speed[stopping] = 0.0
+        wait = np.where(should_stop, self._start_delay, wait)
+
+        waiting = ~should_stop & stopped
+        wait = np.where(waiting, wait - dt, wait)
+        stopped &= ~(waiting & (wait <= 0))
+
+        # 3. Aplikace pohybu
+        negative = (speed < 0) & self._can_stop
+        stopped |= negative
+        speed[negative] = 0.0
+
+        self._pos = np.where(stopped, pos, pos + speed * dt)
+        self._speed = speed
+        self._stopped = stopped
+        self._braking = braking
+        self._wait = wait
+
+    def _brake(self, speed, braking, mask, distance, dt):
+        # Stejný výpočet jako Vehicle.brake s požadovaným zpomalením podle vzdálenosti.
+        time_to_brake = distance / np.maximum(speed, 0.1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            required_deceleration = speed / time_to_brake
+        braked = speed - required_deceleration * dt
+        braked = np.where(braked < 0, 0.0, braked)
+        braking |= mask
+        return np.where(mask, braked, speed)
+
+
+class MultiLaneRoad(Road):
+    # Silnice s několika pruhy v jednom směru. Každý pruh je samostatný seřazený seznam,
+    # fyzika (ACC, semafory) běží po pruzích stejně jako v Road.update. Řidiči mezi
+    # pruhy přejíždějí podle modelu MOBIL: pruh změní, když si polepší o víc než
+    # change_threshold a nový sledující přitom nemusí brzdit víc než safe_deceleration.
+    # Sousedy v cílovém pruhu hledáme bisectem v pozicích pruhu (O(log n) na vozidlo).
+    politeness = 0.3            # MOBIL: jak moc řidič bere ohled na ostatní (0 = sobec)
+    change_threshold = 0.2      # Minimální zisk zrychlení (m/s²), pro který se vyplatí měnit pruh
+    safe_deceleration = 4.0     # Nejprudší brzdění (m/s²), které smíme vnutit novému sledujícímu
+    max_deceleration = 9.0      # Odhad brzdění, když je mezera kritická
+    min_lane_gap = 2.0          # Minimální mezera (m) před i za vozidlem v cílovém pruhu
+    lane_change_interval = 0.5  # Jak často (s) řidiči změnu pruhu zvažují
+
+    def __init__(self, length, direction = 'H', start_x=0, start_y=0, reverse=False, road_type="road", lanes=2,
+                 model=None):
+        self.lane_count = lanes
+        self.lanes = [[] for _ in range(lanes)]
+        self.lane_timer = 0.0   # Čas od posledního rozhodování o změně pruhů
+        self.lane_side = 1      # Směr změn v příštím kole (+1 / -1, střídá se)
+        super().__init__(length, direction, start_x, start_y, reverse, road_type, model)
+
+    @property
+    def vehicles(self):
+        # Všechna vozidla ze všech pruhů seřazená podle pozice (seznam je nový při každém čtení).
+        # Pruhy už seřazené jsou, stačí je slít (při stejné pozici má přednost nižší pruh).
+        return list(heapq.merge(*self.lanes, key=lambda v: v.position))
+
+    @vehicles.setter
+    def vehicles(self, value):
+        # Rozdělí vozidla do pruhů podle vehicle.lane (mimo rozsah -> nejbližší pruh).
+        lanes = [[] for _ in range(self.lane_count)]
+        for v in sorted(value, key=lambda v: v.position):
+            v.lane = min(max(v.lane, 0), self.lane_count - 1)
+            lanes[v.lane].append(v)
+        self.lanes = lanes
+
+    def vehicle_count(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def get_state(self):
+        return dict(super().get_state(), lane_timer=self.lane_timer, lane_side=self.lane_side)
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.lane_timer = state["lane_timer"]
+        self.lane_side = state["lane_side"]
+
+    def add_vehicle(self, vehicle, notify=True):
+        if notify:
+            for listener in self.listeners:
+                listener(self, vehicle)
+            self.free_dt = 0.0 # Nové vozidlo - první krok s ním jde se základním dt
+        if self.remote is not None:
+            self.remote.add_vehicle(vehicle, notify) # Silnice běží v jiném procesu
+            return
+        # Nové vozidlo vjede do pruhu, kde je na začátku nejvíc místa
+        best, best_tail = 0, None
+        for index, lane in enumerate(self.lanes):
+            if not lane:
+                best = index
+                break
+            if best_tail is None or lane[0].position > best_tail:
+                best, best_tail = index, lane[0].position
+        vehicle.lane = best
+        lane = self.lanes[best]
+        if not lane or vehicle.position < lane[0].position:
+            lane.insert(0, vehicle)
+        else:
+            bisect.insort_right(lane, vehicle, key=lambda v: v.position)
+        self._enter_zones(vehicle)
+
+    def tail_position(self):
+        # Místo na vjezdu je tam, kde je ho nejvíc - rozhoduje nejvolnější pruh.
+        if self.remote is not None:
+            return self.remote.tail
+        tails = [lane[0].position for lane in self.lanes if lane]
+        if len(tails) < len(self.lanes):
+            return None # Některý pruh je prázdný
+        return max(tails)
+
+    def update(self, dt):
+        prof = profiler.enabled
+        if prof: t = profiler.now()
+
+        # 1. Aktualizace semaforů (chytré semafory čtou auta přes detekční zóny)
+        for light in self._polled_lights:
+            light.update(dt, ())
+        if prof: t = profiler.record("road.lights", t)
+
+        # 2. Pohyb vozidel - každý pruh zvlášť, vozidlo před námi je jen ve stejném pruhu
+        has_zones = bool(self.zones)
+        for lane in self.lanes:
+            first_disorder = self.model.drive(self, lane, dt, has_zones)
+            if first_disorder is not None:
+                self._repair_order(first_disorder, lane)
+        if prof: t = profiler.record("road.vehicles", t)
+
+        # 3. Změny pruhů (jen jednou za lane_change_interval)
+        self.lane_timer += dt
+        if self.lane_timer >= self.lane_change_interval:
+            self.lane_timer = 0.0
+            self._change_lanes()
+        if prof: t = profiler.record("road.lanes", t)
+
+        # 4. Odstranění aut a aktualizace statistik
+        total_speed = 0.0
+        count = 0
+        for lane in self.lanes:
+            self._remove_finished(lane, has_zones)
+            total_speed += sum(v.speed for v in lane)
+            count += len(lane)
+        self.stats_avg_speed = (total_speed / count) * 3.6 if count else 0.0
+        if prof: profiler.record("road.exit", t)
+
+    def estimate_acceleration(self, vehicle, leader):
+        # Odhad zrychlení vozidla za daným vozidlem vpředu podle stejných pravidel jako ACC
+        # (bezpečná vzdálenost 2 s + 5 m). MOBIL podle něj porovnává pruhy.
+        # Model, který umí vlastní odhad (IDM), má přednost.
+        model_estimate = self.model.estimate(vehicle, leader)
+        if model_estimate is not None:
+            return model_estimate
+        free = vehicle.acceleration if vehicle.speed < vehicle.max_speed else 0.0
+        if leader is None:
+            return free
+        gap = vehicle.get_distance_to(leader)
+        if gap <= self.min_lane_gap:
+            return -self.max_deceleration
+        if gap >= vehicle.max_speed * 2 + 5.0:
+            return free # Vozidlo vpředu nás neomezí ani při plné rychlosti
+        closing = vehicle.speed - leader.speed
+        if closing > 0 and gap < vehicle.speed * 2 + 5.0:
+            # Uvnitř bezpečné vzdálenosti: brzdění potřebné k vyrovnání rychlosti na délce mezery
+            return -min(self.max_deceleration, closing * closing / (2 * gap))
+        # Vozidlo vpředu nás omezuje - jeho rychlosti se přizpůsobíme zhruba za 2 s
+        return min(free, -closing / 2.0)
+
+    def _change_lanes(self):
+        # Jedno kolo rozhodování MOBIL. V jednom kole se jezdí jen jedním směrem (střídá se),
+        # takže do stejné mezery nemohou najet dvě vozidla z opačných stran.
+        side = self.lane_side
+        self.lane_side = -side
+        lanes = self.lanes
+        positions = [[v.position for v in lane] for lane in lanes] # Index sousedů pro bisect
+        estimate = self.estimate_acceleration
+        politeness = self.politeness
+        moves = []
+        for index, lane in enumerate(lanes):
+            target = index + side
+            if not 0 <= target < len(lanes):
+                continue
+            target_lane = lanes[target]
+            target_positions = positions[target]
+            last_index = len(lane) - 1
+            follower_moved = False # Rozhodnutí počítají s tím, že sledující zůstane na místě
+            for i, vehicle in enumerate(lane):
+                if follower_moved or vehicle.stopped or not vehicle.can_stop:
+                    follower_moved = False
+                    continue # Stojící vozidla (a vlaky) pruh nemění
+                # Sousedé v cílovém pruhu: první vozidlo před námi a poslední za námi
+                j = bisect.bisect_right(target_positions, vehicle.position)
+                new_leader = target_lane[j] if j < len(target_lane) else None
+                new_follower = target_lane[j - 1] if j > 0 else None
+
+                # Bezpečnost: mezera před i za námi a snesitelné brzdění nového sledujícího
+                if new_leader is not None and vehicle.get_distance_to(new_leader) < self.min_lane_gap:
+                    continue
+                if new_follower is not None:
+                    if new_follower.get_distance_to(vehicle) < self.min_lane_gap:
+                        continue
+                    follower_after = estimate(new_follower, vehicle)
+                    if follower_after < -self.safe_deceleration:
+                        continue
+
+                # Motivace: můj zisk + zdvořilost * (změna u nového a starého sledujícího)
+                leader = lane[i + 1] if i < last_index else None
+                gain = estimate(vehicle, new_leader) - estimate(vehicle, leader)
+                if new_follower is not None:
+                    gain += politeness * (follower_after - estimate(new_follower, new_leader))
+                if i > 0:
+                    follower = lane[i - 1]
+                    gain += politeness * (estimate(follower, leader) - estimate(follower, vehicle))
+                if gain > self.change_threshold:
+                    moves.append((vehicle, index, target))
+                    follower_moved = True
+
+        if not moves:
+            return
+        sources = set()
+        for vehicle, source, target in moves:
+            vehicle.lane = target
+            sources.add(source)
+            event_log.emit(EVENT_LANE_CHANGE, self, vehicle=type(vehicle).__name__, lane=target)
+        for source in sources:
+            lanes[source][:] = [v for v in lanes[source] if v.lane == source]
+        for vehicle, source, target in moves:
+            bisect.insort_right(lanes[target], vehicle, key=lambda v: v.position)
+
+
+class RoadNetwork:
+    # Síť silnic: silnice jsou hrany, křižovatky uzly (libovolné jméno - řetězec nebo číslo).
+    # Vozidlo s cílem (vehicle.destination) jede po nejkratší trase. Tabulky "další silnice
+    # k cíli" se spočítají jednou (Dijkstra) a každá silnice dostane tu pro svůj koncový uzel,
+    # takže rozhodnutí na konci silnice je jedno hledání ve slovníku.
+    # Vozidla se mezi silnicemi předávají až na bariéře kroku (transfer) - silnice tak
+    # v rámci kroku zůstávají nezávislé a můžou běžet paralelně.
+    entry_gap = 40.0 # Potřebné místo na začátku další silnice (jako u generátoru)
+
+    def __init__(self):
+        self.roads = []        # Silnice v síti (index = číslo v tabulkách tras)
+        self.ends = {}         # Silnice -> (počáteční uzel, koncový uzel)
+        self.nodes = []        # Uzly v pořadí přidání
+        self.exits = []        # Uzly, kde vozidla mohou síť opustit (cíle)
+        self.tables = {}       # Uzel -> {cíl: index další silnice}
+        self.handoffs = 0      # Počet předání mezi silnicemi
+        self._choices = {}     # Silnice -> možné cíle nových vozidel (cache)
+
+    def add_node(self, node, exit=False):
+        if node not in self.nodes:
+            self.nodes.append(node)
+        if exit and node not in self.exits:
+            self.exits.append(node)
+        return node
+
+    def connect(self, road, start, end):
+        # Přidá silnici vedoucí z uzlu start do uzlu end.
+        self.add_node(start)
+        self.add_node(end)
+        self.roads.append(road)
+        self.ends[road] = (start, end)
+        road.outbox = []
+        return road
+
+    def build_routes(self):
+        # Dijkstra od každého cíle po obrácených hranách (váha = délka silnice).
+        # Pro každý uzel tak známe první silnici nejkratší cesty do každého cíle.
+        incoming = {node: [] for node in self.nodes}
+        for index, road in enumerate(self.roads):
+            start, end = self.ends[road]
+            incoming[end].append((index, start))
+        tables = {node: {} for node in self.nodes}
+        for destination in self.nodes:
+            distance = {destination: 0.0}
+            heap = [(0.0, 0, destination)]
+            counter = 1 # Pořadí přidání rozhoduje shody (uzly se mezi sebou neporovnávají)
+            while heap:
+                d, _, node = heapq.heappop(heap)
+                if d > distance[node]:
+                    continue
+                for index, start in incoming[node]:
+                    candidate = d + self.roads[index].length
+                    if candidate < distance.get(start, float("inf")):
+                        distance[start] = candidate
+                        tables[start][destination] = index
+                        heapq.heappush(heap, (candidate, counter, start))
+                        counter += 1
+        self.tables = tables
+        for road in self.roads:
+            road.routes = tables[self.ends[road][1]]
+        self._choices = {}
+
+    def route(self, road, destination):
+        # Silnice, po kterých vozidlo z dané silnice pojede do cíle (včetně té první).
+        path = [road]
+        while road.routes is not None and destination in road.routes:
+            road = self.roads[road.routes[destination]]
+            path.append(road)
+        return path
+
+    def pick_destination(self, road, rng):
+        # Cíl pro nové vozidlo: náhodný z výjezdů dosažitelných z konce silnice (kromě toho,
+        # odkud vozidlo přijelo). rng je generátor náhody silnice (viz TrafficGenerator).
+        choices = self._choices.get(road)
+        if choices is None:
+            start, end = self.ends[road]
+            exits = self.exits or [node for node in self.nodes if not self.tables.get(node)]
+            choices = [node for node in exits if node != start and (node == end or node in road.routes)]
+            self._choices[road] = choices
+        return rng.choice(choices) if choices else None
+
+    def transfer(self):
+        # Předá vozidla, která v tomto kroku opustila silnici, na další silnici trasy.
+        # Když na začátku další silnice není místo, vozidlo zůstane stát tam, kde silnici opustilo
+        # (nikdy necouvne na vozidla za sebou), a zkusí to znovu - kolona se tak přirozeně šíří
+        # proti směru jízdy.
+        for road in self.roads:
+            if not road.outbox:
+                continue
+            outbox, road.outbox = road.outbox, []
+            for index, vehicle in outbox:
+                next_road = self.roads[index]
+                overshoot = vehicle.position - vehicle.length - road.length # Kus za koncem silnice
+                if next_road.has_entry_space(overshoot + self.entry_gap):
+                    vehicle.position = overshoot
+                    vehicle.direction = next_road.travel_direction()
+                    vehicle.lane = 0
+                    next_road.add_vehicle(vehicle)
+                    self.handoffs += 1
+                else:
+                    vehicle.stop()
+                    vehicle.current_wait = vehicle.start_delay
+                    road.add_vehicle(vehicle, notify=False) # Na silnici už jednou vjelo
 
 
 # --- 5. Mozek křižovatky ---
@@ -338,6 +1882,20 @@ class IntersectionController:
             if self.timer >= self.red_clearance:
                 self.change_state("H_GREEN")
 
+    def next_wakeup(self):
+        # Za kolik sekund se změní fáze - do té doby řadič nemusí nic dělat
+        if self.state in ("H_GREEN", "V_GREEN"):
+            return self.green_duration - self.timer
+        return self.red_clearance - self.timer
+
+    def get_state(self):
+        # Stav automatu pro snapshot (semafory si ukládají svůj stav samy).
+        return {"state": self.state, "timer": self.timer}
+
+    def set_state(self, state):
+        self.state = state["state"]
+        self.timer = state["timer"]
+
     def change_state(self, new_state):
         # Změna stavu a aktualizace semaforů
         self.state = new_state
@@ -369,6 +1927,10 @@ class SmartIntersectionController:
         self.timer = 0.0
         self.state = "H_GREEN" # Začínáme zelenou pro H
         
+        # Detekční zóny front - silnice je aktualizují, když auta přejedou jejich hranice
+        self.queue_zones = {}
+        self.prepare()
+        
         # Start
         self.set_lights(self.lights_h, True)
         self.set_lights(self.lights_v, False)
@@ -377,31 +1939,36 @@ class SmartIntersectionController:
         for l in lights:
             l.is_green = is_green
 
+    def prepare(self):
+        # Založí zóny front na všech silnicích, které už mají semafor.
+        # Volá se i před spuštěním paralelních procesů, aby zóny existovaly i v nich.
+        for road in self.roads_h + self.roads_v:
+            self._queue_zone(road)
+
+    def _queue_zone(self, road):
+        # Vrátí (případně vytvoří) zónu fronty 0 až 100 m před prvním semaforem silnice.
+        zone = self.queue_zones.get(road)
+        if zone is None and road.traffic_lights:
+            light_pos = road.traffic_lights[0].position
+            zone = road.add_zone(DetectionZone(light_pos - 100, light_pos))
+            self.queue_zones[road] = zone
+        return zone
+
     def count_queue(self, roads):
         # Spočítá, kolik aut čeká (nebo se blíží) ke křižovatce na daných silnicích.
+        # Počítadla zón průběžně aktualizují samy silnice, tady je jen sečteme.
         count = 0
         for road in roads:
-            # Hledáme semafor na této silnici
-            if not road.traffic_lights:
-                continue
-            
-            # Kde je semafor?
-            light_pos = road.traffic_lights[0].position
-            
-            # Počítáme auta, která jsou v zóně 0 až 100m před semaforem
-            for v in road.vehicles:
-                dist = light_pos - v.position
-                if 0 < dist < 100:
-                    count += 1
+            zone = self._queue_zone(road)
+            if zone is not None: # Silnice bez semaforu frontu nemá
+                count += zone.count
         return count
 
     def update(self, dt):
         self.timer += dt
         
         # --- LOGIKA STAVOVÉHO AUTOMATU ---
-        # Spočítáme fronty
-        queue_h = self.count_queue(self.roads_h) # Počet aut na horizontálních silnicích
-        queue_v = self.count_queue(self.roads_v) # Počet aut na vertikálních silnicích
+        # Fronty počítáme až ve chvíli, kdy se podle nich opravdu rozhoduje
         
         if self.state == "H_GREEN":
             # 1. Musíme dodržet minimální čas
@@ -414,10 +1981,12 @@ class SmartIntersectionController:
                 return
 
             # 3. CHYTRÉ ROZHODOVÁNÍ          
+            queue_h = self.count_queue(self.roads_h) # Počet aut na horizontálních silnicích
+            queue_v = self.count_queue(self.roads_v) # Počet aut na vertikálních silnicích
             # Pokud na červené čeká více aut než kolik jede na zelené, přepni.
             # Přidáme malý práh (+2), abychom nepřepínali zbytečně při rovnosti.
             if queue_v > queue_h + 2:
-                print(f"SMART: Přepínám na V (Fronta V:{queue_v} vs H:{queue_h})")
+                event_log.emit(EVENT_LIGHT, self, INFO, state="TO_VERTICAL", queue_h=queue_h, queue_v=queue_v)
                 self.change_state("TO_VERTICAL")
 
         elif self.state == "TO_VERTICAL":
@@ -431,14 +2000,37 @@ class SmartIntersectionController:
                 self.change_state("TO_HORIZONTAL")
                 return
             
+            queue_h = self.count_queue(self.roads_h)
+            queue_v = self.count_queue(self.roads_v)
             if queue_h > queue_v + 2:
-                print(f"SMART: Přepínám na H (Fronta H:{queue_h} vs V:{queue_v})")
+                event_log.emit(EVENT_LIGHT, self, INFO, state="TO_HORIZONTAL", queue_h=queue_h, queue_v=queue_v)
                 self.change_state("TO_HORIZONTAL")
 
         elif self.state == "TO_HORIZONTAL":
             if self.timer >= self.red_clearance:
                 self.change_state("H_GREEN")
 
+    def next_wakeup(self):
+        # Vyklízení a minimální zelená běží jen podle času. Potom se rozhoduje podle front,
+        # které se mění s každým krokem silnic - řadič se volá v každém kroku.
+        if self.state in ("TO_VERTICAL", "TO_HORIZONTAL"):
+            return self.red_clearance - self.timer
+        return max(self.min_green_time - self.timer, 0.0)
+
+    def horizon(self):
+        # Za kolik sekund vyprší maximální zelená (adaptivní krok ji nesmí přeskočit)
+        if self.state in ("H_GREEN", "V_GREEN"):
+            return max(self.max_green_time - self.timer, 0.0)
+        return None
+
+    def get_state(self):
+        # Stav automatu pro snapshot (semafory si ukládají svůj stav samy).
+        return {"state": self.state, "timer": self.timer}
+
+    def set_state(self, state):
+        self.state = state["state"]
+        self.timer = state["timer"]
+
     def change_state(self, new_state):
         # Změna stavu a aktualizace semaforů
         self.state = new_state
@@ -457,50 +2049,117 @@ class SmartIntersectionController:
 
 
 class RailwayController:
-    # Řídí železniční přejezd. Auta mají zelenou, dokud se neobjeví vlak.
+    # Řídí železniční přejezd. Auta mají zelenou, dokud se neblíží vlak.
+    # Příjezd vlaku se předpovídá z jeho pozice a rychlosti hned, jak vjede na kolej
+    # (koleje řadiči každé nové vozidlo ohlásí). Zavření a otevření se naplánují jako
+    # časové události do prioritní fronty (heap) - update() jen posune hodiny a vyřídí
+    # události, které už nastaly. Zavřeno je jen po dobu, kterou vyžaduje bezpečnost:
+    # od warning_time před příjezdem čela vlaku do clearance_time po odjezdu jeho konce.
+    # Pojistka: dokud je vlak v zóně u přejezdu (třeba zpomalil za pomalejším vlakem),
+    # přejezd se neotevře.
+    warning_time = 4.0      # Kolik sekund před příjezdem vlaku se zavírá
+    clearance_time = 1.0    # Kolik sekund po průjezdu konce vlaku se otevírá
+    guard_distance = 200.0  # Pojistná zóna před přejezdem (m), zasahuje i délku vlaku za něj
+    recheck_interval = 0.5  # Za jak dlouho zkusit otevřít znovu, když je v pojistné zóně vlak
+
     def __init__(self, tracks, crossing_lights, crossing_point):
         self.tracks = tracks           # Seznam kolejí
         self.crossing_lights = crossing_lights # Semafory na silnici před přejezdem
         self.crossing_point = crossing_point # Pozice přejezdu na silnici (v metrech)
         self.state = "OPEN"            # OPEN (auta jedou) / CLOSED (vlak jede)
         self.safety_timer = 0.0
-        
+        self.time = 0.0                # Hodiny řadiče (posouvá je update)
+        self.events = []               # Naplánované události (čas, pořadí, "close"/"open") - heap
+        self.event_seq = 0             # Pořadí událostí se stejným časem
+        self.trains_due = 0            # Vlaky, kvůli kterým je zavřeno (zavření proběhlo, otevření ne)
+        self.crossing_positions = {}   # Kolej -> pozice přejezdu na ní
+        self.zones = []                # Pojistné zóny (jedna na kolej)
+        for track in tracks:
+            # Pokud kolej vede "pozpátku" (reverse), musíme souřadnici otočit.
+            position = track.length - crossing_point if track.reverse else crossing_point
+            self.crossing_positions[track] = position
+            self.zones.append(track.add_zone(DetectionZone(position - self.guard_distance,
+                                                           position + Train.length)))
+            track.add_listener(self.vehicle_added)
+
         # Defaultně zelená pro auta
         self.set_lights(True)
+        # Vlaky, které už na kolejích jsou
+        for track in tracks:
+            for vehicle in track.vehicles:
+                self.vehicle_added(track, vehicle)
 
     def set_lights(self, is_green):
         for l in self.crossing_lights:
             l.is_green = is_green
 
+    def get_state(self):
+        # Stav přejezdu pro snapshot (včetně naplánovaných událostí).
+        return {"state": self.state, "safety_timer": self.safety_timer, "time": self.time,
+                "events": self.events, "event_seq": self.event_seq, "trains_due": self.trains_due}
+
+    def set_state(self, state):
+        self.state = state["state"]
+        self.safety_timer = state["safety_timer"]
+        self.time = state["time"]
+        self.events = [tuple(event) for event in state["events"]]
+        heapq.heapify(self.events)
+        self.event_seq = state["event_seq"]
+        self.trains_due = state["trains_due"]
+
+    def occupied(self):
+        # Je v některé pojistné zóně vlak? (jen přečte počítadla zón)
+        for zone in self.zones:
+            if zone.count:
+                return True
+        return False
+
+    def schedule(self, time, kind):
+        heapq.heappush(self.events, (time, self.event_seq, kind))
+        self.event_seq += 1
+
+    def horizon(self):
+        # Za kolik sekund má přejezd naplánovanou změnu (adaptivní krok ji nesmí přeskočit)
+        return self.events[0][0] - self.time if self.events else None
+
+    def vehicle_added(self, track, vehicle):
+        # Nový vlak na koleji: předpověď příjezdu za předpokladu stálé rychlosti.
+        # Zavíráme podle nejvyšší možné rychlosti (nejdřívější příjezd), otevíráme podle
+        # skutečné - kdyby vlak zpomalil, otevření podrží pojistná zóna.
+        distance = self.crossing_positions[track] - vehicle.position
+        if distance + vehicle.length < 0:
+            return # Vlak už je za přejezdem
+        fastest = max(vehicle.speed, vehicle.max_speed)
+        close_at = self.time + (distance / fastest if fastest > 0 else 0.0) - self.warning_time
+        if vehicle.speed > 0:
+            open_at = self.time + (distance + vehicle.length) / vehicle.speed + self.clearance_time
+        else:
+            open_at = close_at + self.recheck_interval
+        self.schedule(close_at, "close")
+        self.schedule(max(open_at, close_at), "open")
+
     def update(self, dt):
-        # 1. Detekce vlaku
-        train_approaching = False
-         
-        for track in self.tracks:
-            # Pokud kolej vede "pozpátku" (reverse), musíme souřadnici otočit.
-            if track.reverse:
-                current_crossing_pos = track.length - self.crossing_point
+        # Jen vyřídí události, jejichž čas už nastal (jinak nic nedělá).
+        self.time += dt
+        events = self.events
+        while events and events[0][0] <= self.time:
+            _, _, kind = heapq.heappop(events)
+            if kind == "close":
+                self.trains_due += 1
+                if self.state == "OPEN":
+                    event_log.emit(EVENT_CROSSING_CLOSE, self, INFO, crossing_point=self.crossing_point)
+                    self.state = "CLOSED"
+                    self.set_lights(False) # Červená pro auta
             else:
-                current_crossing_pos = self.crossing_point
-
-            # Detekční zóna se počítá pro každou kolej zvlášť
-            detection_zone_start = current_crossing_pos - 250 
-            detection_zone_end   = current_crossing_pos + 200 
-            
-            for v in track.vehicles:
-                if detection_zone_start < v.position < detection_zone_end:
-                    train_approaching = True
-
-        # 2. Stavový automat
-        if self.state == "OPEN":
-            if train_approaching:
-                print("PŘEJEZD: Pozor, vlak! Červená.")
-                self.state = "CLOSED"
-                self.set_lights(False) # Červená pro auta
-
-        elif self.state == "CLOSED":
-            if not train_approaching:
-                print("PŘEJEZD: Vlak projel. Zelená.")
+                self.trains_due -= 1
+                if self.trains_due > 0 or self.state == "OPEN":
+                    continue
+                if self.occupied():
+                    # Vlak ještě nepřejel (zpomalil) - zkusíme to znovu za chvíli
+                    self.trains_due += 1
+                    self.schedule(self.time + self.recheck_interval, "open")
+                    continue
+                event_log.emit(EVENT_CROSSING_OPEN, self, INFO, crossing_point=self.crossing_point)
                 self.state = "OPEN"
                 self.set_lights(True) # Zelená pro auta
 
@@ -508,86 +2167,613 @@ class RailwayController:
 # --- 6. GENERÁTOR DOPRAVY ---
 class TrafficGenerator:
     # Třída, která se stará o automatické generování dopravy.
-    def __init__(self, roads):
+    # Každá silnice má vlastní generátor náhodných čísel (random.Random) odvozený ze seedu,
+    # takže se stejným seedem vyjde stejná doprava - nezávisle na ostatních silnicích.
+    CAR_TYPES = [Car, Truck, Bus]     # Typy vozidel na silnici
+    CAR_WEIGHTS = [70, 20, 10]        # Jejich četnost v procentech
+    SPEEDS = {Car: (23, 27), Bus: (18, 22), Truck: (13, 17), Train: (35, 45)} # Rozmezí rychlostí v m/s
+
+    def __init__(self, roads, car_interval=(3.0, 7.0), train_interval=(45, 75), seed=None, batch_size=64,
+                 network=None):
         self.roads = roads # Seznam silnic
+        self.network = network               # Síť silnic - nová vozidla v ní dostanou cíl
+        self.car_interval = car_interval     # Rozmezí sekund mezi auty
+        self.train_interval = train_interval # Rozmezí sekund mezi vlaky
+        self.batch_size = batch_size         # Kolik vozidel se losuje najednou
+        self.reseed(seed)
         # Každá silnice bude mít svůj časovač
         self.timers = {road: 0.0 for road in roads}
         self.next_spawns = {road: 0.0 for road in roads}
 
+    def reseed(self, seed=None):
+        # Nové náhodné proudy pro všechny silnice (např. pro různé běhy z jednoho snapshotu).
+        if seed is None:
+            seed = random.getrandbits(64) # Bez seedu navážeme na globální random
+        self.seed = seed
+        # Seedy silnic odvodíme z hlavního seedu (v pořadí silnic)
+        master = random.Random(seed)
+        self.rngs = {road: random.Random(master.getrandbits(64)) for road in self.roads}
+        self.planned = {road: deque() for road in self.roads} # Předem vylosovaná vozidla
+
+    def get_state(self):
+        # Časovače, stavy generátorů náhody a vylosovaná vozidla (v pořadí silnic).
+        return {
+            "seed": self.seed,
+            "timers": [self.timers[road] for road in self.roads],
+            "next_spawns": [self.next_spawns[road] for road in self.roads],
+            "rngs": [self.rngs[road].getstate() for road in self.roads],
+            "planned": [[(t.__name__, speed, interval) for t, speed, interval in self.planned[road]]
+                        for road in self.roads],
+        }
+
+    def set_state(self, state):
+        self.seed = state["seed"]
+        for i, road in enumerate(self.roads):
+            self.timers[road] = state["timers"][i]
+            self.next_spawns[road] = state["next_spawns"][i]
+            version, internal, gauss = state["rngs"][i]
+            self.rngs[road].setstate((version, tuple(internal), gauss))
+            self.planned[road] = deque((VEHICLE_TYPES[name], speed, interval)
+                                       for name, speed, interval in state["planned"][i])
+
+    def predraw(self, road, count):
+        # Vylosuje dopředu count vozidel pro silnici. Vrací sloupce (typy, rychlosti, intervaly),
+        # kde interval je čas do dalšího vozidla po tomto.
+        rng = self.rngs[road]
+        if road.road_type == "rail":
+            # Pokud jsou to koleje, VŽDY generujeme vlak
+            types = [Train] * count
+            interval = self.train_interval # Vlaky jezdí zřídka (např. jednou za 45 až 75 sekund)
+        else:
+            # Jinak je to silnice -> generujeme auta (typy najednou jedním voláním)
+            types = rng.choices(self.CAR_TYPES, weights=self.CAR_WEIGHTS, k=count)
+            interval = self.car_interval   # Auta jezdí často (např. jednou za 3 až 7 sekund)
+        speeds = [rng.uniform(*self.SPEEDS[vehicle_type]) for vehicle_type in types]
+        intervals = [rng.uniform(*interval) for _ in range(count)]
+        return types, speeds, intervals
+
     def update(self, dt):
         for road in self.roads:
             self.timers[road] += dt
             if self.timers[road] >= self.next_spawns[road]:
-                if self.spawn_vehicle(road):
+                interval = self.spawn_vehicle(road)
+                if interval is not None:
                     self.timers[road] = 0.0
+                    self.next_spawns[road] = interval
 
-                    if road.road_type == "rail":
-                        # Vlaky jezdí zřídka (např. jednou za 45 až 75 sekund)
-                        self.next_spawns[road] = random.uniform(45, 75)
-                    else:
-                        # Auta jezdí často (např. jednou za 3 až 7 sekund)
-                        self.next_spawns[road] = random.uniform(3.0, 7.0)
+    def next_wakeup(self):
+        # Za kolik sekund má některá silnice vypustit vozidlo (0 = některá čeká, až bude na vjezdu místo)
+        if not self.roads:
+            return None
+        return min(self.next_spawns[road] - self.timers[road] for road in self.roads)
 
     def spawn_vehicle(self, road):
-        # Vytvoří náhodné vozidlo a přidá ho na silnici, pokud je volno.
+        # Přidá na silnici další vylosované vozidlo, pokud je volno.
+        # Vrací čas do dalšího vozidla, nebo None, když se vozidlo nevešlo.
         
         # 1. Kontrola místa
-        road.vehicles.sort(key=lambda v: v.position)
-        if len(road.vehicles) > 0:
-            if road.vehicles[0].position < 40.0:
-                return False 
+        if not road.has_entry_space(40.0):
+            return None
             
         # 2. Určení směru podle silnice
-        direction = DIR_RIGHT # Default
-        if road.direction == 'H':
-            # Pokud je silnice reverzní, jede doleva, jinak doprava
-            direction = DIR_LEFT if road.reverse else DIR_RIGHT
-        else:
-            # Pokud je silnice reverzní, jede nahoru, jinak dolů
-            direction = DIR_UP if road.reverse else DIR_DOWN
+        direction = road.travel_direction()
 
-        # 3. Výběr typu
-        if road.road_type == "rail":
-            # Pokud jsou to koleje, VŽDY generujeme vlak
-            vehicle_type = Train
-            speed = random.uniform(35, 45) # Rychlý vlak
+        # 3. Typ a rychlost z předem vylosované dávky
+        planned = self.planned[road]
+        if not planned:
+            planned.extend(zip(*self.predraw(road, self.batch_size)))
+        vehicle_type, speed, interval = planned.popleft()
 
-        else:
-            # Jinak je to silnice -> generujeme auta
-            vehicle_type = random.choices([Car, Truck, Bus], weights=[70, 20, 10], k=1)[0]
-            # 4. Rychlost
-            if vehicle_type == Car:
-                speed = random.uniform(23, 27)
-            elif vehicle_type == Bus:
-                speed = random.uniform(18, 22)
-            elif vehicle_type == Truck:
-                speed = random.uniform(13, 17)
-
-        # 5. Vytvoření
+        # 4. Vytvoření
         new_vehicle = vehicle_type(position=-10.0, speed=speed, direction=direction)
+        if self.network is not None and road.routes is not None:
+            new_vehicle.destination = self.network.pick_destination(road, self.rngs[road])
         road.add_vehicle(new_vehicle)
         
-        # Pro debug vypíšeme info
-        print(f"Generátor: Přidáno {vehicle_type.__name__} (Rychlost: {speed:.1f} m/s)")
-        return True
+        # Záznam do logu událostí (bez výpisu na konzoli)
+        event_log.emit(EVENT_SPAWN, road, vehicle=vehicle_type.__name__, speed=speed)
+        return interval
+
 
+# --- 7. SIMULACE (Bez grafiky) ---
+
+def _road_worker(conn):
+    # Pracovní proces: drží svou část silnic a na povel je posune o jeden krok.
+    roads = conn.recv() # {index: silnice}
+    event_log.sink = None # Do souboru zapisuje jen hlavní proces
+    while True:
+        command = conn.recv()
+        if command[0] == "step":
+            _, dt, inputs, base_dt, max_dt = command
+            replies = {}
+            for index, road in roads.items():
+                _apply_inputs(road, inputs[index])
+                before = event_log.total
+                if max_dt:
+                    road.advance_substeps(dt, base_dt, max_dt)
+                else:
+                    road.advance(dt)
+                replies[index] = _road_reply(road, event_log.latest(event_log.total - before), max_dt)
+            conn.send(replies)
+        elif command[0] == "sync":
+            # Vozidla předaná sítí v posledním kroku musí být ve staženém stavu taky
+            for index, road in roads.items():
+                _apply_inputs(road, command[1][index])
+            conn.send({index: list(road.vehicles) for index, road in roads.items()})
+        else: # "stop"
+            conn.close()
+            return
 
-# --- 7. VIZUALIZACE (Pygame) ---
+
+def _apply_inputs(road, inputs):
+    light_states, new_vehicles, new_zones = inputs
+    # 1. Stav semaforů, jak ho na konci minulého kroku nastavily řadiče
+    for light, is_green in zip(road.traffic_lights, light_states):
+        light.is_green = is_green
+    for zone in new_zones: # Zóny, které v hlavním procesu přibyly až za běhu
+        road.add_zone(zone)
+    # 2. Nová vozidla z generátoru a ze sítě
+    for vehicle, notify in new_vehicles:
+        road.add_vehicle(vehicle, notify)
+
+
+def _road_reply(road, events, max_dt=None):
+    # Co hlavní proces potřebuje po každém kroku: semafory, zóny, statistiky, místo na vjezdu, události
+    # a při adaptivním kroku i to, za jak dlouho se změna silnice projeví navenek.
+    # Vozidla se neposílají vůbec - i vlaky u přejezdů hlídají zóny kolejí.
+    # Zdroj události nahradíme odkazem (-1 = silnice, jinak index semaforu), objekty neposíláme
+    events = [(level, kind, -1 if source is road else road.traffic_lights.index(source), data)
+              for _, level, kind, source, data in events]
+    # Vozidla, která silnici opustila a pokračují v síti, předá až hlavní proces
+    outbox = road.outbox
+    if outbox:
+        road.outbox = []
+    return (tuple(light.is_green for light in road.traffic_lights),
+            tuple(zone.count for zone in road.zones),
+            road.stats_cars_finished, road.stats_avg_speed,
+            road.tail_position(), events, outbox, road.boundary_step(max_dt) if max_dt else 0.0)
+
+
+class RemoteRoad:
+    # Zástupce silnice v hlavním procesu, zatímco silnici počítá pracovní proces.
+    def __init__(self, tail, zones_sent):
+        self.tail = tail              # Pozice nejzadnějšího vozidla (pro kontrolu místa na vjezdu)
+        self.new_vehicles = []        # (vozidlo, notify) z generátoru a sítě, pošleme je s dalším krokem
+        self.zones_sent = zones_sent  # Kolik zón silnice už pracovní proces zná
+
+    def add_vehicle(self, vehicle, notify=True):
+        self.new_vehicles.append((vehicle, notify))
+        if self.tail is None or vehicle.position < self.tail:
+            self.tail = vehicle.position
+
+
+class ParallelStepper:
+    # Posouvá silnice paralelně v několika procesech.
+    # Silnice jsou v rámci jednoho kroku nezávislé - propojují je jen semafory, které
+    # nastavují řadiče. Proto: všechny procesy posunou své silnice (bariéra), hlavní proces
+    # převezme semafory, zóny a statistiky, řadiče rozhodnou a nové stavy semaforů
+    # se pošlou s dalším krokem. Výsledek je bit po bitu stejný jako při sériovém běhu.
+    def __init__(self, roads, workers):
+        self.roads = roads
+        self.workers = max(1, min(workers, len(roads)))
+        self.connections = []
+        self.processes = []
+        self.partitions = []
+
+    def start(self):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        for w in range(self.workers):
+            indices = list(range(w, len(self.roads), self.workers)) # Rozdělení po jedné silnici
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_road_worker, args=(child_conn,), daemon=True)
+            process.start()
+            parent_conn.send({i: self.roads[i] for i in indices})
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+            self.partitions.append(indices)
+        for road in self.roads:
+            road.remote = RemoteRoad(road.tail_position(), len(road.zones))
+
+    def _inputs(self, indices):
+        # Co procesu chybí od minula: semafory od řadičů, nová vozidla a nové zóny.
+        inputs = {}
+        for i in indices:
+            road = self.roads[i]
+            remote = road.remote
+            inputs[i] = (tuple(light.is_green for light in road.traffic_lights), remote.new_vehicles,
+                         road.zones[remote.zones_sent:])
+            remote.new_vehicles = []
+            remote.zones_sent = len(road.zones)
+        return inputs
+
+    def step(self, dt, base_dt=None, max_dt=None):
+        # 1. Rozeslat povel všem procesům (semafory od řadičů + nová vozidla)
+        for conn, indices in zip(self.connections, self.partitions):
+            conn.send(("step", dt, self._inputs(indices), base_dt, max_dt))
+
+        # 2. Bariéra - počkáme na všechny a převezmeme konzistentní stav
+        for conn in self.connections:
+            for i, reply in conn.recv().items():
+                self._apply_reply(self.roads[i], reply)
+
+    def _apply_reply(self, road, reply):
+        light_states, zone_counts, finished, avg_speed, tail, events, outbox, boundary_dt = reply
+        road.boundary_dt = boundary_dt
+        for light, is_green in zip(road.traffic_lights, light_states):
+            light.is_green = is_green
+        for zone, count in zip(road.zones, zone_counts):
+            zone.count = count
+        road.stats_cars_finished = finished
+        road.stats_avg_speed = avg_speed
+        road.remote.tail = tail
+        if outbox:
+            road.outbox.extend(outbox)
+        for level, kind, source, data in events:
+            event_log.emit(kind, road if source < 0 else road.traffic_lights[source], level, **data)
+
+    def sync(self):
+        # Stáhne aktuální vozidla ze všech procesů (pro vykreslení a statistiky).
+        # Jsou to kopie - změny v nich se do pracovních procesů nepropíšou.
+        # Vozidla čekající na další krok (např. předaná sítí po bariéře) pošleme napřed,
+        # jinak by ve staženém stavu chyběla a po close() by se ztratila úplně.
+        for conn, indices in zip(self.connections, self.partitions):
+            conn.send(("sync", self._inputs(indices)))
+        for conn in self.connections:
+            for i, vehicles in conn.recv().items():
+                self.roads[i].vehicles = vehicles
+
+    def close(self):
+        # Ukončí procesy. Silnice v hlavním procesu dostanou poslední stav a jedou dál sériově.
+        if not self.processes:
+            return
+        self.sync()
+        for conn in self.connections:
+            conn.send(("stop",))
+        for process in self.processes:
+            process.join()
+        for road in self.roads:
+            road.remote = None
+            road.free_dt = 0.0 # Vlastní krok silnice zná jen pracovní proces - začneme základním
+            road.busy_steps = 0
+            road.rebuild_zones()
+        self.connections, self.processes, self.partitions = [], [], []
+
+
+PHASE_GENERATOR, PHASE_LIGHTS, PHASE_CONTROLLERS = 0, 1, 2 # Kdy v kroku se komponenta kalendáře volá
+CALENDAR_EPSILON = 1e-9 # Tolerance pro součty kroků v plovoucí čárce
+
+
+class CalendarEntry:
+    # Jedna komponenta v kalendáři: co zavolat, kdy naposledy běžela a kdy se má probudit.
+    __slots__ = ("update", "next_wakeup", "horizon", "phase", "last", "delay", "wake", "seq")
+
+    def __init__(self, update, next_wakeup, phase, now, horizon=None):
+        self.update = update           # update(uplynulý čas)
+        self.next_wakeup = next_wakeup # Za kolik sekund je komponenta potřeba (None = nikdy)
+        self.horizon = horizon         # Volá-li se v každém kroku: za kolik sekund má vlastní událost
+        self.phase = phase
+        self.last = now                # Čas, do kterého je komponenta dopočítaná
+        self.delay = 0.0
+        self.wake = None
+        self.seq = 0                   # Pořadí posledního naplánování
+
+
+class EventCalendar:
+    # Kalendář událostí (halda podle simulovaného času) pro řadiče, časové semafory a generátor.
+    # Komponenta řekne, za kolik sekund ji něco čeká, a simulace ji zavolá až v kroku, kdy ten čas
+    # nastane - s celým uplynulým časem najednou. Mezi tím nestojí nic, ani volání metody.
+    # Zpoždění 0 znamená "v každém kroku" (např. chytrý řadič, který sleduje fronty) - takové
+    # komponenty nejdou do haldy, ale do seznamu své fáze.
+    def __init__(self):
+        self.entries = []
+        self.heaps = ([], [], [])      # Jedna halda na fázi kroku
+        self.every_step = [[], [], []] # Komponenty, které se volají v každém kroku
+        self.seq = 0                   # Pořadí naplánování (při stejném čase rozhoduje)
+
+    def add(self, update, next_wakeup, phase, now=0.0, horizon=None):
+        entry = CalendarEntry(update, next_wakeup, phase, now, horizon)
+        self.entries.append(entry)
+        self.schedule(entry, now)
+        return entry
+
+    def schedule(self, entry, now):
+        delay = entry.next_wakeup()
+        if delay is None:
+            entry.wake = None
+            return
+        entry.delay = max(delay, 0.0)
+        entry.wake = now + entry.delay
+        self.seq += 1
+        entry.seq = self.seq
+        if entry.delay == 0.0:
+            self.every_step[entry.phase].append(entry)
+            return
+        heapq.heappush(self.heaps[entry.phase], (entry.wake, self.seq, entry))
+
+    def run_due(self, phase, end_time):
+        # Zavolá komponenty dané fáze, jejichž čas nastane do konce kroku end_time. Vrací jejich počet.
+        heap = self.heaps[phase]
+        limit = end_time + CALENDAR_EPSILON
+        woken = self.every_step[phase]
+        self.every_step[phase] = []
+        for entry in woken:
+            entry.update(end_time - entry.last)
+            entry.last = end_time
+        while heap and heap[0][0] <= limit:
+            entry = heapq.heappop(heap)[2]
+            # Skutečně uplynulý čas - kdyby po zaokrouhlení chyběl zlomek, komponenta si řekne o další krok
+            entry.update(end_time - entry.last)
+            entry.last = end_time
+            woken.append(entry)
+        for entry in woken: # Až po průchodu, aby se komponenta se zpožděním 0 nevolala dvakrát
+            self.schedule(entry, end_time)
+        return len(woken)
+
+    def next_time(self):
+        # Nejbližší čas, kdy se má něco probudit (None = nic není naplánováno). Komponenty volané
+        # v každém kroku se počítají jen vlastní událostí (horizon), jinak by to byl vždy příští krok.
+        times = [heap[0][0] for heap in self.heaps if heap]
+        for entries in self.every_step:
+            for entry in entries:
+                horizon = entry.horizon() if entry.horizon is not None else None
+                if horizon is not None:
+                    times.append(entry.last + horizon)
+        return min(times) if times else None
+
+    def get_state(self):
+        # Do kdy je která komponenta dopočítaná a v jakém pořadí byla naplánovaná. Stav komponent
+        # samotných (get_state) odpovídá jejich času last, ne času simulace.
+        return [[entry.last, entry.seq] for entry in self.entries]
+
+    def set_state(self, state):
+        # Naplánuje komponenty znovu od jejich uložených časů. Plánuje se v původním pořadí,
+        # aby komponenty probuzené ve stejném čase běžely ve stejném pořadí jako předtím.
+        self.heaps = tuple([] for _ in self.heaps)
+        self.every_step = [[] for _ in self.every_step]
+        for entry, (last, seq) in sorted(zip(self.entries, state), key=lambda item: item[1][1]):
+            entry.last = last
+            self.schedule(entry, last)
+
+
+class Simulation:
+    # Celý svět simulace: silnice, generátor dopravy a všechny řadiče.
+    # Krokuje s pevným dt tak rychle, jak to procesor zvládne, a pygame vůbec nepotřebuje.
+    # S workers > 1 se silnice v každém kroku počítají paralelně ve více procesech.
+    def __init__(self, roads, generator=None, controllers=None, dt=0.016, workers=1, network=None, max_dt=None):
+        self.roads = roads                          # Seznam silnic a kolejí
+        self.generator = generator                  # Generátor dopravy (může chybět)
+        self.controllers = list(controllers or [])  # Řadiče křižovatek a přejezdů
+        self.network = network                      # Síť silnic s trasami (může chybět)
+        if network is not None:
+            network.build_routes()
+        self.dt = dt                                # Pevný krok simulace v sekundách
+        self.max_dt = max_dt                        # Adaptivní krok až do max_dt (None = vždy dt)
+        self.time = 0.0                             # Uplynulý simulovaný čas
+        self.ticks = 0                              # Počet provedených kroků
+        self.visualizer = None
+        self.recorder = None                        # TrajectoryRecorder (volitelný)
+        self.workers = workers                      # Počet procesů pro silnice
+        self.stepper = None                         # ParallelStepper (spustí se při prvním kroku)
+        self._synced_tick = -1                      # Krok, ke kterému jsou vozidla stažená
+        # Řadiče, časové semafory a generátor se volají jen tehdy, když je čeká změna
+        self.calendar = EventCalendar()
+        if self.generator:
+            self._schedule(self.generator.update, self.generator, PHASE_GENERATOR)
+        for road in roads:
+            for light in road.traffic_lights:
+                if hasattr(light, "tick"):
+                    light.scheduled = True # Silnice ho přeskočí, přepíná ho kalendář
+                    self._schedule(light.tick, light, PHASE_LIGHTS)
+            road.refresh_lights()
+        for controller in self.controllers:
+            self._schedule(controller.update, controller, PHASE_CONTROLLERS)
+
+    def _schedule(self, update, component, phase):
+        # Komponenta bez next_wakeup (např. přejezd s vlastním plánem) se volá v každém kroku.
+        next_wakeup = getattr(component, "next_wakeup", None) or (lambda: 0.0)
+        self.calendar.add(update, next_wakeup, phase, self.time, getattr(component, "horizon", None))
+
+    def add_controller(self, controller):
+        self.controllers.append(controller)
+        self._schedule(controller.update, controller, PHASE_CONTROLLERS)
+
+    def next_dt(self):
+        # Adaptivní krok: co nejdelší celý násobek dt (do max_dt), který nepřeskočí událost
+        # z kalendáře, snímek záznamu ani chvíli, kdy by se změna některé silnice projevila navenek
+        # (vozidlo na hranici zóny nebo na konci silnice v síti, viz Road.boundary_step).
+        # Co se děje uvnitř silnice, si každá silnice rozdělí na vlastní kroky (advance_substeps).
+        # Řadiče tak vidí zóny a síť předává vozidla ve stejném základním kroku jako při pevném dt
+        # (vozidlo, které na silnici přibylo během kroku, se započítá až od dalšího kroku).
+        dt = self.max_dt
+        next_time = self.calendar.next_time()
+        if next_time is not None:
+            dt = min(dt, next_time - self.time)
+        if self.recorder is not None: # Snímek záznamu má být v plánovaném čase, ne o krok později
+            dt = min(dt, self.recorder.next_time - self.time)
+        for road in self.roads:
+            if dt <= self.dt:
+                break
+            dt = min(dt, road.boundary_dt)
+        return self.dt * max(1, int(dt / self.dt + CALENDAR_EPSILON))
+
+    def step(self, dt=None):
+        # Jeden krok simulace - stejné pořadí, jaké měl dřív Visualizer.run.
+        if dt is None:
+            dt = self.next_dt() if self.max_dt else self.dt
+        prof = profiler.enabled
+        if prof: start = t = profiler.now()
+        event_log.time = self.time # Události tohoto kroku dostanou jeho čas
+        end_time = self.time + dt
+        self.calendar.run_due(PHASE_GENERATOR, end_time)
+        if prof: t = profiler.record("sim.generator", t)
+        # Časové semafory přepnou dřív, než se pohnou silnice (dřív to dělala silnice sama)
+        self.calendar.run_due(PHASE_LIGHTS, end_time)
+
+        if self.workers > 1:
+            if self.stepper is None:
+                for controller in self.controllers:
+                    prepare = getattr(controller, "prepare", None)
+                    if prepare is not None:
+                        prepare()
+                self.stepper = ParallelStepper(self.roads, self.workers)
+                self.stepper.start()
+            self.stepper.step(dt, self.dt, self.max_dt)
+        elif self.max_dt:
+            for road in self.roads:
+                road.advance_substeps(dt, self.dt, self.max_dt)
+                road.boundary_dt = road.boundary_step(self.max_dt)
+        else:
+            for road in self.roads:
+                road.advance(dt)
+        if prof: t = profiler.record("sim.roads", t)
+
+        # Bariéra: vozidla z konců silnic přejedou na další silnice svých tras
+        if self.network is not None:
+            self.network.transfer()
+            if prof: t = profiler.record("sim.network", t)
+
+        self.calendar.run_due(PHASE_CONTROLLERS, end_time)
+        if prof: t = profiler.record("sim.controllers", t)
+
+        self.time = end_time
+        self.ticks += 1
+        if self.recorder is not None and self.recorder.due(self):
+            self.recorder.sample(self)
+            if prof: profiler.record("sim.recorder", t)
+        if prof: profiler.record("sim.step", start)
+
+    def run(self, seconds):
+        # Odsimuluje zadaný počet sekund bez vykreslování a vrátí statistiky.
+        steps = int(round(seconds / self.dt))
+        if self.max_dt:
+            # Adaptivní kroky jsou celé násobky dt - odsimuluje se přesně stejný počet základních kroků
+            while steps > 0:
+                ticks = min(int(round(self.next_dt() / self.dt)), steps)
+                self.step(ticks * self.dt)
+                steps -= ticks
+            return self.stats()
+        for _ in range(steps):
+            self.step()
+        return self.stats()
+
+    def sync(self):
+        # Při paralelním běhu stáhne aktuální vozidla z pracovních procesů (jednou za krok).
+        if self.stepper is not None and self._synced_tick != self.ticks:
+            self.stepper.sync()
+            self._synced_tick = self.ticks
+
+    def close(self):
+        # Ukončí pracovní procesy (simulace pak může pokračovat sériově) a dopíše události a záznam.
+        event_log.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.stepper is not None:
+            self.stepper.close()
+            self.stepper = None
+            self.workers = 1
+
+    def stats(self):
+        # Souhrnné statistiky ze všech silnic (stejné hodnoty ukazuje panel ve Visualizeru).
+        self.sync()
+        total_cars = sum(len(r.vehicles) for r in self.roads)
+        total_finished = sum(r.stats_cars_finished for r in self.roads)
+        all_speeds = [v.speed for r in self.roads for v in r.vehicles]
+        if len(all_speeds) > 0:
+            avg_speed = (sum(all_speeds) / len(all_speeds)) * 3.6 # Převod m/s -> km/h
+        else:
+            avg_speed = 0.0
+        return {
+            "time": self.time,
+            "ticks": self.ticks,
+            "cars_on_road": total_cars,
+            "cars_finished": total_finished,
+            "avg_speed": avg_speed,
+        }
+
+    def attach_recorder(self, path, interval=1.0, chunk_rows=65536):
+        # Začne zaznamenávat trajektorie vozidel do adresáře path (viz TrajectoryRecorder).
+        self.recorder = TrajectoryRecorder(path, self, interval, chunk_rows)
+        return self.recorder
+
+    def save_snapshot(self, path):
+        # Uloží stav do souboru (viz save_snapshot).
+        save_snapshot(self, path)
+
+    def load_snapshot(self, path):
+        # Pokračuje ze stavu uloženého v souboru (viz load_snapshot).
+        load_snapshot(self, path)
+
+    def attach_visualizer(self, width=1000, height=700, time_scale=1.0):
+        # Teprve tady se načte pygame a otevře okno.
+        self.visualizer = Visualizer(self.roads, self.generator, width, height, simulation=self,
+                                     time_scale=time_scale)
+        return self.visualizer
+
+
+class SimulationClock:
+    # Převádí reálný čas na kroky simulace s pevným dt (akumulátor).
+    # Fyzika tak nezávisí na FPS: za jeden snímek proběhne tolik kroků, kolik
+    # odpovídá uplynulému času krát zrychlení (time_scale).
+    def __init__(self, simulation, time_scale=1.0, max_steps=2000):
+        self.simulation = simulation
+        self.time_scale = time_scale  # 1 = reálný čas, 10 = desetkrát rychleji...
+        self.max_steps = max_steps    # Strop kroků na jeden snímek
+        self.accumulator = 0.0        # Simulovaný čas, který ještě čeká na odkrokování
+        self.paused = False
+
+    @property
+    def behind(self):
+        # Simulace nestihla dohnat reálný čas (zbyl aspoň jeden celý krok)
+        return self.accumulator >= self.simulation.dt
+
+    def advance(self, real_dt):
+        # Přidá uplynulý reálný čas a odkrokuje, co se dá. Vrací počet kroků.
+        if self.paused:
+            return 0
+        dt = self.simulation.dt
+        self.accumulator += real_dt * self.time_scale
+        steps = min(int(self.accumulator / dt), self.max_steps)
+        for _ in range(steps):
+            self.simulation.step(dt) # V okně vždy pevný krok, i když má simulace adaptivní
+        self.accumulator -= steps * dt
+        # Když simulace dlouhodobě nestíhá, zbytek zahodíme - jinak by dluh rostl donekonečna
+        self.accumulator = min(self.accumulator, self.max_steps * dt)
+        return steps
+
+
+# --- 8. VIZUALIZACE (Pygame) ---
 
 class Visualizer:
-    def __init__(self, roads, generator=None, width=1000, height=700):
+    def __init__(self, roads, generator=None, width=1000, height=700, simulation=None, time_scale=1.0, fps=60):
         self.roads = roads # Seznam silnic
         self.generator = generator
         self.width = width
         self.height = height
         self.scale = 1.0 
+        # Vizualizace jen vykresluje - krokování světa obstarává Simulation
+        self.simulation = simulation or Simulation(roads, generator)
+        self.sim_clock = SimulationClock(self.simulation, time_scale) # Kroky simulace podle reálného času
+        self.fps = fps                # Cílový počet snímků za sekundu
+        self.max_frame_skip = 5       # Kolik snímků po sobě smíme vynechat, když simulace nestíhá
+        self.show_profile = False     # Panel s délkami fází (klávesa P)
+
+        # Statické vrstvy (silnice, koleje, tunely) se kreslí jen jednou a pak se kopírují
+        self.background = None        # Podklad pod vozidly
+        self.overlay = None           # Tunely nad vozidly (průhledná vrstva)
+        self.static_key = None        # Podoba sítě, ze které vrstvy vznikly
         
+        _load_pygame()
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height))
         self.clock = pygame.time.Clock()
         self.font = pygame.font.SysFont("Arial", 16)
 
-    def draw_road_surface(self, road):
+    def draw_road_surface(self, road, surface=None):
+        # Kreslí se jednou do statického podkladu (viz build_static_layers).
+        surface = surface or self.screen
+        if road.lane_count > 1:
+            self.draw_extra_lanes(road, surface) # Pruhy navíc má každý směr svoje
         if road.reverse: return # Kreslíme podklad jen jednou
         
         if road.road_type == "road":
@@ -595,18 +2781,18 @@ class Visualizer:
             if road.direction == 'H':
                 # HORIZONTÁLNÍ SILNICE
                 # 1. Silnice
-                pygame.draw.rect(self.screen, (50, 50, 50), 
+                pygame.draw.rect(surface, (50, 50, 50), 
                                 (road.start_x, road.start_y - 20, road.length, 40))
                 # 2. Středová čára
-                pygame.draw.line(self.screen, (255, 255, 255), 
+                pygame.draw.line(surface, (255, 255, 255), 
                                 (road.start_x, road.start_y), (road.start_x + road.length, road.start_y), 2)
             else:
                 # VERTIKÁLNÍ SILNICE
                 # 1. Silnice
-                pygame.draw.rect(self.screen, (50, 50, 50), 
+                pygame.draw.rect(surface, (50, 50, 50), 
                                 (road.start_x - 20, road.start_y, 40, road.length))
                 # 2. Středová čára
-                pygame.draw.line(self.screen, (255, 255, 255), 
+                pygame.draw.line(surface, (255, 255, 255), 
                                 (road.start_x, road.start_y), (road.start_x, road.start_y + road.length), 2)
 
         else:
@@ -614,36 +2800,59 @@ class Visualizer:
             if road.direction == 'V':
                 # VERTIKÁLNÍ KOLEJE
                 # 1. Štěrk
-                pygame.draw.rect(self.screen, (100, 80, 50), (road.start_x - 16, road.start_y, 33, road.length))
+                pygame.draw.rect(surface, (100, 80, 50), (road.start_x - 16, road.start_y, 33, road.length))
                 # 2. Pražce (vodorovné čárky)
                 for i in range(0, road.length, 10):
                     y = road.start_y + i
-                    pygame.draw.line(self.screen, (60, 40, 20), (road.start_x - 16, y), (road.start_x + 16, y), 4)
+                    pygame.draw.line(surface, (60, 40, 20), (road.start_x - 16, y), (road.start_x + 16, y), 4)
                 # 3. Kolejnice (svislé čáry)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x - 8, road.start_y), (road.start_x - 8, road.start_y + road.length), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x + 7, road.start_y), (road.start_x + 7, road.start_y + road.length), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x - 14, road.start_y), (road.start_x - 14, road.start_y + road.length), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x + 13, road.start_y), (road.start_x + 13, road.start_y + road.length), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x - 8, road.start_y), (road.start_x - 8, road.start_y + road.length), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x + 7, road.start_y), (road.start_x + 7, road.start_y + road.length), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x - 14, road.start_y), (road.start_x - 14, road.start_y + road.length), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x + 13, road.start_y), (road.start_x + 13, road.start_y + road.length), 2)
             
             else: 
                 # HORIZONTÁLNÍ KOLEJE
                 # 1. Štěrk
-                pygame.draw.rect(self.screen, (100, 80, 50), (road.start_x, road.start_y - 16, road.length, 33))
+                pygame.draw.rect(surface, (100, 80, 50), (road.start_x, road.start_y - 16, road.length, 33))
                 # 2. Pražce (svislé čárky)
                 for i in range(0, road.length, 10):
                     x = road.start_x + i
-                    pygame.draw.line(self.screen, (60, 40, 20), (x, road.start_y - 16), (x, road.start_y + 16), 4)
+                    pygame.draw.line(surface, (60, 40, 20), (x, road.start_y - 16), (x, road.start_y + 16), 4)
                 # 3. Kolejnice (vodorovné čáry)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x, road.start_y - 8), (road.start_x + road.length, road.start_y - 8), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x, road.start_y + 7), (road.start_x + road.length, road.start_y + 7), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x, road.start_y - 14), (road.start_x + road.length, road.start_y - 14), 2)
-                pygame.draw.line(self.screen, (180, 180, 180), (road.start_x, road.start_y + 13), (road.start_x + road.length, road.start_y + 13), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x, road.start_y - 8), (road.start_x + road.length, road.start_y - 8), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x, road.start_y + 7), (road.start_x + road.length, road.start_y + 7), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x, road.start_y - 14), (road.start_x + road.length, road.start_y - 14), 2)
+                pygame.draw.line(surface, (180, 180, 180), (road.start_x, road.start_y + 13), (road.start_x + road.length, road.start_y + 13), 2)
             
+    def draw_extra_lanes(self, road, surface):
+        # Další pruhy vícepruhové silnice (20 px každý) vně základní silnice, na straně směru jízdy.
+        side = 1 if road.travel_direction() in (DIR_RIGHT, DIR_UP) else -1
+        for k in range(road.lane_count - 1):
+            offset = side * (20 + 20 * k) # Hranice mezi pruhy k a k+1
+            if road.direction == 'H':
+                top = road.start_y + offset if side > 0 else road.start_y + offset - 20
+                pygame.draw.rect(surface, (50, 50, 50), (road.start_x, top, road.length, 20))
+            else:
+                left = road.start_x + offset if side > 0 else road.start_x + offset - 20
+                pygame.draw.rect(surface, (50, 50, 50), (left, road.start_y, 20, road.length))
+        # Přerušované čáry mezi pruhy
+        for k in range(road.lane_count - 1):
+            offset = side * (20 + 20 * k)
+            for i in range(0, road.length, 30):
+                if road.direction == 'H':
+                    start = (road.start_x + i, road.start_y + offset)
+                    end = (road.start_x + min(i + 15, road.length), road.start_y + offset)
+                else:
+                    start = (road.start_x + offset, road.start_y + i)
+                    end = (road.start_x + offset, road.start_y + min(i + 15, road.length))
+                pygame.draw.line(surface, (200, 200, 200), start, end, 1)
+
     def draw_vehicle(self, v, road):
         # Vykreslí jedno vozidlo na dané silnici.
-        length = v.get_length() * self.scale
+        length = v.length * self.scale
         width = 10 
-        lane_offset = 10 # Vzdálenost středu pruhu od středu silnice
+        lane_offset = 10 + 20 * v.lane # Vzdálenost středu pruhu od středu silnice
         
         # Souřadnice levého horního rohu pro vykreslení
         x, y = 0, 0
@@ -716,27 +2925,18 @@ class Visualizer:
     def draw_ui(self):
         # Vykreslí informační panel se statistikami.
         # 1. Podkladový panel (poloprůhledný)
-        ui_surface = pygame.Surface((240, 90)) 
+        ui_surface = pygame.Surface((240, 115)) 
         ui_surface.set_alpha(200) 
         ui_surface.fill((0, 0, 0)) 
         ui_x = 10
         ui_y = 180
         self.screen.blit(ui_surface, (ui_x, ui_y))
         
-        # 2. Výpočet souhrnných statistik ze všech silnic
-        total_cars = sum(len(r.vehicles) for r in self.roads)
-        total_finished = sum(r.stats_cars_finished for r in self.roads)
-        
-        # Výpočet globální průměrné rychlosti
-        all_speeds = []
-        for r in self.roads:
-            for v in r.vehicles:
-                all_speeds.append(v.speed)
-        
-        if len(all_speeds) > 0:
-            avg_speed = (sum(all_speeds) / len(all_speeds)) * 3.6 # Převod m/s -> km/h
-        else:
-            avg_speed = 0.0
+        # 2. Souhrnné statistiky ze všech silnic
+        stats = self.simulation.stats()
+        total_cars = stats["cars_on_road"]
+        total_finished = stats["cars_finished"]
+        avg_speed = stats["avg_speed"]
 
         # 3. Vykreslení textů
         text_count = self.font.render(f"Aut na scéně: {total_cars}", True, (255, 255, 255))
@@ -750,100 +2950,255 @@ class Visualizer:
         text_speed = self.font.render(f"Prům. rychlost: {avg_speed:.1f} km/h", True, color_speed)
         self.screen.blit(text_speed, (ui_x + 10, ui_y + 60))
 
+        state = "pauza" if self.sim_clock.paused else f"{self.sim_clock.time_scale:g}×"
+        text_time = self.font.render(f"Čas: {stats['time']:.0f} s ({state})", True, (200, 200, 200))
+        self.screen.blit(text_time, (ui_x + 10, ui_y + 85))
+
+    def road_layout(self):
+        # Vše, na čem závisí statické vrstvy. Když se změní, vrstvy se překreslí.
+        return (self.width, self.height) + tuple(
+            (id(r), r.length, r.direction, r.start_x, r.start_y, r.reverse, r.road_type, r.lane_count)
+            for r in self.roads)
+
+    def build_static_layers(self):
+        # Předkreslí silnice, záplaty křižovatek a koleje do podkladu a tunely do překryvné vrstvy.
+        self.background = pygame.Surface((self.width, self.height))
+        self.background.fill((30, 30, 30))
+
+        # VRSTVA 1: Silnice (Podklad)
+        # Nejdřív nakreslíme asfalt všech silnic, aby tvořily souvislý povrch
+        for road in self.roads:
+            if road.road_type == "road":
+                self.draw_road_surface(road, self.background)
+
+        # VRSTVA 2: ZÁPLATA KŘIŽOVATKY
+        # Najdeme souřadnice křižovatky
+        # 1. Posbíráme souřadnice všech silnic (ignorujeme koleje)
+        vertical_xs = set()
+        horizontal_ys = set()
+        
+        for r in self.roads:
+            if r.road_type == "road": # Jen pro silnice (ne koleje)
+                if r.direction == 'V':
+                    vertical_xs.add(r.start_x)
+                elif r.direction == 'H':
+                    horizontal_ys.add(r.start_y)
+        
+        # 2. Vykreslíme čtverec na KAŽDÉM průsečíku
+        # Projdeme všechny kombinace X a Y
+        for cx in vertical_xs:
+            for cy in horizontal_ys:
+                # Kreslíme záplatu 40x40 (střed silnic)
+                pygame.draw.rect(self.background, (50, 50, 50), (cx - 20, cy - 20, 40, 40))
+        
+        # VRSTVA 3: KOLEJE
+        for road in self.roads:
+            if road.road_type == "rail":
+                self.draw_road_surface(road, self.background)
+
+        # VRSTVA 6: TUNELY (KRYTÍ VLAKŮ) - samostatná vrstva, kreslí se až nad vozidla
+        self.overlay = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        rail_xs = set()
+        rail_ys = set()
+        for r in self.roads:
+            if r.road_type == "rail":
+                if r.direction == 'V': rail_xs.add(r.start_x)
+                elif r.direction == 'H': rail_ys.add(r.start_y)
+        
+        for rx in rail_xs:
+            for ry in rail_ys:
+                # Tunel musí být o kousek větší než koleje (např. 60x60), aby schoval vlak
+                tunnel_size = 60
+                tunnel_rect = (rx - tunnel_size//2, ry - tunnel_size//2, tunnel_size, tunnel_size)
+                
+                # 1. Střecha tunelu (Barva terénu/Beton)
+                pygame.draw.rect(self.overlay, (40, 40, 45), tunnel_rect)
+                
+                # 2. Okraj (Rám mostu)
+                pygame.draw.rect(self.overlay, (20, 20, 25), tunnel_rect, 4)
+                
+                # 3. Designový prvek (X na střeše nebo šrafování)
+                pygame.draw.line(self.overlay, (30, 30, 35), (rx - 20, ry - 20), (rx + 20, ry + 20), 3)
+                pygame.draw.line(self.overlay, (30, 30, 35), (rx + 20, ry - 20), (rx - 20, ry + 20), 3)
+
+        self.static_key = self.road_layout()
+
+    def draw_world(self):
+        # Vykreslí silnice, semafory, vozidla a tunely (vše kromě UI).
+        prof = profiler.enabled
+        if prof: t = profiler.now()
+
+        # VRSTVY 1-3: Statický podklad (překreslí se jen při změně sítě)
+        if self.static_key != self.road_layout():
+            self.build_static_layers()
+        self.screen.blit(self.background, (0, 0))
+        if prof: t = profiler.record("draw.background", t)
+        
+        # VRSTVA 4: SEMAFORY
+        for road in self.roads:
+            self.draw_lights(road)
+        if prof: t = profiler.record("draw.lights", t)
+
+        # VRSTVA 5: Vozidla
+        for road in self.roads:
+            for v in road.vehicles:
+                self.draw_vehicle(v, road)
+        if prof: t = profiler.record("draw.vehicles", t)
+
+        # VRSTVA 6: TUNELY (KRYTÍ VLAKŮ)
+        self.screen.blit(self.overlay, (0, 0))
+        if prof: profiler.record("draw.overlay", t)
+
+    def draw_profile(self):
+        # Panel s klouzavými percentily fází (p50 / p95 v ms), nejdražší fáze nahoře.
+        rows = sorted(profiler.summary().items(), key=lambda item: -item[1]["p95"])[:16]
+        ui_surface = pygame.Surface((300, 30 + 20 * len(rows)))
+        ui_surface.set_alpha(200)
+        ui_surface.fill((0, 0, 0))
+        ui_x = self.width - 310
+        ui_y = 10
+        self.screen.blit(ui_surface, (ui_x, ui_y))
+
+        header = self.font.render("Fáze            p50 / p95 ms", True, (255, 255, 0))
+        self.screen.blit(header, (ui_x + 10, ui_y + 5))
+        for i, (name, row) in enumerate(rows):
+            text = self.font.render(f"{name:16} {row['p50']:.2f} / {row['p95']:.2f}", True, (255, 255, 255))
+            self.screen.blit(text, (ui_x + 10, ui_y + 25 + 20 * i))
+
     def run(self):
         running = True
-        dt = 0.016
+        skipped = 0 # Počet po sobě vynechaných snímků
         
         while running:
+            # Reálný čas od minulého snímku (max 0.25 s, např. po přetažení okna)
+            real_dt = min(self.clock.tick(self.fps) / 1000.0, 0.25)
+
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: running = False
+                elif event.type == pygame.KEYDOWN:
+                    # Šipky nahoru/dolů mění zrychlení, mezerník pozastaví simulaci
+                    if event.key == pygame.K_UP: self.sim_clock.time_scale *= 2
+                    elif event.key == pygame.K_DOWN: self.sim_clock.time_scale /= 2
+                    elif event.key == pygame.K_SPACE: self.sim_clock.paused = not self.sim_clock.paused
+                    elif event.key == pygame.K_p:
+                        # P zapne profilování a ukáže panel s délkami fází
+                        self.show_profile = not self.show_profile
+                        profiler.enabled = profiler.enabled or self.show_profile
 
             # --- 1. UPDATE LOGIKY (Výpočty) ---
-            if self.generator: self.generator.update(dt)
-            
-            for road in self.roads:
-                road.update(dt)
-            
-            if hasattr(self, 'intersection_ctrl'):
-                self.intersection_ctrl.update(dt)
+            # Pevný krok fyziky - za snímek proběhne tolik kroků, kolik odpovídá času
+            prof = profiler.enabled
+            if prof: t = profiler.now()
+            self.sim_clock.advance(real_dt)
+            if prof: profiler.record("frame.simulation", t)
 
-            # --- 2. VYKRESLOVÁNÍ (Grafika) ---
-            self.screen.fill((30, 30, 30))
-            
-            # VRSTVA 1: Silnice (Podklad)
-            # Nejdřív nakreslíme asfalt všech silnic, aby tvořily souvislý povrch
-            for road in self.roads:
-                if road.road_type == "road":
-                    self.draw_road_surface(road)
-
-            # VRSTVA 2: ZÁPLATA KŘIŽOVATKY
-            # Najdeme souřadnice křižovatky
-            # 1. Posbíráme souřadnice všech silnic (ignorujeme koleje)
-            vertical_xs = set()
-            horizontal_ys = set()
-            
-            for r in self.roads:
-                if r.road_type == "road": # Jen pro silnice (ne koleje)
-                    if r.direction == 'V':
-                        vertical_xs.add(r.start_x)
-                    elif r.direction == 'H':
-                        horizontal_ys.add(r.start_y)
-            
-            # 2. Vykreslíme čtverec na KAŽDÉM průsečíku
-            # Projdeme všechny kombinace X a Y
-            for cx in vertical_xs:
-                for cy in horizontal_ys:
-                    # Kreslíme záplatu 40x40 (střed silnic)
-                    pygame.draw.rect(self.screen, (50, 50, 50), (cx - 20, cy - 20, 40, 40))
-            
-            # VRSTVA 3: KOLEJE
-            for road in self.roads:
-                if road.road_type == "rail":
-                    self.draw_road_surface(road)
-            
-            # VRSTVA 4: SEMAFORY
-            for road in self.roads:
-                self.draw_lights(road)
+            # Když simulace nestíhá, vynecháme vykreslení (ale ne donekonečna)
+            if self.sim_clock.behind and skipped < self.max_frame_skip:
+                skipped += 1
+                continue
+            skipped = 0
+            self.simulation.sync()
 
-            # VRSTVA 5: Vozidla
-            for road in self.roads:
-                for v in road.vehicles:
-                    self.draw_vehicle(v, road)
-
-            # VRSTVA 6: TUNELY (KRYTÍ VLAKŮ)           
-            rail_xs = set()
-            rail_ys = set()
-            for r in self.roads:
-                if r.road_type == "rail":
-                    if r.direction == 'V': rail_xs.add(r.start_x)
-                    elif r.direction == 'H': rail_ys.add(r.start_y)
-            
-            for rx in rail_xs:
-                for ry in rail_ys:
-                    # Tunel musí být o kousek větší než koleje (např. 60x60), aby schoval vlak
-                    tunnel_size = 60
-                    tunnel_rect = (rx - tunnel_size//2, ry - tunnel_size//2, tunnel_size, tunnel_size)
-                    
-                    # 1. Střecha tunelu (Barva terénu/Beton)
-                    pygame.draw.rect(self.screen, (40, 40, 45), tunnel_rect)
-                    
-                    # 2. Okraj (Rám mostu)
-                    pygame.draw.rect(self.screen, (20, 20, 25), tunnel_rect, 4)
-                    
-                    # 3. Designový prvek (X na střeše nebo šrafování)
-                    pygame.draw.line(self.screen, (30, 30, 35), (rx - 20, ry - 20), (rx + 20, ry + 20), 3)
-                    pygame.draw.line(self.screen, (30, 30, 35), (rx + 20, ry - 20), (rx - 20, ry + 20), 3)
+            # --- 2. VYKRESLOVÁNÍ (Grafika) ---
+            self.draw_world()
 
             # VRSTVA 7: UI (Úplně nahoře)
+            if prof: t = profiler.now()
             self.draw_ui()
+            if self.show_profile:
+                self.draw_profile()
+            if prof: t = profiler.record("draw.ui", t)
             
             pygame.display.flip()
-            self.clock.tick(60)
+            if prof: profiler.record("draw.flip", t)
 
+    # --- PŘEHRÁVÁNÍ ZÁZNAMU ---
 
-# --- SPUŠTĚNÍ ---
+    def timeline_rect(self):
+        # Posuvník času dole na obrazovce (x, y, šířka, výška).
+        return (10, self.height - 25, self.width - 20, 12)
 
-if __name__ == "__main__":
+    def timeline_time(self, x, start_time, end_time):
+        # Čas, který odpovídá vodorovné pozici myši na posuvníku.
+        left, _, width, _ = self.timeline_rect()
+        ratio = min(max((x - left) / width, 0.0), 1.0)
+        return start_time + ratio * (end_time - start_time)
+
+    def draw_replay_ui(self, replay, time, start_time, end_time, speed, paused):
+        # Panel s časem a rychlostí přehrávání + posuvník.
+        ui_surface = pygame.Surface((240, 65))
+        ui_surface.set_alpha(200)
+        ui_surface.fill((0, 0, 0))
+        self.screen.blit(ui_surface, (10, 180))
+        state = "pauza" if paused else f"{speed:g}×"
+        text_time = self.font.render(f"Záznam: {time:.1f} / {end_time:.1f} s ({state})", True, (255, 255, 255))
+        self.screen.blit(text_time, (20, 190))
+        cars = sum(len(r.vehicles) for r in self.roads)
+        text_frame = self.font.render(f"Snímek {replay.current}, aut: {cars}", True, (200, 200, 200))
+        self.screen.blit(text_frame, (20, 215))
+
+        left, top, width, height = self.timeline_rect()
+        pygame.draw.rect(self.screen, (80, 80, 80), (left, top, width, height))
+        if end_time > start_time:
+            done = (time - start_time) / (end_time - start_time)
+            pygame.draw.rect(self.screen, (0, 160, 255), (left, top, int(width * done), height))
+
+    def replay(self, replay, speed=1.0):
+        # Přehraje záznam (TrajectoryReplay) bez simulace.
+        # Mezerník = pauza, šipky vlevo/vpravo = skok o 10 s, nahoru/dolů = rychlost 2×,
+        # kliknutí nebo tažení po posuvníku = skok na daný čas.
+        self.roads = replay.roads
+        if replay.frame_count == 0:
+            return
+        start_time = replay.frame_time(0)
+        end_time = replay.frame_time(replay.frame_count - 1)
+        time = start_time
+        paused = False
+        scrubbing = False
+        left, top, width, height = self.timeline_rect()
+        running = True
+
+        while running:
+            real_dt = min(self.clock.tick(self.fps) / 1000.0, 0.25)
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT: running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE: paused = not paused
+                    elif event.key == pygame.K_RIGHT: time = min(time + 10.0, end_time)
+                    elif event.key == pygame.K_LEFT: time = max(time - 10.0, start_time)
+                    elif event.key == pygame.K_UP: speed *= 2
+                    elif event.key == pygame.K_DOWN: speed /= 2
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    x, y = event.pos
+                    if left <= x <= left + width and top - 5 <= y <= top + height + 5:
+                        scrubbing = True
+                        time = self.timeline_time(x, start_time, end_time)
+                elif event.type == pygame.MOUSEMOTION and scrubbing:
+                    time = self.timeline_time(event.pos[0], start_time, end_time)
+                elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                    scrubbing = False
+
+            if not paused and not scrubbing:
+                time = min(time + real_dt * speed, end_time)
+
+            # Snímek se načte jen při změně (binární hledání + O(1) přístup do souborů)
+            index = replay.seek(time)
+            if index != replay.current:
+                replay.load(index)
+
+            self.draw_world()
+            self.draw_replay_ui(replay, time, start_time, end_time, speed, paused)
+            pygame.display.flip()
+
+
+# --- 9. UKÁZKOVÁ SCÉNA ---
+
+def build_demo_simulation(min_green_time=5, max_green_time=20.0, red_clearance=2.0, green_duration=10.0,
+                          car_interval=(3.0, 7.0), train_interval=(45, 75), seed=None, model=None, dt=0.016):
+    # Postaví ukázkovou síť (2 křižovatky, 3 železniční přejezdy) a vrátí Simulation.
+    # Parametry řadičů a generátoru jdou přenastavit (používá je sweep()).
+    # Se stejným seedem vyjde pokaždé stejná doprava. model = model sledování vozidla silnic.
     # --- Nastavení světa ---
     size_width = 1200
     size_height = 700
@@ -860,14 +3215,14 @@ if __name__ == "__main__":
 
     # --- DEFINICE SILNIC A KOLEJÍ  ---
     # 1. Horizontální silnice (Dlouhé 1200m, Křižovatka na x 400 a 800)
-    road1_h_right = Road(1200, 'H', 0, road1_Y, reverse=False)
-    road1_h_left  = Road(1200, 'H', 0, road1_Y, reverse=True)
-    road2_h_right = Road(1200, 'H', 0, road2_Y, reverse=False)
-    road2_h_left  = Road(1200, 'H', 0, road2_Y, reverse=True)
+    road1_h_right = Road(1200, 'H', 0, road1_Y, reverse=False, model=model)
+    road1_h_left  = Road(1200, 'H', 0, road1_Y, reverse=True, model=model)
+    road2_h_right = Road(1200, 'H', 0, road2_Y, reverse=False, model=model)
+    road2_h_left  = Road(1200, 'H', 0, road2_Y, reverse=True, model=model)
 
     # 2. Vertikální silnice (Dlouhá 700, Křižovatka na y 100 a 600)
-    road_v_down = Road(700, 'V', road1_X, 0, reverse=False)
-    road_v_up   = Road(700, 'V', road1_X, 0, reverse=True)
+    road_v_down = Road(700, 'V', road1_X, 0, reverse=False, model=model)
+    road_v_up   = Road(700, 'V', road1_X, 0, reverse=True, model=model)
 
     # 3. Horizontální kolej (Dlouhá 1200, Přejezd na x 400)
     rail_h_right = Road(1200, 'H', 0, rail2_Y, reverse=False, road_type="rail")
@@ -895,7 +3250,7 @@ if __name__ == "__main__":
         [road_v_down, road_v_up],
         [l_cross1_h_right, l_cross1_h_left], 
         [l_cross1_v_down, l_cross1_v_up], 
-        min_green_time=5, max_green_time=20.0, red_clearance=2.0
+        min_green_time=min_green_time, max_green_time=max_green_time, red_clearance=red_clearance
     )
 
     # Křižovatka 2 mezi road2_h a road_v (X=400, Y=600)
@@ -913,7 +3268,7 @@ if __name__ == "__main__":
     intersection_ctrl_2 = IntersectionController(
         [l_cross2_h_right, l_cross2_h_left], 
         [l_cross2_v_down, l_cross2_v_up], 
-        green_duration=10.0, red_clearance=2.0
+        green_duration=green_duration, red_clearance=red_clearance
     )
 
     # Přejezd 1 na road1_h (X=800, Y=350)
@@ -958,28 +3313,952 @@ if __name__ == "__main__":
         crossing_point=rail2_X # <--- Předáme souřadnici křížení
     )
     
-    # --- SPUŠTĚNÍ ---
     roads = [road1_h_right, road1_h_left, road2_h_right, road2_h_left,road_v_down, road_v_up, rail_h_left, rail_h_right, rail_v_down, rail_v_up]
-    generator = TrafficGenerator(roads)
-    
-    app = Visualizer(roads, generator, 1200, 700)
-    
-    # Visualizeru musíme předat OBA řadiče, aby je aktualizoval
-    # Uděláme si na to malý trik - přidáme si je do seznamu
-    app.controllers = [smart_intersection_ctrl_1, intersection_ctrl_2, railway_ctrl_1, railway_ctrl_2, railway_ctrl_3]
-    
-    # Upravíme metodu run ve Visualizeru, aby volala všechny controllery
-    # (viz malá úprava níže)
-    
-    # Rychlý hack: Metoda run ve Visualizeru volá 'self.intersection_ctrl'.
-    # Abychom nemuseli přepisovat Visualizer, uděláme objekt, který se tváří jako jeden controller
-    class MasterController:
-        def __init__(self, ctrls): self.ctrls = ctrls
-        def update(self, dt):
-            for c in self.ctrls: c.update(dt)
-        @property
-        def state(self): return "RUNNING" # Dummy
-            
-    app.intersection_ctrl = MasterController(app.controllers)
-    
-    app.run()
\ No newline at end of file
+    generator = TrafficGenerator(roads, car_interval, train_interval, seed=seed)
+    controllers = [smart_intersection_ctrl_1, intersection_ctrl_2, railway_ctrl_1, railway_ctrl_2, railway_ctrl_3]
+    return Simulation(roads, generator, controllers, dt=dt)
+
+
+def build_grid_simulation(columns=4, rows=2, block=300, stub=100, green_duration=10.0, red_clearance=2.0,
+                          car_interval=(4.0, 8.0), seed=None, model=None, dt=0.016):
+    # Městská mřížka columns x rows křižovatek propojená silnicemi v síti (RoadNetwork).
+    # Na okrajích jsou krátké příjezdy z "bran" - tam vozidla vznikají a tam také síť opouštějí.
+    # Každá křižovatka má semafory na konci příjezdových silnic a řadič H/V.
+    x0, y0 = stub, stub + 50
+    network = RoadNetwork()
+    roads = []
+    entries = []                      # Příjezdy z bran (pro generátor)
+    lights = {}                       # Křižovatka -> ([semafory H], [semafory V])
+
+    def node(i, j):
+        return f"{i},{j}"
+
+    def street(length, direction, x, y, start, end):
+        # Obousměrná ulice: silnice start -> end a zpětná end -> start
+        forward = network.connect(Road(length, direction, x, y, model=model), start, end)
+        backward = network.connect(Road(length, direction, x, y, reverse=True, model=model), end, start)
+        roads.extend((forward, backward))
+        return forward, backward
+
+    for j in range(rows):
+        for i in range(columns):
+            lights[network.add_node(node(i, j))] = ([], [])
+    # Ulice mezi křižovatkami
+    for j in range(rows):
+        for i in range(columns - 1):
+            street(block, 'H', x0 + i * block, y0 + j * block, node(i, j), node(i + 1, j))
+    for i in range(columns):
+        for j in range(rows - 1):
+            street(block, 'V', x0 + i * block, y0 + j * block, node(i, j), node(i, j + 1))
+    # Příjezdy z bran na okrajích (vlevo, vpravo, nahoře, dole)
+    for j in range(rows):
+        gate = network.add_node(f"W{j}", exit=True)
+        entries.append(street(stub, 'H', x0 - stub, y0 + j * block, gate, node(0, j))[0])
+        gate = network.add_node(f"E{j}", exit=True)
+        entries.append(street(stub, 'H', x0 + (columns - 1) * block, y0 + j * block, node(columns - 1, j), gate)[1])
+    for i in range(columns):
+        gate = network.add_node(f"N{i}", exit=True)
+        entries.append(street(stub, 'V', x0 + i * block, y0 - stub, gate, node(i, 0))[0])
+        gate = network.add_node(f"S{i}", exit=True)
+        entries.append(street(stub, 'V', x0 + i * block, y0 + (rows - 1) * block, node(i, rows - 1), gate)[1])
+
+    # Semafory 30 m před každou křižovatkou
+    for road in roads:
+        end = network.ends[road][1]
+        if end in lights:
+            light = TrafficLight(road.length - 30)
+            road.add_traffic_light(light)
+            lights[end][0 if road.direction == 'H' else 1].append(light)
+    controllers = [IntersectionController(h, v, green_duration=green_duration, red_clearance=red_clearance)
+                   for h, v in lights.values()]
+
+    generator = TrafficGenerator(entries, car_interval, seed=seed, network=network)
+    return Simulation(roads, generator, controllers, dt=dt, network=network)
+
+
+# --- 10. PARAMETRICKÉ SWEEPY (Monte Carlo) ---
+
+# Kritické hodnoty Studentova t-rozdělení pro 95% interval (podle počtu stupňů volnosti)
+_T95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+        10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042, 60: 2.000, 120: 1.980}
+
+
+def confidence_interval(values):
+    # Vrátí (průměr, polovina šířky 95% intervalu spolehlivosti).
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, float("inf")
+    variance = sum((x - mean) ** 2 for x in values) / (n - 1)
+    df = n - 1
+    # Nejbližší tabulková hodnota s df nejvýš skutečným - t s df klesá, takže interval
+    # vyjde spíš širší (konzervativně nahoru)
+    t = _T95[max(limit for limit in _T95 if limit <= df)]
+    return mean, t * (variance / n) ** 0.5
+
+
+def parameter_grid(space):
+    # Kartézský součin: {"a": [1, 2], "b": [3]} -> [{"a": 1, "b": 3}, {"a": 2, "b": 3}]
+    configs = [{}]
+    for name, values in space.items():
+        configs = [dict(config, **{name: value}) for config in configs for value in values]
+    return configs
+
+
+def random_search(space, samples, seed=0):
+    # Náhodné konfigurace: seznam = výběr jedné hodnoty, dvojice (od, do) = rovnoměrně z intervalu.
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(samples):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                config[name] = rng.uniform(*values)
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def _sweep_run(task):
+    # Jeden běh sweepu v pracovním procesu: nasadí seed, postaví scénu a odsimuluje ji.
+    factory, config_index, params, seed, seconds, sample_interval, snapshot = task
+    event_log.sink = None # Události běhů sweepu se nikam nezapisují
+    simulation = factory(seed=seed, **params)
+    if snapshot is not None:
+        # Start z rozjetého stavu; každá replikace dál losuje s vlastním seedem
+        simulation.load_snapshot(snapshot)
+        simulation.generator.reseed(seed)
+    queues = []
+    sample_steps = max(1, int(round(sample_interval / simulation.dt)))
+    for tick in range(1, int(round(seconds / simulation.dt)) + 1):
+        simulation.step()
+        if tick % sample_steps == 0:
+            # Fronta = vozidla, která stojí nebo se jen plazí (< 1 m/s)
+            queues.append(sum(1 for road in simulation.roads for v in road.vehicles if v.speed < 1.0))
+    stats = simulation.stats()
+    simulation.close()
+    return {
+        "config": config_index,
+        "params": params,
+        "seed": seed,
+        "cars_finished": stats["cars_finished"],
+        "avg_speed": stats["avg_speed"],
+        "mean_queue": sum(queues) / len(queues) if queues else 0.0,
+        "max_queue": max(queues) if queues else 0,
+    }
+
+
+class SweepResults:
+    # Průběžně sbírá výsledky běhů a počítá souhrny s intervaly spolehlivosti.
+    METRICS = ("cars_finished", "avg_speed", "mean_queue", "max_queue")
+
+    def __init__(self, configs):
+        self.configs = configs                   # Seznam slovníků parametrů
+        self.runs = [[] for _ in configs]        # Výsledky běhů pro každou konfiguraci
+
+    def add(self, run):
+        self.runs[run["config"]].append(run)
+
+    def summary(self):
+        # Pro každou konfiguraci: počet běhů a (průměr, ± 95% interval) každé metriky.
+        rows = []
+        for index, (params, runs) in enumerate(zip(self.configs, self.runs)):
+            row = {"config": index, "params": params, "runs": len(runs)}
+            for metric in self.METRICS:
+                values = [run[metric] for run in runs]
+                row[metric] = confidence_interval(values) if values else None
+            rows.append(row)
+        return rows
+
+    def best(self, metric="cars_finished"):
+        # Konfigurace s nejvyšším průměrem zvolené metriky.
+        rows = [row for row in self.summary() if row["runs"] > 0]
+        return max(rows, key=lambda row: row[metric][0])
+
+
+def sweep(factory, configs, replications=5, seconds=300.0, processes=None, base_seed=0, sample_interval=1.0,
+          snapshot=None):
+    # Spustí každou konfiguraci v několika replikacích napříč procesy.
+    # factory(seed=..., **parametry) musí vrátit Simulation (např. build_demo_simulation).
+    # Je to generátor: po každém dokončeném běhu vrátí (běh, SweepResults), takže jde
+    # průběžně sledovat výsledky a dlouhý sweep kdykoli ukončit (break).
+    # Replikace r má u všech konfigurací stejný seed -> rozdíly nejsou jen šum generátoru.
+    # Se snapshotem začínají všechny běhy z uloženého (rozjetého) stavu místo prázdné sítě.
+    results = SweepResults(configs)
+    tasks = [(factory, index, params, base_seed + r, seconds, sample_interval, snapshot)
+             for r in range(replications) for index, params in enumerate(configs)]
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    pool = context.Pool(processes)
+    try:
+        for run in pool.imap_unordered(_sweep_run, tasks):
+            results.add(run)
+            yield run, results
+    finally:
+        pool.terminate() # Při předčasném ukončení zahodí zbylé běhy
+        pool.join()
+
+
+# --- 11. SNAPSHOTY (Uložení a obnovení stavu) ---
+# Soubor: hlavička (magic + délka JSONu), JSON s malým stavem (čas, semafory, řadiče,
+# generátor), pak sloupce vozidel všech silnic za sebou - nejdřív reálná čísla (double),
+# čísla vozidel (int64), bajty (typ, směr, příznaky) a nakonec stavy generátorů náhody (uint32).
+# Sloupce se čtou přímo z mmap, bez parsování.
+SNAPSHOT_MAGIC = b"TSNAP002"
+SNAPSHOT_HEADER = struct.Struct("<8sQ")
+SNAPSHOT_FLOATS = ("position", "speed", "max_speed", "current_wait") # Zrychlení apod. jsou konstanty typu vozidla
+SNAPSHOT_TYPES = (Car, Bus, Truck, Train)
+SNAPSHOT_DIRECTIONS = (DIR_RIGHT, DIR_LEFT, DIR_DOWN, DIR_UP)
+
+
+def save_snapshot(simulation, path):
+    # Uloží celý proměnlivý stav simulace do binárního souboru.
+    simulation.sync()
+    roads = simulation.roads
+    generator_state = simulation.generator.get_state() if simulation.generator else None
+    rng_states = []
+    if generator_state:
+        # Stavy Mersenne Twisteru (625 čísel na silnici) jdou binárně, ne do JSONu
+        rng_states = generator_state.pop("rngs")
+        generator_state["rng_meta"] = [(version, len(internal), gauss) for version, internal, gauss in rng_states]
+    meta = {
+        "time": simulation.time,
+        "ticks": simulation.ticks,
+        "roads": [road.get_state() for road in roads],
+        "counts": [len(road.vehicles) for road in roads],
+        "lights": [light.get_state() for road in roads for light in road.traffic_lights],
+        "controllers": [controller.get_state() for controller in simulation.controllers],
+        "generator": generator_state,
+        "calendar": simulation.calendar.get_state(), # Komponenty kalendáře jsou dopočítané jen do svého času
+    }
+    vehicles = [v for road in roads for v in road.vehicles]
+    if any(v.destination is not None for v in vehicles):
+        meta["destinations"] = [v.destination for v in vehicles] # Cíle v síti silnic (jména uzlů)
+    type_codes = {cls: code for code, cls in enumerate(SNAPSHOT_TYPES)}
+    direction_codes = {direction: code for code, direction in enumerate(SNAPSHOT_DIRECTIONS)}
+
+    meta_bytes = json.dumps(meta).encode("utf-8")
+    meta_bytes += b" " * (-len(meta_bytes) % 8) # Zarovnání, aby sloupce double začínaly na násobku 8
+    with open(path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta_bytes)))
+        f.write(meta_bytes)
+        for name in SNAPSHOT_FLOATS:
+            f.write(array("d", [float(getattr(v, name)) for v in vehicles]).tobytes())
+        f.write(array("q", [v.id for v in vehicles]).tobytes())
+        f.write(bytes(type_codes[type(v)] for v in vehicles))
+        f.write(bytes(direction_codes[v.direction] for v in vehicles))
+        f.write(bytes(v.stopped | (v.is_braking << 1) | (v.lane << 2) for v in vehicles)) # Bity 2-7: pruh
+        for _, internal, _ in rng_states:
+            f.write(array("I", internal).tobytes())
+
+
+def load_snapshot(simulation, path):
+    # Obnoví stav simulace ze snapshotu. Simulace musí mít stejnou síť (stejná továrna scénáře).
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, meta_length = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} není snapshot simulace")
+        offset = SNAPSHOT_HEADER.size
+        meta = json.loads(bytes(data[offset:offset + meta_length]))
+        offset += meta_length
+
+        roads = simulation.roads
+        lights = [light for road in roads for light in road.traffic_lights]
+        if (len(meta["counts"]) != len(roads) or len(meta["lights"]) != len(lights)
+                or len(meta["controllers"]) != len(simulation.controllers)
+                or len(meta["calendar"]) != len(simulation.calendar.entries)):
+            raise ValueError("Snapshot patří k jiné síti (nesedí počet silnic, semaforů nebo řadičů)")
+
+        # Sloupce vozidel - pohledy do mmap, čteme je najednou
+        total = sum(meta["counts"])
+        view = memoryview(data)
+        columns = {}
+        for name in SNAPSHOT_FLOATS:
+            column = view[offset:offset + 8 * total].cast("d")
+            columns[name] = column.tolist()
+            column.release()
+            offset += 8 * total
+        ids = array("q", bytes(view[offset:offset + 8 * total])).tolist()
+        offset += 8 * total
+        types, directions, flags = (bytes(view[offset + i * total:offset + (i + 1) * total]) for i in range(3))
+        offset += 3 * total
+        generator_state = meta["generator"]
+        if generator_state:
+            rngs = []
+            for version, length, gauss in generator_state.pop("rng_meta"):
+                size = length * array("I").itemsize
+                rngs.append((version, array("I", bytes(view[offset:offset + size])).tolist(), gauss))
+                offset += size
+            generator_state["rngs"] = rngs
+        view.release()
+
+    # Simulace pokračuje ze snapshotu - případné pracovní procesy se spustí znovu
+    workers = simulation.workers
+    simulation.close()
+    simulation.workers = workers
+    simulation.time = meta["time"]
+    simulation.ticks = meta["ticks"]
+    simulation._synced_tick = -1
+
+    start = 0
+    destinations = meta.get("destinations")
+    for road, road_state, count in zip(roads, meta["roads"], meta["counts"]):
+        vehicles = []
+        for i in range(start, start + count):
+            v = SNAPSHOT_TYPES[types[i]](speed=0.0, position=0.0, direction=SNAPSHOT_DIRECTIONS[directions[i]])
+            for name in SNAPSHOT_FLOATS:
+                setattr(v, name, columns[name][i])
+            v.stopped = bool(flags[i] & 1)
+            v.is_braking = bool(flags[i] & 2)
+            v.lane = flags[i] >> 2
+            if destinations is not None:
+                v.destination = destinations[i]
+            v.id = ids[i]
+            vehicles.append(v)
+        start += count
+        road.vehicles = vehicles
+        road.set_state(road_state)
+        road.rebuild_zones()
+    for light, state in zip(lights, meta["lights"]):
+        light.set_state(state)
+    for controller, state in zip(simulation.controllers, meta["controllers"]):
+        controller.set_state(state)
+    if ids:
+        Vehicle.next_id = max(Vehicle.next_id, max(ids) + 1) # Nová vozidla nesmí dostat stejné číslo
+    if simulation.generator and generator_state:
+        simulation.generator.set_state(generator_state)
+    simulation.calendar.set_state(meta["calendar"])
+
+
+# --- 12. ZÁZNAM TRAJEKTORIÍ ---
+# Adresář se záznamem: meta.json (popis sloupců a silnic), jeden soubor na sloupec
+# (<název>.bin, surová pole bez hlavičky, jen se připisuje na konec), frames.bin
+# (index snímků: tick, čas, první řádek) a lights.bin (stav všech semaforů, bajt na
+# semafor a snímek). Řádek = jedno vozidlo v jednom snímku.
+TRAJECTORY_COLUMNS = (("tick", "q"), ("road", "H"), ("id", "q"), ("type", "B"), ("position", "d"),
+                      ("speed", "d"), ("stopped", "B"), ("is_braking", "B"), ("lane", "B"))
+TRAJECTORY_FRAME = struct.Struct("<qdq") # tick, čas, index prvního řádku snímku
+
+
+class TrajectoryRecorder:
+    # Vzorkuje všechna vozidla s danou periodou do předem alokovaných polí a po plných
+    # dávkách (chunk_rows řádků) je připisuje do sloupcových souborů.
+    # Paměť je omezená velikostí dávky bez ohledu na délku běhu.
+    def __init__(self, path, simulation, interval=1.0, chunk_rows=65536):
+        self.path = path
+        self.interval = interval                 # Perioda vzorkování v simulovaných sekundách
+        self.chunk_rows = chunk_rows             # Velikost dávky (řádků) před zápisem
+        self.every = max(1, int(round(interval / simulation.dt))) # Po kolika základních krocích vzorkovat
+        self.period = self.every * simulation.dt  # Skutečná perioda v sekundách (celý počet kroků)
+        self.tolerance = simulation.dt / 2        # Součty kroků v plovoucí čárce nejsou přesné
+        # Čas dalšího snímku - počítá se v sekundách, aby seděl i s adaptivním krokem
+        self.next_time = simulation.time + (self.every - simulation.ticks % self.every) * simulation.dt
+        self.rows = 0                            # Řádků zapsaných do souborů
+        self.frames = 0                          # Počet snímků zapsaných do souborů
+        self.filled = 0                          # Řádků v aktuální dávce
+        self.buffers = {name: array(code, bytes(array(code).itemsize * chunk_rows))
+                        for name, code in TRAJECTORY_COLUMNS}
+        self.frame_buffer = bytearray()          # Index snímků čekající na zápis
+        self.light_buffer = bytearray()          # Stavy semaforů čekající na zápis
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name + ".bin"), "wb") for name, _ in TRAJECTORY_COLUMNS}
+        self.frame_file = open(os.path.join(path, "frames.bin"), "wb")
+        self.light_file = open(os.path.join(path, "lights.bin"), "wb")
+        self.lights = [light for road in simulation.roads for light in road.traffic_lights]
+        self.meta = {
+            "version": 2,                        # 2: sloupec lane a počet pruhů silnic
+            "dt": simulation.dt,
+            "interval": interval,
+            "columns": [[name, code] for name, code in TRAJECTORY_COLUMNS], # Kódy typů modulu array
+            "byteorder": sys.byteorder,
+            "frame_format": TRAJECTORY_FRAME.format,
+            "roads": [{"length": r.length, "direction": r.direction, "start_x": r.start_x, "start_y": r.start_y,
+                       "reverse": r.reverse, "road_type": r.road_type, "lanes": r.lane_count,
+                       "lights": [light.position for light in r.traffic_lights]} for r in simulation.roads],
+            "types": [],                         # Názvy typů vozidel podle hodnoty ve sloupci type
+        }
+        self.type_codes = {}                     # Třída vozidla -> kód ve sloupci type
+        self.write_meta()
+
+    def due(self, simulation):
+        return simulation.time >= self.next_time - self.tolerance
+
+    def sample(self, simulation):
+        # Uloží jeden snímek: všechna vozidla na všech silnicích.
+        simulation.sync()
+        while self.next_time - self.tolerance <= simulation.time:
+            self.next_time += self.period
+        if len(self.frame_buffer) >= self.chunk_rows * TRAJECTORY_FRAME.size:
+            self.flush() # Index snímků má stejný strop paměti jako sloupce
+        self.frame_buffer += TRAJECTORY_FRAME.pack(simulation.ticks, simulation.time, self.rows + self.filled)
+        self.light_buffer += bytes(light.is_green for light in self.lights)
+        b = self.buffers
+        tick, road_col, ids, type_col = b["tick"], b["road"], b["id"], b["type"]
+        positions, speeds, stopped, braking = b["position"], b["speed"], b["stopped"], b["is_braking"]
+        lane_col = b["lane"]
+        type_codes = self.type_codes
+        ticks = simulation.ticks
+        for road_index, road in enumerate(simulation.roads):
+            for v in road.vehicles:
+                if self.filled == self.chunk_rows:
+                    self.flush()
+                i = self.filled
+                tick[i] = ticks
+                road_col[i] = road_index
+                ids[i] = v.id
+                cls = type(v)
+                if cls not in type_codes:
+                    type_codes[cls] = len(self.meta["types"])
+                    self.meta["types"].append(cls.__name__)
+                type_col[i] = type_codes[cls]
+                positions[i] = v.position
+                speeds[i] = v.speed
+                stopped[i] = v.stopped
+                braking[i] = v.is_braking
+                lane_col[i] = v.lane
+                self.filled = i + 1
+
+    def flush(self):
+        # Připíše naplněnou část dávky na konec souborů a dávku vyprázdní.
+        n = self.filled
+        if n:
+            for name, buffer in self.buffers.items():
+                self.files[name].write(memoryview(buffer)[:n].tobytes())
+        if self.frame_buffer:
+            self.frame_file.write(self.frame_buffer)
+            self.light_file.write(self.light_buffer)
+            self.frames += len(self.frame_buffer) // TRAJECTORY_FRAME.size
+            self.frame_buffer = bytearray()
+            self.light_buffer = bytearray()
+        self.rows += n
+        self.filled = 0
+        for f in self.files.values():
+            f.flush()
+        self.frame_file.flush()
+        self.light_file.flush()
+        self.write_meta()
+
+    def write_meta(self):
+        # Meta popisuje jen to, co už je v souborech
+        self.meta["rows"] = self.rows
+        self.meta["frames"] = self.frames
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.frame_file.close()
+        self.light_file.close()
+
+
+def read_trajectories(path):
+    # Načte celý záznam: vrátí (meta, sloupce, snímky). Sloupce jsou pole array.array,
+    # snímky seznam (tick, čas, první řádek, počet řádků).
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    columns = {}
+    for name, code in meta["columns"]:
+        column = array(code)
+        with open(os.path.join(path, name + ".bin"), "rb") as f:
+            column.frombytes(f.read(meta["rows"] * column.itemsize))
+        columns[name] = column
+    with open(os.path.join(path, "frames.bin"), "rb") as f:
+        data = f.read(meta["frames"] * TRAJECTORY_FRAME.size)
+    starts = list(TRAJECTORY_FRAME.iter_unpack(data))
+    frames = []
+    for i, (tick, time, start) in enumerate(starts):
+        end = starts[i + 1][2] if i + 1 < len(starts) else meta["rows"]
+        frames.append((tick, time, start, end - start))
+    return meta, columns, frames
+
+
+class TrajectoryReplay:
+    # Přehrávání záznamu bez simulace. Soubory se mapují do paměti (mmap), takže
+    # i hodinový záznam se otevře hned a libovolný snímek se načte v O(1) přes frames.bin.
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.frame_count = self.meta["frames"]
+        self.rows = self.meta["rows"]
+        self.types = [VEHICLE_TYPES[name] for name in self.meta["types"]]
+        # Silnice a semafory jen pro vykreslení (stejná geometrie jako při záznamu)
+        self.roads = []
+        for info in self.meta["roads"]:
+            geometry = (info["length"], info["direction"], info["start_x"], info["start_y"],
+                        info["reverse"], info["road_type"])
+            lanes = info.get("lanes", 1) # Záznamy verze 1 pruhy neznají
+            road = MultiLaneRoad(*geometry, lanes=lanes) if lanes > 1 else Road(*geometry)
+            for position in info["lights"]:
+                road.add_traffic_light(TrafficLight(position))
+            self.roads.append(road)
+        self.lights = [light for road in self.roads for light in road.traffic_lights]
+
+        self.maps = []  # Otevřené mmapy (zavře je close)
+        self.views = [] # Pohledy do nich (musí se uvolnit dřív než mmap)
+        self.columns = {name: self._map(path, name + ".bin", code, self.rows)
+                        for name, code in self.meta["columns"]}
+        self.frame_data = self._map(path, "frames.bin", "B", self.frame_count * TRAJECTORY_FRAME.size)
+        self.light_data = self._map(path, "lights.bin", "B", self.frame_count * len(self.lights))
+        self.current = None # Index načteného snímku
+
+    def _map(self, path, name, code, count):
+        # Typovaný pohled na soubor v paměti (prázdný soubor mmap neumí).
+        with open(os.path.join(path, name), "rb") as f:
+            if count == 0:
+                return memoryview(b"").cast(code)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(data)
+        raw = memoryview(data)
+        typed = raw.cast(code)
+        view = typed[:count]
+        self.views += [view, typed, raw]
+        return view
+
+    def frame(self, index):
+        # (tick, čas, první řádek, počet řádků) snímku - jen dvě čtení z indexu.
+        tick, time, start = TRAJECTORY_FRAME.unpack_from(self.frame_data, index * TRAJECTORY_FRAME.size)
+        if index + 1 < self.frame_count:
+            end = TRAJECTORY_FRAME.unpack_from(self.frame_data, (index + 1) * TRAJECTORY_FRAME.size)[2]
+        else:
+            end = self.rows
+        return tick, time, start, end - start
+
+    def frame_time(self, index):
+        return self.frame(index)[1]
+
+    def seek(self, time):
+        # Index posledního snímku, který nastal nejpozději v čase time (binární hledání).
+        lo, hi = 0, self.frame_count - 1
+        if hi < 0 or time <= self.frame_time(0):
+            return 0
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.frame_time(mid) <= time:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def load(self, index):
+        # Naplní silnice vozidly a semafory stavem ze snímku index.
+        _, _, start, count = self.frame(index)
+        vehicles = [[] for _ in self.roads]
+        c = self.columns
+        road_col, types, ids = c["road"], c["type"], c["id"]
+        positions, speeds, stopped, braking = c["position"], c["speed"], c["stopped"], c["is_braking"]
+        lane_col = c.get("lane")
+        for k in range(start, start + count):
+            road = self.roads[road_col[k]]
+            v = self.types[types[k]](speed=speeds[k], position=positions[k], direction=road.travel_direction())
+            v.id = ids[k]
+            v.stopped = bool(stopped[k])
+            v.is_braking = bool(braking[k])
+            if lane_col is not None:
+                v.lane = lane_col[k]
+            vehicles[road_col[k]].append(v)
+        # Přiřazením (ne append) - vícepruhová silnice vozidla rozdělí do pruhů podle v.lane
+        for road, road_vehicles in zip(self.roads, vehicles):
+            road.vehicles = road_vehicles
+        n = len(self.lights)
+        states = self.light_data[index * n:(index + 1) * n]
+        for light, state in zip(self.lights, states):
+            light.is_green = bool(state)
+        self.current = index
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        for data in self.maps:
+            data.close()
+        self.views, self.maps = [], []
+
+
+# --- 13. SCÉNÁŘE (Deklarativní popis sítě) ---
+# Síť popsaná v JSONu (nebo TOML) místo kódu: silnice a koleje, křižovatky a přejezdy
+# zadané souřadnicemi ve světě, řadiče a poptávka. Pozice semaforů (i na zpětných
+# silnicích) a body přejezdů na kolejích dopočítá loader - ručně se nic nepočítá.
+#
+#   {"roads": [{"id": "h", "direction": "H", "y": 350, "length": 1200},
+#              {"id": "h_back", "direction": "H", "y": 350, "length": 1200, "reverse": true}, ...],
+#    "intersections": [{"id": "k1", "at": [400, 350], "h": ["h", "h_back"], "v": [...], "controller": "smart"}],
+#    "crossings": [{"id": "p1", "at": [800, 350], "tracks": [...], "roads": ["h", "h_back"]}],
+#    "demand": {"car_interval": [3, 7], "train_interval": [45, 75]}, "seed": 42}
+#
+# seed je výchozí seed generátoru dopravy (parametr build_scenario ho přebije, např. ve sweepu).
+#
+# Soubor se nejdřív celý zkontroluje a převede na plán (validate_scenario), podle kterého
+# build_scenario postaví objekty jedním průchodem.
+
+SCENARIO_KEYS = {"name", "dt", "model", "engine", "stop_line", "roads", "intersections", "crossings", "demand",
+                 "seed"}
+SCENARIO_ROAD_KEYS = {"id", "direction", "length", "x", "y", "reverse", "type", "lanes", "spawn"}
+SCENARIO_INTERSECTION_KEYS = {"id", "at", "h", "v", "controller", "queues_h", "queues_v", "stop_line",
+                              "green_duration", "red_clearance", "min_green_time", "max_green_time"}
+SCENARIO_BASE_KEYS = {"id", "at", "h", "v", "controller", "stop_line"} # Klíče společné všem křižovatkám
+SCENARIO_CROSSING_KEYS = {"id", "at", "tracks", "roads", "stop_line"}
+SCENARIO_DEMAND_KEYS = {"car_interval", "train_interval"}
+SCENARIO_OVERRIDES = {"green_duration", "red_clearance", "min_green_time", "max_green_time", "car_interval",
+                      "train_interval"} # Co jde přepsat parametrem build_scenario (sweep)
+SCENARIO_ENGINES = {"road": Road, "array": ArrayRoad}
+SCENARIO_CONTROLLER_PARAMS = {
+    "fixed": {"green_duration": 10.0, "red_clearance": 2.0},
+    "smart": {"min_green_time": 5.0, "max_green_time": 20.0, "red_clearance": 2.0},
+}
+
+
+class ScenarioError(ValueError):
+    # Chyba ve scénáři. Zpráva začíná místem v souboru, např. "roads[3].length: ...".
+    pass
+
+
+def read_scenario(path):
+    # Načte scénář ze souboru (.json, nebo .toml) jako slovník - zatím bez kontroly.
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ScenarioError(f"{path}: TOML vyžaduje Python 3.11+ (nebo použijte JSON)")
+        with open(path, "rb") as f:
+            try:
+                return tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise ScenarioError(f"{path}: {e}") from None
+    with open(path, encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            raise ScenarioError(f"{path}: {e}") from None
+
+
+def _check_keys(where, data, allowed, required=()):
+    if not isinstance(data, dict):
+        raise ScenarioError(f"{where}: očekáván objekt")
+    unknown = sorted(set(data) - allowed)
+    if unknown:
+        raise ScenarioError(f"{where}: neznámé klíče {', '.join(unknown)}")
+    for key in required:
+        if key not in data:
+            raise ScenarioError(f"{where}: chybí klíč '{key}'")
+
+
+def _number(where, value, minimum=None, positive=False):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ScenarioError(f"{where}: očekáváno číslo, ne {value!r}")
+    if positive and value <= 0 or minimum is not None and value < minimum:
+        raise ScenarioError(f"{where}: hodnota {value} je mimo povolený rozsah")
+    return float(value)
+
+
+def _interval(where, value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ScenarioError(f"{where}: očekáván interval [od, do]")
+    low, high = _number(f"{where}[0]", value[0], minimum=0), _number(f"{where}[1]", value[1], minimum=0)
+    if low > high:
+        raise ScenarioError(f"{where}: začátek intervalu je větší než konec")
+    return (low, high)
+
+
+def _point(where, value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ScenarioError(f"{where}: očekáván bod [x, y]")
+    return _number(f"{where}[0]", value[0]), _number(f"{where}[1]", value[1])
+
+
+def _along(where, road, point):
+    # Vzdálenost bodu od začátku silnice (v dopředném směru). Bod musí ležet na silnici.
+    x, y = point
+    if road["direction"] == 'H':
+        across, along = y - road["y"], x - road["x"]
+    else:
+        across, along = x - road["x"], y - road["y"]
+    if abs(across) > 1e-9 or not 0 < along < road["length"]:
+        raise ScenarioError(f"{where}: bod {list(point)} neleží na silnici '{road['id']}'")
+    return along
+
+
+def validate_scenario(data):
+    # Zkontroluje scénář a vrátí plán stavby: silnice, semafory (index silnice, pozice)
+    # v pořadí přidání, řadiče a poptávku. Každá chyba skončí ScenarioError.
+    _check_keys("scénář", data, SCENARIO_KEYS, ("roads",))
+    engine = data.get("engine", "road")
+    if engine not in SCENARIO_ENGINES:
+        raise ScenarioError(f"engine: neznámý engine '{engine}' (povolené: {', '.join(SCENARIO_ENGINES)})")
+    model = data.get("model", "legacy")
+    if model not in CAR_FOLLOWING_MODELS:
+        raise ScenarioError(f"model: neznámý model '{model}' (povolené: {', '.join(CAR_FOLLOWING_MODELS)})")
+    stop_line = _number("stop_line", data.get("stop_line", 30.0), minimum=0)
+    seed = data.get("seed")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+        raise ScenarioError(f"seed: očekáváno celé číslo ({seed!r})")
+    plan = {"dt": _number("dt", data.get("dt", 0.016), positive=True), "model": model, "engine": engine,
+            "seed": seed, "roads": [], "lights": [], "controllers": [], "spawn": []}
+
+    # 1. Silnice a koleje
+    if not isinstance(data["roads"], list) or not data["roads"]:
+        raise ScenarioError("roads: očekáván neprázdný seznam silnic")
+    roads = []
+    index_of = {}
+    for i, raw in enumerate(data["roads"]):
+        where = f"roads[{i}]"
+        _check_keys(where, raw, SCENARIO_ROAD_KEYS, ("id", "direction", "length"))
+        road = {
+            "id": raw["id"],
+            "direction": raw["direction"],
+            "length": _number(f"{where}.length", raw["length"], positive=True),
+            "x": _number(f"{where}.x", raw.get("x", 0)),
+            "y": _number(f"{where}.y", raw.get("y", 0)),
+            "reverse": raw.get("reverse", False),
+            "type": raw.get("type", "road"),
+            "lanes": raw.get("lanes", 1),
+        }
+        if not isinstance(road["id"], str) or road["id"] in index_of:
+            raise ScenarioError(f"{where}.id: id musí být jedinečný řetězec ({road['id']!r})")
+        if road["direction"] not in ('H', 'V'):
+            raise ScenarioError(f"{where}.direction: povolené hodnoty jsou 'H' a 'V'")
+        if road["type"] not in ("road", "rail"):
+            raise ScenarioError(f"{where}.type: povolené hodnoty jsou 'road' a 'rail'")
+        if not isinstance(road["reverse"], bool):
+            raise ScenarioError(f"{where}.reverse: očekáváno true/false")
+        if isinstance(road["lanes"], bool) or not isinstance(road["lanes"], int) or road["lanes"] < 1:
+            raise ScenarioError(f"{where}.lanes: očekáváno kladné celé číslo")
+        if road["type"] == "rail" and road["lanes"] > 1:
+            raise ScenarioError(f"{where}.lanes: koleje mají jen jeden pruh")
+        index_of[road["id"]] = len(roads)
+        roads.append(road)
+        plan["roads"].append(road)
+        if raw.get("spawn", True):
+            plan["spawn"].append(index_of[road["id"]])
+
+    def references(where, ids, road_type, direction=None):
+        # Seznam id silnic -> indexy (a kontrola, že jde o správný druh silnice)
+        if not isinstance(ids, list) or not ids:
+            raise ScenarioError(f"{where}: očekáván neprázdný seznam id silnic")
+        result = []
+        for j, road_id in enumerate(ids):
+            if road_id not in index_of:
+                raise ScenarioError(f"{where}[{j}]: neznámá silnice '{road_id}'")
+            road = roads[index_of[road_id]]
+            if road["type"] != road_type:
+                raise ScenarioError(f"{where}[{j}]: '{road_id}' není {'kolej' if road_type == 'rail' else 'silnice'}")
+            if direction is not None and road["direction"] != direction:
+                raise ScenarioError(f"{where}[{j}]: '{road_id}' nevede ve směru {direction}")
+            result.append(index_of[road_id])
+        return result
+
+    def place_lights(where, indexes, point, setback):
+        # Semafor setback metrů před bodem - na zpětné silnici se pozice počítá od jejího konce
+        lights = []
+        for j, index in enumerate(indexes):
+            road = roads[index]
+            along = _along(f"{where}[{j}]", road, point)
+            position = (road["length"] - along if road["reverse"] else along) - setback
+            if position < 0:
+                raise ScenarioError(f"{where}[{j}]: semafor by ležel před začátkem silnice '{road['id']}'")
+            lights.append(len(plan["lights"]))
+            plan["lights"].append((index, position))
+        return lights
+
+    # 2. Křižovatky (semafory před křížením + řadič H/V)
+    for i, raw in enumerate(data.get("intersections", [])):
+        where = f"intersections[{i}]"
+        _check_keys(where, raw, SCENARIO_INTERSECTION_KEYS, ("at", "h", "v"))
+        kind = raw.get("controller", "fixed")
+        if kind not in SCENARIO_CONTROLLER_PARAMS:
+            raise ScenarioError(f"{where}.controller: povolené hodnoty jsou 'fixed' a 'smart'")
+        point = _point(f"{where}.at", raw["at"])
+        setback = _number(f"{where}.stop_line", raw.get("stop_line", stop_line), minimum=0)
+        roads_h = references(f"{where}.h", raw["h"], "road", 'H')
+        roads_v = references(f"{where}.v", raw["v"], "road", 'V')
+        params = {}
+        for key, default in SCENARIO_CONTROLLER_PARAMS[kind].items():
+            params[key] = _number(f"{where}.{key}", raw.get(key, default), minimum=0)
+        allowed = set(params) | ({"queues_h", "queues_v"} if kind == "smart" else set())
+        foreign = sorted(set(raw) & (SCENARIO_INTERSECTION_KEYS - SCENARIO_BASE_KEYS - allowed))
+        if foreign:
+            raise ScenarioError(f"{where}: řadič '{kind}' nemá parametry {', '.join(foreign)}")
+        controller = {"kind": kind, "params": params,
+                      "lights_h": place_lights(f"{where}.h", roads_h, point, setback),
+                      "lights_v": place_lights(f"{where}.v", roads_v, point, setback)}
+        if kind == "smart":
+            # Fronty se měří na silnicích křižovatky, pokud scénář neřekne jinak
+            controller["queues_h"] = references(f"{where}.queues_h", raw.get("queues_h", raw["h"]), "road")
+            controller["queues_v"] = references(f"{where}.queues_v", raw.get("queues_v", raw["v"]), "road")
+        plan["controllers"].append(controller)
+
+    # 3. Železniční přejezdy (semafory na silnicích, bod křížení na kolejích)
+    for i, raw in enumerate(data.get("crossings", [])):
+        where = f"crossings[{i}]"
+        _check_keys(where, raw, SCENARIO_CROSSING_KEYS, ("at", "tracks", "roads"))
+        point = _point(f"{where}.at", raw["at"])
+        setback = _number(f"{where}.stop_line", raw.get("stop_line", stop_line), minimum=0)
+        tracks = references(f"{where}.tracks", raw["tracks"], "rail")
+        # RailwayController dostává bod v dopředném směru kolejí - musí být pro všechny stejný
+        points = {_along(f"{where}.tracks[{j}]", roads[index], point) for j, index in enumerate(tracks)}
+        if len(points) > 1:
+            raise ScenarioError(f"{where}.tracks: koleje přejezdu musí začínat ve stejném místě")
+        roads_crossed = references(f"{where}.roads", raw["roads"], "road")
+        plan["controllers"].append({"kind": "railway", "tracks": tracks, "crossing_point": points.pop(),
+                                    "lights": place_lights(f"{where}.roads", roads_crossed, point, setback)})
+
+    # 4. Poptávka
+    demand = data.get("demand", {})
+    _check_keys("demand", demand, SCENARIO_DEMAND_KEYS)
+    plan["car_interval"] = _interval("demand.car_interval", demand.get("car_interval", (3.0, 7.0)))
+    plan["train_interval"] = _interval("demand.train_interval", demand.get("train_interval", (45, 75)))
+    return plan
+
+
+def build_scenario(scenario, seed=None, model=None, dt=None, **params):
+    # Postaví Simulation ze scénáře (cesta k souboru, slovník nebo plán z validate_scenario).
+    # Bez seedu se použije seed ze scénáře (pokud ho má). params přepíšou parametry všech řadičů daného druhu a poptávku (car_interval, ...),
+    # takže jde scénář rovnou použít ve sweep(): functools.partial(build_scenario, "sit.json").
+    unknown = sorted(set(params) - SCENARIO_OVERRIDES)
+    if unknown:
+        raise ScenarioError(f"neznámé parametry scénáře: {', '.join(unknown)}")
+    if isinstance(scenario, str):
+        scenario = read_scenario(scenario)
+    plan = scenario if "lights" in scenario else validate_scenario(scenario)
+    model = model or CAR_FOLLOWING_MODELS[plan["model"]]()
+    road_class = SCENARIO_ENGINES[plan["engine"]]
+
+    roads = []
+    for road in plan["roads"]:
+        if road["type"] == "rail":
+            roads.append(road_class(road["length"], road["direction"], road["x"], road["y"], road["reverse"], "rail"))
+        elif road["lanes"] > 1:
+            roads.append(MultiLaneRoad(road["length"], road["direction"], road["x"], road["y"], road["reverse"],
+                                       lanes=road["lanes"], model=model))
+        else:
+            roads.append(road_class(road["length"], road["direction"], road["x"], road["y"], road["reverse"],
+                                    model=model))
+    lights = []
+    for index, position in plan["lights"]:
+        light = TrafficLight(position)
+        roads[index].add_traffic_light(light)
+        lights.append(light)
+
+    def pick(indexes, items):
+        return [items[i] for i in indexes]
+
+    controllers = []
+    for controller in plan["controllers"]:
+        kind = controller["kind"]
+        if kind == "railway":
+            controllers.append(RailwayController(pick(controller["tracks"], roads), pick(controller["lights"], lights),
+                                                 crossing_point=controller["crossing_point"]))
+            continue
+        options = {key: params.get(key, value) for key, value in controller["params"].items()}
+        lights_h, lights_v = pick(controller["lights_h"], lights), pick(controller["lights_v"], lights)
+        if kind == "smart":
+            controllers.append(SmartIntersectionController(pick(controller["queues_h"], roads),
+                                                           pick(controller["queues_v"], roads),
+                                                           lights_h, lights_v, **options))
+        else:
+            controllers.append(IntersectionController(lights_h, lights_v, **options))
+
+    generator = TrafficGenerator(pick(plan["spawn"], roads), params.get("car_interval", plan["car_interval"]),
+                                 params.get("train_interval", plan["train_interval"]),
+                                 seed=plan.get("seed") if seed is None else seed)
+    return Simulation(roads, generator, controllers, dt=dt or plan["dt"])
+
+
+# --- SPUŠTĚNÍ ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulace dopravy")
+    parser.add_argument("--headless", action="store_true", help="Simulovat bez okna (pygame se nenačte)")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Délka headless běhu v simulovaných sekundách")
+    parser.add_argument("--workers", type=int, default=1, help="Počet procesů pro paralelní krokování silnic")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Zrychlení simulace oproti reálnému času v okně (např. 10)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed generátoru dopravy (stejný seed = stejný běh)")
+    parser.add_argument("--load-snapshot", metavar="SOUBOR", help="Pokračovat ze snapshotu (headless i v okně)")
+    parser.add_argument("--save-snapshot", metavar="SOUBOR", help="Po headless běhu uložit snapshot")
+    parser.add_argument("--record", metavar="ADRESÁŘ", help="Zaznamenávat trajektorie vozidel do adresáře")
+    parser.add_argument("--record-interval", type=float, default=1.0,
+                        help="Perioda záznamu trajektorií v simulovaných sekundách")
+    parser.add_argument("--replay", metavar="ADRESÁŘ", help="Přehrát záznam trajektorií (bez simulace)")
+    parser.add_argument("--events", metavar="SOUBOR",
+                        help="Zapisovat události (JSON řádky) po dávkách do souboru")
+    parser.add_argument("--sweep", type=int, default=0, metavar="N",
+                        help="Sweep délek zelené u chytré křižovatky, N replikací na konfiguraci "
+                             "(ukázková scéna nebo --scenario; --seed je seed první replikace)")
+    parser.add_argument("--grid", action="store_true",
+                        help="Místo ukázkové scény městská mřížka křižovatek (vozidla jezdí po trasách)")
+    parser.add_argument("--profile", metavar="SOUBOR",
+                        help="Měřit délky fází a uložit je jako Chrome trace (chrome://tracing, speedscope)")
+    parser.add_argument("--scenario", metavar="SOUBOR",
+                        help="Postavit síť ze scénáře (JSON/TOML) místo ukázkové scény")
+    parser.add_argument("--model", choices=sorted(CAR_FOLLOWING_MODELS),
+                        help="Model sledování vozidla (idm snese větší krok --dt)")
+    parser.add_argument("--dt", type=float, help="Krok simulace v sekundách (výchozí 0.016)")
+    parser.add_argument("--max-dt", type=float, metavar="SEKUNDY",
+                        help="Headless: adaptivní krok až do SEKUNDY (každá silnice jede vlastními kroky)")
+    args = parser.parse_args()
+    if args.events:
+        event_log.sink = FileSink(args.events)
+    if args.profile:
+        profiler.enabled = True
+    if args.scenario:
+        try:
+            build_scene = partial(build_scenario, validate_scenario(read_scenario(args.scenario)))
+        except ScenarioError as e:
+            sys.exit(f"Chyba ve scénáři {e}")
+    else:
+        build_scene = build_grid_simulation if args.grid else build_demo_simulation
+    scene_options = {"seed": args.seed}
+    if args.model:
+        scene_options["model"] = CAR_FOLLOWING_MODELS[args.model]()
+    if args.dt:
+        scene_options["dt"] = args.dt
+
+    if args.replay:
+        replay = TrajectoryReplay(args.replay)
+        Visualizer(replay.roads, width=1200, height=700).replay(replay, speed=args.time_scale)
+        replay.close()
+    elif args.sweep:
+        if args.grid:
+            parser.error("--sweep mění délky zelené chytré křižovatky, mřížka (--grid) žádnou nemá")
+        configs = parameter_grid({"min_green_time": [3.0, 5.0, 8.0], "max_green_time": [15.0, 20.0, 30.0]})
+        total = len(configs) * args.sweep
+        # Stejná scéna jako bez sweepu; seed dostává každá replikace vlastní (od --seed dál)
+        options = {name: value for name, value in scene_options.items() if name != "seed"}
+        factory = partial(build_scene, **options)
+        runs = sweep(factory, configs, args.sweep, args.seconds, base_seed=args.seed or 0,
+                     snapshot=args.load_snapshot)
+        for done, (run, results) in enumerate(runs, 1):
+            print(f"[{done}/{total}] {run['params']} seed {run['seed']}: dojelo {run['cars_finished']}, "
+                  f"fronta {run['mean_queue']:.1f}")
+        for row in results.summary():
+            mean, half = row["cars_finished"]
+            print(f"{row['params']}: dojelo {mean:.1f} ± {half:.1f} ({row['runs']} běhů)")
+    elif args.headless:
+        simulation = build_scene(**scene_options)
+        simulation.workers = args.workers
+        simulation.max_dt = args.max_dt
+        if args.load_snapshot:
+            simulation.load_snapshot(args.load_snapshot)
+        if args.record:
+            simulation.attach_recorder(args.record, args.record_interval)
+        stats = simulation.run(args.seconds)
+        if args.save_snapshot:
+            simulation.save_snapshot(args.save_snapshot)
+        simulation.close()
+        if simulation.recorder:
+            simulation.recorder.close()
+        print(f"Čas: {stats['time']:.1f} s | Aut na scéně: {stats['cars_on_road']} | "
+              f"Dojelo do cíle: {stats['cars_finished']} | Prům. rychlost: {stats['avg_speed']:.1f} km/h")
+    else:
+        simulation = build_scene(**scene_options)
+        simulation.workers = args.workers
+        if args.load_snapshot:
+            simulation.load_snapshot(args.load_snapshot)
+        app = simulation.attach_visualizer(1200, 700, time_scale=args.time_scale)
+        app.show_profile = bool(args.profile)
+        app.run()
+    event_log.close()
+    if args.profile:
+        profiler.export_chrome_trace(args.profile)
+        for name, row in sorted(profiler.summary().items()):
+            print(f"{name:18} p50 {row['p50']:.3f} ms | p95 {row['p95']:.3f} ms | p99 {row['p99']:.3f} ms")
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from Traffic_Simulation import (Car, Train, Road, ArrayRoad, MultiLaneRoad, TrafficLight, SmartTrafficLight,
+                                IntersectionController, RailwayController, TrafficGenerator, CAR_FOLLOWING_MODELS,
+                                DIR_RIGHT)
+
+# --- BENCHMARKY HLAVNÍ SMYČKY ---
+# Staví syntetické sítě rostoucí velikosti a měří zvlášť silnice (Road.update),
+# řadiče a generátor. Výsledky jdou uložit do JSONu a porovnat s jiným commitem:
+#
+#   python bench_Traffic_Simulation.py --output po.json
+#   python bench_Traffic_Simulation.py --compare pred.json po.json
+
+SPACING = 25.0 # Rozestup vozidel v metrech při startu
+
+# Sada případů: (vozidel na silnici, počet silnic, semaforů na silnici, podíl chytrých semaforů, kolejí)
+FULL_CASES = [
+    (10, 10, 2, 0.5, 2),
+    (100, 10, 2, 0.5, 2),
+    (1000, 10, 2, 0.5, 2),
+    (10000, 2, 2, 0.5, 1),
+    (100, 50, 2, 0.5, 4),
+    (100, 10, 10, 0.5, 2),
+    (100, 10, 10, 1.0, 0),
+    (1000, 10, 0, 0.0, 0),
+]
+QUICK_CASES = [
+    (10, 4, 2, 0.5, 1),
+    (100, 4, 2, 0.5, 1),
+    (1000, 2, 2, 0.5, 1),
+]
+
+
+def case_name(vehicles, roads, lights, smart, rails):
+    return f"v{vehicles}_r{roads}_l{lights}_s{smart:g}_t{rails}"
+
+
+def build_network(vehicles, roads, lights, smart, rails, road_class=Road, model=None):
+    # Syntetická síť: silnice plné aut, semafory rovnoměrně po délce, koleje s vlaky.
+    # Obyčejné semafory řídí po dvojicích IntersectionController, chytré se řídí samy.
+    length = int(vehicles * SPACING + 500)
+    road_list = []
+    plain_lights = []
+    for _ in range(roads):
+        road = road_class(length, model=model)
+        for i in range(lights):
+            position = (i + 1) * length / (lights + 1)
+            if i < round(lights * smart):
+                road.add_traffic_light(SmartTrafficLight(position))
+            else:
+                light = TrafficLight(position)
+                road.add_traffic_light(light)
+                plain_lights.append(light)
+        for i in range(vehicles):
+            road.add_vehicle(Car(speed=20.0, position=i * SPACING, direction=DIR_RIGHT))
+        road_list.append(road)
+
+    controllers = []
+    for i in range(0, len(plain_lights) - 1, 2):
+        controllers.append(IntersectionController([plain_lights[i]], [plain_lights[i + 1]]))
+
+    tracks = []
+    rail_class = Road if road_class is MultiLaneRoad else road_class # Vlaky jezdí po jedné koleji
+    for _ in range(rails):
+        track = rail_class(length, road_type="rail")
+        for i in range(max(1, vehicles // 50)):
+            track.add_vehicle(Train(speed=40.0, position=i * 300.0, direction=DIR_RIGHT))
+        tracks.append(track)
+    # Každá kolej zavírá přejezd na jedné silnici (semafor na 1/3 délky)
+    for track, road in zip(tracks, road_list):
+        crossing = TrafficLight(length / 3)
+        road.add_traffic_light(crossing)
+        controllers.append(RailwayController([track], [crossing], crossing_point=length / 3))
+
+    all_roads = road_list + tracks
+    generator = TrafficGenerator(all_roads, seed=0)
+    return all_roads, controllers, generator
+
+
+def run_case(vehicles, roads, lights, smart, rails, dt=0.016, min_seconds=0.5, max_ticks=2000,
+             road_class=Road, model=None):
+    # Krokuje síť, dokud neuplyne min_seconds reálného času (nebo max_ticks kroků).
+    all_roads, controllers, generator = build_network(vehicles, roads, lights, smart, rails, road_class, model)
+    road_time = controller_time = generator_time = 0.0
+    vehicle_updates = 0
+    ticks = 0
+    clock = time.perf_counter
+    started = clock()
+    while ticks < max_ticks and (clock() - started) < min_seconds:
+        t0 = clock()
+        generator.update(dt)
+        t1 = clock()
+        for road in all_roads:
+            vehicle_updates += road.vehicle_count()
+            road.advance(dt) # Jako v simulaci: prázdné silnice v klidu se přeskakují
+        t2 = clock()
+        for controller in controllers:
+            controller.update(dt)
+        t3 = clock()
+        generator_time += t1 - t0
+        road_time += t2 - t1
+        controller_time += t3 - t2
+        ticks += 1
+
+    total = road_time + controller_time + generator_time
+    return {
+        "name": case_name(vehicles, roads, lights, smart, rails),
+        "road_class": road_class.__name__,
+        "model": all_roads[0].model.name,
+        "vehicles_per_road": vehicles,
+        "roads": roads,
+        "lights_per_road": lights,
+        "smart_ratio": smart,
+        "rails": rails,
+        "ticks": ticks,
+        "ticks_per_sec": ticks / total,
+        "vehicle_updates_per_sec": vehicle_updates / road_time if road_time else 0.0,
+        "road_ms_per_tick": 1000 * road_time / ticks,
+        "controller_ms_per_tick": 1000 * controller_time / ticks,
+        "generator_ms_per_tick": 1000 * generator_time / ticks,
+    }
+
+
+def environment():
+    # Kde a na čem se měřilo (aby šly výsledky porovnat).
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def compare(old, new, threshold=0.10):
+    # Porovná dva výsledky (slovníky z JSONu). Vrací řádky (název, starý, nový, změna, regrese?).
+    old_results = {(r["name"], r["road_class"], r.get("model", "legacy")): r for r in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = old_results.get((result["name"], result["road_class"], result.get("model", "legacy")))
+        if before is None:
+            continue
+        change = result["ticks_per_sec"] / before["ticks_per_sec"] - 1.0
+        rows.append((result["name"], result["road_class"], before["ticks_per_sec"], result["ticks_per_sec"],
+                     change, change < -threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark smyčky simulace dopravy")
+    parser.add_argument("--quick", action="store_true", help="Jen malé případy (pár sekund)")
+    parser.add_argument("--array", action="store_true", help="Měřit ArrayRoad místo Road")
+    parser.add_argument("--multilane", action="store_true", help="Měřit MultiLaneRoad (2 pruhy) místo Road")
+    parser.add_argument("--model", choices=sorted(CAR_FOLLOWING_MODELS), default="legacy",
+                        help="Model sledování vozidla na silnicích")
+    parser.add_argument("--dt", type=float, default=0.016, help="Krok simulace v sekundách")
+    parser.add_argument("--seconds", type=float, default=0.5, help="Minimální doba měření jednoho případu")
+    parser.add_argument("--output", metavar="SOUBOR", help="Uložit výsledky do JSONu")
+    parser.add_argument("--compare", nargs=2, metavar=("PŘED", "PO"), help="Porovnat dva uložené výsledky")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Pokles ticks/s, který je regrese (0.10 = 10 %%)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        for name, road_class, before, after, change, regression in rows:
+            flag = "  REGRESE" if regression else ""
+            print(f"{name:28} {road_class:9} {before:10.1f} -> {after:10.1f} ticks/s ({change:+.1%}){flag}")
+        return 1 if any(row[5] for row in rows) else 0
+
+    road_class = ArrayRoad if args.array else MultiLaneRoad if args.multilane else Road
+    results = []
+    for case in (QUICK_CASES if args.quick else FULL_CASES):
+        result = run_case(*case, dt=args.dt, min_seconds=args.seconds, road_class=road_class,
+                          model=CAR_FOLLOWING_MODELS[args.model]())
+        results.append(result)
+        print(f"{result['name']:28} {result['ticks_per_sec']:10.1f} ticks/s  "
+              f"{result['vehicle_updates_per_sec']:12.0f} vozidel/s  "
+              f"silnice {result['road_ms_per_tick']:.3f} ms  řadiče {result['controller_ms_per_tick']:.3f} ms  "
+              f"generátor {result['generator_ms_per_tick']:.3f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
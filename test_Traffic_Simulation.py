@@ -1,5 +1,10 @@
+import json
+import os
+import subprocess
+import sys
+
 import pytest
-from Traffic_Simulation import Vehicle, Car, Road, DIR_RIGHT
+from Traffic_Simulation import Vehicle, Car, Bus, Truck, Train, Road, ArrayRoad, TrafficLight, CyclicTrafficLight, SmartTrafficLight, DetectionZone, SmartIntersectionController, IntersectionController, RailwayController, Simulation, SimulationClock, TrafficGenerator, build_demo_simulation, confidence_interval, parameter_grid, random_search, sweep, EventLog, FileSink, event_log, INFO, EVENT_SPAWN, EVENT_EXIT, EVENT_CROSSING_CLOSE, read_trajectories, TrajectoryReplay, Visualizer, Profiler, profiler, MultiLaneRoad, EVENT_LANE_CHANGE, RoadNetwork, build_grid_simulation, CarFollowingModel, LegacyModel, IDMModel, ScenarioError, read_scenario, validate_scenario, build_scenario, DIR_RIGHT
 
 # --- TESTY TŘÍDY VEHICLE ---
 
@@ -49,6 +54,28 @@ def test_braking():
     v.brake(deceleration=10, dt=1.0)
     assert v.speed == 0
 
+def test_vehicle_slots_and_class_constants():
+    # Vozidla nemají __dict__, délka, barva a zrychlení jsou konstanty třídy.
+    car = Car(speed=20, position=0, direction=DIR_RIGHT)
+    assert not hasattr(car, "__dict__")
+    with pytest.raises(AttributeError):
+        car.nickname = "x"
+    assert car.get_length() == car.length == Car.length == 10
+    assert car.acceleration == 7.0 and car.color == (0, 100, 255)
+    assert Train(speed=40, position=0, direction=DIR_RIGHT).length == 120.0
+    assert Vehicle(position=0, speed=10, acceleration=2, direction=DIR_RIGHT).acceleration == 2
+
+def test_vehicle_pickle_roundtrip():
+    # Vozidla se posílají do pracovních procesů - stav musí projít přes pickle.
+    import pickle
+    car = Car(speed=20, position=35.5, direction=DIR_RIGHT)
+    car.stop()
+    copy = pickle.loads(pickle.dumps(car))
+    assert (copy.id, copy.position, copy.speed, copy.max_speed, copy.stopped) == (car.id, 35.5, 0, 20, True)
+    assert copy.acceleration == 7.0
+    base = pickle.loads(pickle.dumps(Vehicle(position=0, speed=10, acceleration=2, direction=DIR_RIGHT)))
+    assert base.acceleration == 2
+
 # --- TESTY INTERAKCÍ (Mezery) ---
 
 def test_get_distance_to():
@@ -81,6 +108,48 @@ def test_road_add_vehicle():
     assert len(road.vehicles) == 1
     assert road.vehicles[0] == car
 
+def test_road_keeps_vehicles_sorted():
+    # Silnice drží vozidla seřazená podle pozice bez řazení v každém kroku.
+    road = Road(length=1000)
+    middle = Car(speed=10, position=200, direction=DIR_RIGHT)
+    front = Car(speed=10, position=500, direction=DIR_RIGHT)
+    tail = Car(speed=10, position=-10, direction=DIR_RIGHT)
+    for car in (middle, front, tail):
+        road.add_vehicle(car)
+
+    assert list(road.vehicles) == [tail, middle, front]
+    assert road.has_entry_space(40.0) is False
+
+def test_road_repairs_order_after_overtaking():
+    # Pokud auto předjede auto před sebou, pořadí se opraví (záložní insertion sort).
+    road = Road(length=1000)
+    slow = Car(speed=10, position=100, direction=DIR_RIGHT)
+    fast = Car(speed=10, position=300, direction=DIR_RIGHT)
+    road.add_vehicle(slow)
+    road.add_vehicle(fast)
+
+    slow.position = 400 # "Předjetí" mimo fyziku silnice
+    road.update(dt=0.1)
+    assert list(road.vehicles) == [fast, slow]
+
+def test_lights_ahead_uses_spatial_index():
+    # Auto "vidí" jen semafory 0-100 m před sebou, i když jich silnice má desítky.
+    road = Road(length=5000)
+    lights = [TrafficLight(position) for position in range(4900, 0, -100)] # Přidané pozpátku
+    for light in lights:
+        road.add_traffic_light(light)
+
+    assert road.traffic_lights == lights # Pořadí přidání zůstává zachované
+    assert road._lights_ahead(1250) == [road.traffic_lights[-13]] # Semafor na 1300 m
+    assert road._lights_ahead(1310) == [road.traffic_lights[-14]] # Semafor na 1300 m už je za námi
+    assert list(road._lights_ahead(4950)) == []
+
+    # Více semaforů v dosahu vrací v pořadí přidání (přidané pozpátku = sestupně podle pozice)
+    dense = Road(length=1000)
+    for position in (90, 30, 60, 10):
+        dense.add_traffic_light(TrafficLight(position))
+    assert [light.position for light in dense._lights_ahead(0)] == [90, 30, 60, 10]
+
 def test_cars_finished_counter():
     # Ověří, zda silnice počítá auta, která dojela do cíle.
     road = Road(length=100)
@@ -97,4 +166,1101 @@ def test_cars_finished_counter():
     road.update(dt=0.1)
     
     assert road.stats_cars_finished == 1
-    assert len(road.vehicles) == 0 # Mělo by zmizet ze silnice
\ No newline at end of file
+    assert len(road.vehicles) == 0 # Mělo by zmizet ze silnice
+
+# --- TESTY TŘÍDY ARRAYROAD (NumPy) ---
+
+def _fill_road(road):
+    # Stejná sada vozidel a semaforů pro objektovou i "polovou" silnici.
+    road.add_traffic_light(CyclicTrafficLight(300, interval=4.0))
+    road.add_traffic_light(SmartTrafficLight(650, detection_range=60.0))
+    road.add_traffic_light(TrafficLight(900))
+    road.add_vehicle(Car(speed=25, position=0, direction=DIR_RIGHT))
+    road.add_vehicle(Truck(speed=15, position=60, direction=DIR_RIGHT))
+    road.add_vehicle(Bus(speed=20, position=130, direction=DIR_RIGHT))
+    road.add_vehicle(Car(speed=27, position=150, direction=DIR_RIGHT))
+    road.add_vehicle(Train(speed=30, position=400, direction=DIR_RIGHT))
+
+def test_array_road_matches_object_road():
+    # Vektorová silnice musí dávat stejné výsledky jako objektová.
+    pytest.importorskip("numpy")
+    road = Road(length=1000)
+    array_road = ArrayRoad(length=1000)
+    _fill_road(road)
+    _fill_road(array_road)
+
+    for tick in range(4000):
+        if tick % 200 == 0:
+            road.add_vehicle(Car(speed=24, position=-10.0, direction=DIR_RIGHT))
+            array_road.add_vehicle(Car(speed=24, position=-10.0, direction=DIR_RIGHT))
+        road.traffic_lights[2].is_green = (tick // 300) % 2 == 0
+        array_road.traffic_lights[2].is_green = (tick // 300) % 2 == 0
+        road.update(dt=0.016)
+        array_road.update(dt=0.016)
+
+    assert road.stats_cars_finished == array_road.stats_cars_finished > 0
+    assert road.stats_avg_speed == array_road.stats_avg_speed
+    expected = [(type(v), v.position, v.speed, v.stopped, v.is_braking) for v in road.vehicles]
+    actual = [(type(v), v.position, v.speed, v.stopped, v.is_braking) for v in array_road.vehicles]
+    assert actual == expected
+
+def test_array_road_views_stay_vehicle_objects():
+    # Vozidla zůstávají jako objekty (pohledy) a úpravy přes ně se projeví v polích.
+    pytest.importorskip("numpy")
+    road = ArrayRoad(length=100)
+    car = Car(speed=20, position=50, direction=DIR_RIGHT)
+    road.add_vehicle(car)
+    road.update(dt=0.5)
+
+    assert road.vehicles[0] is car
+    assert car.position == 60.0
+    assert not road._arrays_stale # Samotné čtení pole nezneplatní
+
+    car.position = 200 # Teleport za cíl přes pohled
+    road.vehicles_changed()
+    road.update(dt=0.1)
+    assert road.stats_cars_finished == 1
+    assert len(road.vehicles) == 0
+
+# --- TESTY MODELU IDM ---
+
+def _overlapping(road):
+    vehicles = list(road.vehicles)
+    return [a for a, b in zip(vehicles, vehicles[1:]) if a.get_distance_to(b) < 0]
+
+def test_idm_stops_before_red_light():
+    # Kolona s IDM zastaví před červenou a mezery mezi auty zůstanou kladné.
+    road = Road(length=1000, model=IDMModel())
+    light = TrafficLight(300)
+    light.is_green = False
+    road.add_traffic_light(light)
+    for i in range(5):
+        road.add_vehicle(Car(speed=20, position=i * 40.0, direction=DIR_RIGHT))
+
+    for _ in range(1500):
+        road.update(dt=0.02)
+        assert not _overlapping(road)
+
+    assert all(v.stopped and v.speed == 0.0 for v in road.vehicles)
+    assert 295.0 < road.vehicles[-1].position < 300.0
+    assert Road(length=10).model.__class__ is LegacyModel # Výchozí model se nemění
+
+def test_model_must_implement_both_drive_methods():
+    # Model jen s drive() (bez vektorové verze) nejde vytvořit.
+    class HalfModel(CarFollowingModel):
+        def drive(self, road, vehicles, dt, has_zones):
+            return None
+
+    with pytest.raises(TypeError):
+        HalfModel()
+    with pytest.raises(TypeError):
+        CarFollowingModel()
+
+def test_idm_array_road_matches_object_road():
+    # Vektorová verze IDM dává stejné výsledky jako smyčka nad objekty.
+    pytest.importorskip("numpy")
+    model = IDMModel()
+    road = Road(length=1000, model=model)
+    array_road = ArrayRoad(length=1000, model=model)
+    _fill_road(road)
+    _fill_road(array_road)
+
+    for tick in range(1000):
+        if tick % 50 == 0:
+            road.add_vehicle(Car(speed=24, position=-10.0, direction=DIR_RIGHT))
+            array_road.add_vehicle(Car(speed=24, position=-10.0, direction=DIR_RIGHT))
+        road.traffic_lights[2].is_green = (tick // 75) % 2 == 0
+        array_road.traffic_lights[2].is_green = (tick // 75) % 2 == 0
+        road.update(dt=0.064)
+        array_road.update(dt=0.064)
+
+    assert road.stats_cars_finished == array_road.stats_cars_finished > 0
+    expected = [(type(v), v.stopped, v.is_braking) for v in road.vehicles]
+    actual = [(type(v), v.stopped, v.is_braking) for v in array_road.vehicles]
+    assert actual == expected
+    assert [v.position for v in array_road.vehicles] == pytest.approx([v.position for v in road.vehicles])
+    assert [v.speed for v in array_road.vehicles] == pytest.approx([v.speed for v in road.vehicles])
+
+def test_idm_large_step_stays_collision_free():
+    # S krokem 0.5 s IDM nedovolí srážku ani autu vypuštěnému těsně za pomalý kamion.
+    road = Road(length=2000, model=IDMModel())
+    road.add_vehicle(Truck(speed=3, position=60, direction=DIR_RIGHT))
+    road.add_vehicle(Car(speed=25, position=-10, direction=DIR_RIGHT))
+
+    for _ in range(200):
+        road.update(dt=0.5)
+        assert not _overlapping(road)
+
+    car, truck = road.vehicles
+    assert car.speed == pytest.approx(truck.speed, abs=0.1)
+    assert car.get_distance_to(truck) > IDMModel().min_gap
+
+# --- TESTY VÍCEPRUHOVÉ SILNICE ---
+
+def test_multilane_overtakes_slow_vehicle():
+    # Rychlé auto za pomalým kamionem přejede do volného pruhu a předjede ho.
+    road = MultiLaneRoad(length=2000, lanes=2)
+    truck = Truck(speed=10.0, position=100.0, direction=DIR_RIGHT)
+    car = Car(speed=30.0, position=40.0, direction=DIR_RIGHT)
+    road.vehicles = [car, truck]
+    event_log.clear()
+    for _ in range(600):
+        road.update(dt=0.016)
+    assert (car.lane, truck.lane) == (1, 0)
+    assert car.position > truck.position
+    assert len(event_log.events(EVENT_LANE_CHANGE)) == 1
+    assert [v.lane for v in road.lanes[1]] == [1]
+
+def test_multilane_rejects_unsafe_gap():
+    # Vedle auta v cílovém pruhu není místo - auto zůstane za kamionem.
+    road = MultiLaneRoad(length=2000, lanes=2)
+    truck = Truck(speed=10.0, position=100.0, direction=DIR_RIGHT)
+    car = Car(speed=10.0, position=60.0, direction=DIR_RIGHT)
+    blocker = Bus(speed=10.0, position=65.0, direction=DIR_RIGHT)
+    blocker.lane = 1
+    road.vehicles = [car, truck, blocker]
+    road._change_lanes()
+    assert car.lane == 0 and blocker.lane == 1
+
+def test_multilane_entry_and_lane_lists():
+    # Nová vozidla jdou do pruhu s nejvíc místem; vehicles spojuje pruhy podle pozice.
+    road = MultiLaneRoad(length=1000, lanes=3)
+    road.add_vehicle(Car(speed=20, position=30, direction=DIR_RIGHT))
+    road.add_vehicle(Car(speed=20, position=10, direction=DIR_RIGHT))
+    assert road.tail_position() is None # Třetí pruh je ještě prázdný
+    road.add_vehicle(Car(speed=20, position=20, direction=DIR_RIGHT))
+    assert road.tail_position() == 30
+    road.add_vehicle(Car(speed=20, position=0, direction=DIR_RIGHT))
+    assert [len(lane) for lane in road.lanes] == [2, 1, 1]
+    assert [v.position for v in road.vehicles] == [0, 10, 20, 30]
+    assert road.vehicle_count() == 4
+
+    road.update(dt=0.016)
+    for lane in road.lanes:
+        assert all(a.position <= b.position for a, b in zip(lane, lane[1:]))
+
+# --- TESTY SÍTĚ SILNIC ---
+
+def _diamond():
+    # A -> B -> D je kratší (200 m) než A -> C -> D (400 m)
+    network = RoadNetwork()
+    ab = network.connect(Road(100), "A", "B")
+    bd = network.connect(Road(100), "B", "D")
+    ac = network.connect(Road(200), "A", "C")
+    cd = network.connect(Road(200), "C", "D")
+    start = network.connect(Road(100), "S", "A")
+    return network, start, ab, bd, ac, cd
+
+def test_network_routes_shortest_path():
+    network, start, ab, bd, ac, cd = _diamond()
+    network.build_routes()
+    assert network.route(start, "D") == [start, ab, bd]
+    assert network.route(start, "C") == [start, ac]
+    assert bd.routes == {} # Z D už nikam nevede
+
+def test_network_hands_off_vehicles_along_route():
+    network, start, ab, bd, ac, cd = _diamond()
+    sim = Simulation([start, ab, bd, ac, cd], network=network)
+    routed = Car(speed=20, position=0, direction=DIR_RIGHT)
+    routed.destination = "D"
+    start.add_vehicle(routed)
+    local = Car(speed=20, position=-30, direction=DIR_RIGHT) # Bez cíle - skončí na konci silnice
+    start.add_vehicle(local)
+
+    sim.run(seconds=8)
+    assert routed in ab.vehicles and local not in ab.vehicles
+    assert start.stats_cars_finished == 1
+    sim.run(seconds=10)
+    assert bd.stats_cars_finished == 1 and network.handoffs == 2
+    assert sum(len(r.vehicles) for r in sim.roads) == 0
+
+def test_network_waits_for_entry_space():
+    network, start, ab, bd, ac, cd = _diamond()
+    sim = Simulation([start, ab, bd, ac, cd], network=network)
+    blocker = Truck(speed=0.0, position=5, direction=DIR_RIGHT)
+    blocker.stop()
+    blocker.current_wait = 1e9 # Stojí na začátku A -> B
+    ab.add_vehicle(blocker)
+    car = Car(speed=20, position=60, direction=DIR_RIGHT)
+    car.destination = "D"
+    start.add_vehicle(car)
+
+    sim.run(seconds=5)
+    assert car in start.vehicles and car.position - car.length < start.length + 1.0 # Stojí, kde vyjelo
+    assert network.handoffs == 0 and start.stats_cars_finished == 0
+
+def test_blocked_vehicle_never_backs_onto_follower():
+    # Dlouhé vozidlo, které čeká na místo v síti, nesmí couvnout na vozidlo těsně za sebou
+    # ani se znovu ohlásit posluchačům silnice.
+    network, start, ab, bd, ac, cd = _diamond()
+    sim = Simulation([start, ab, bd, ac, cd], network=network)
+    blocker = Truck(speed=0.0, position=5, direction=DIR_RIGHT)
+    blocker.stop()
+    blocker.current_wait = 1e9
+    ab.add_vehicle(blocker)
+    added = []
+    start.add_listener(lambda road, vehicle: added.append(vehicle))
+    truck = Truck(speed=20, position=60, direction=DIR_RIGHT)
+    truck.destination = "D"
+    follower = Car(speed=20, position=24, direction=DIR_RIGHT)
+    follower.destination = "D"
+    start.add_vehicle(follower)
+    start.add_vehicle(truck)
+
+    positions = []
+    for _ in range(300):
+        sim.step()
+        positions.append(truck.position)
+        assert follower.position <= truck.position - truck.length
+    assert positions == sorted(positions) # Nikdy necouvne
+    assert added == [follower, truck] and network.handoffs == 0
+
+def test_grid_parallel_matches_serial(tmp_path):
+    serial = build_grid_simulation(columns=3, rows=2, seed=5)
+    serial.run(seconds=60)
+    parallel = build_grid_simulation(columns=3, rows=2, seed=5)
+    parallel.workers = 2
+    try:
+        parallel.run(seconds=60)
+        assert parallel.network.handoffs == serial.network.handoffs > 0
+        assert _vehicle_states(parallel) == _vehicle_states(serial)
+        assert [[v.destination for v in r.vehicles] for r in parallel.roads] == \
+               [[v.destination for v in r.vehicles] for r in serial.roads]
+    finally:
+        parallel.close()
+
+    # Cíle vozidel přežijí snapshot
+    serial.save_snapshot(tmp_path / "grid.snap")
+    restored = build_grid_simulation(columns=3, rows=2)
+    restored.load_snapshot(tmp_path / "grid.snap")
+    assert [[v.destination for v in r.vehicles] for r in restored.roads] == \
+           [[v.destination for v in r.vehicles] for r in serial.roads]
+
+def test_parallel_close_keeps_handoff_from_last_tick():
+    # Vozidlo předané sítí v posledním kroku čeká na další krok - close() ho nesmí ztratit.
+    parallel = build_grid_simulation(columns=2, rows=1, seed=3)
+    parallel.workers = 2
+    try:
+        while not any(road.remote and road.remote.new_vehicles for road in parallel.roads):
+            parallel.step()
+    finally:
+        parallel.close()
+    serial = build_grid_simulation(columns=2, rows=1, seed=3)
+    for _ in range(parallel.ticks):
+        serial.step()
+    assert _vehicle_states(parallel) == _vehicle_states(serial)
+    assert parallel.stats() == serial.stats()
+
+# --- TESTY HEADLESS SIMULACE ---
+
+def test_import_does_not_load_pygame():
+    # Import modulu nesmí načíst pygame (to se děje až ve Visualizeru).
+    code = "import sys, Traffic_Simulation; print('pygame' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+def test_sweep_rejects_grid_on_command_line():
+    # Mřížka nemá chytrou křižovatku, jejíž zelenou sweep mění - chyba místo tiché ukázkové scény.
+    result = subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "Traffic_Simulation.py"),
+                             "--sweep", "1", "--grid"], capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "--grid" in result.stderr
+
+def test_simulation_steps_with_fixed_dt():
+    # Simulation krokuje silnice i generátor s pevným dt.
+    road = Road(length=1000)
+    sim = Simulation([road], TrafficGenerator([road]), dt=0.1)
+    stats = sim.run(seconds=10)
+
+    assert sim.ticks == 100
+    assert stats["time"] == pytest.approx(10.0)
+    assert stats["cars_on_road"] == len(road.vehicles) > 0
+
+def test_demo_simulation_runs_headless():
+    # Ukázková síť jde odsimulovat bez okna.
+    sim = build_demo_simulation()
+    stats = sim.run(seconds=60)
+    assert stats["cars_finished"] > 0
+    assert "pygame" not in sys.modules or sim.visualizer is None
+
+def test_calendar_wakes_controller_only_on_phase_change():
+    # Řadič s pevnými časy se volá jen při změně fáze, přepíná ale ve stejných chvílích jako dřív.
+    def build():
+        road = Road(length=1000)
+        light_h, light_v = TrafficLight(300), TrafficLight(600)
+        road.add_traffic_light(light_h)
+        road.add_traffic_light(light_v)
+        return road, IntersectionController([light_h], [light_v], green_duration=10.0, red_clearance=2.0)
+
+    road, ctrl = build()
+    _, polled = build()
+    calls = []
+    update = ctrl.update
+    ctrl.update = lambda dt: (calls.append(dt), update(dt))
+    sim = Simulation([road], controllers=[ctrl], dt=0.25)
+    for _ in range(200): # 50 s
+        sim.step()
+        polled.update(0.25)
+        assert ctrl.state == polled.state
+
+    assert len(calls) == 8 # Fáze se střídají po 10 + 2 s
+    assert sum(calls) == pytest.approx(48.0)
+
+def test_calendar_switches_cyclic_lights_and_generator():
+    # Časový semafor a generátor z kalendáře dávají stejnou dopravu jako volání v každém kroku.
+    def build():
+        road = Road(length=1000)
+        road.add_traffic_light(CyclicTrafficLight(500, interval=7.0))
+        return road, TrafficGenerator([road], seed=3)
+
+    road, generator = build()
+    polled_road, polled_generator = build()
+    sim = Simulation([road], generator, dt=0.25)
+    assert road.traffic_lights[0].scheduled and not polled_road.traffic_lights[0].scheduled
+    for _ in range(400):
+        sim.step()
+        polled_generator.update(0.25)
+        polled_road.update(0.25)
+        assert road.traffic_lights[0].is_green == polled_road.traffic_lights[0].is_green
+
+    assert [(v.id - road.vehicles[0].id, v.position) for v in road.vehicles] == \
+           [(v.id - polled_road.vehicles[0].id, v.position) for v in polled_road.vehicles]
+    assert sim.calendar.next_time() > sim.time
+
+# --- TESTY GENERÁTORU DOPRAVY ---
+
+def _spawns(generator, seconds):
+    for _ in range(int(seconds / 0.1)):
+        generator.update(0.1)
+    return [[(type(v).__name__, v.speed) for v in road.vehicles] for road in generator.roads]
+
+def test_generator_same_seed_same_traffic():
+    a = TrafficGenerator([Road(5000), Road(5000, road_type="rail")], seed=7)
+    b = TrafficGenerator([Road(5000), Road(5000, road_type="rail")], seed=7)
+    c = TrafficGenerator([Road(5000), Road(5000, road_type="rail")], seed=8)
+    assert _spawns(a, 100) == _spawns(b, 100)
+    assert _spawns(a, 100) != _spawns(c, 100)
+
+def test_generator_roads_have_independent_streams():
+    # Doprava na silnici nezávisí na tom, jestli je sousední silnice ucpaná.
+    free = TrafficGenerator([Road(5000), Road(5000)], seed=3)
+    blocked = TrafficGenerator([Road(5000), Road(5000)], seed=3)
+    blocked.roads[1].add_vehicle(Car(speed=0, position=5, direction=DIR_RIGHT)) # Vjezd zablokovaný
+    blocked.roads[1].vehicles[0].max_speed = 0
+    assert _spawns(free, 60)[0] == _spawns(blocked, 60)[0]
+
+def test_generator_predraw_columns():
+    road, rail = Road(1000), Road(1000, road_type="rail")
+    gen = TrafficGenerator([road, rail], seed=1)
+    types, speeds, intervals = gen.predraw(road, 1000)
+    assert len(types) == len(speeds) == len(intervals) == 1000
+    assert set(types) == {Car, Truck, Bus}
+    assert all(3.0 <= t <= 7.0 for t in intervals)
+    assert all(13 <= sp <= 27 for sp in speeds)
+    assert set(gen.predraw(rail, 10)[0]) == {Train}
+
+# --- TESTY DETEKČNÍCH ZÓN ---
+
+def test_detection_zone_counts_vehicles_crossing_boundaries():
+    # Silnice sama počítá vozidla v zóně při vjezdu a výjezdu.
+    road = Road(length=300)
+    zone = road.add_zone(DetectionZone(100, 200))
+    car = Car(speed=50, position=90, direction=DIR_RIGHT)
+    road.add_vehicle(car)
+    assert zone.count == 0
+
+    road.update(dt=0.5) # 90 -> 115 m: vjezd do zóny
+    assert zone.count == 1
+    road.update(dt=2.0) # 115 -> 215 m: výjezd ze zóny
+    assert zone.count == 0
+
+def test_smart_light_reads_zone_on_road():
+    # Chytrý semafor na silnici pouští zelenou podle své detekční zóny.
+    road = Road(length=1000)
+    light = SmartTrafficLight(500, detection_range=50.0)
+    road.add_traffic_light(light)
+    road.add_vehicle(Car(speed=10, position=460, direction=DIR_RIGHT))
+
+    road.update(dt=0.1)
+    assert light.zone.count == 1
+    assert light.is_green is True
+
+def test_smart_intersection_counts_queue_from_zones():
+    # Řadič čte délku fronty z počítadel zón místo procházení všech aut.
+    road_h = Road(length=1000)
+    road_v = Road(length=1000)
+    light_h = TrafficLight(500)
+    light_v = TrafficLight(500)
+    road_h.add_traffic_light(light_h)
+    road_v.add_traffic_light(light_v)
+    ctrl = SmartIntersectionController([road_h], [road_v], [light_h], [light_v])
+
+    for position in (420, 440, 460, 480):
+        road_v.add_vehicle(Car(speed=0, position=position, direction=DIR_RIGHT))
+    road_h.add_vehicle(Car(speed=0, position=100, direction=DIR_RIGHT)) # Mimo zónu
+
+    assert ctrl.count_queue([road_v]) == 4
+    assert ctrl.count_queue([road_h]) == 0
+
+def test_smart_intersection_keeps_max_green_with_adaptive_step():
+    # Ani dlouhý adaptivní krok nepřeskočí konec maximální zelené.
+    road_h, road_v = Road(length=1000), Road(length=1000)
+    light_h, light_v = TrafficLight(500), TrafficLight(500)
+    road_h.add_traffic_light(light_h)
+    road_v.add_traffic_light(light_v)
+    ctrl = SmartIntersectionController([road_h], [road_v], [light_h], [light_v], max_green_time=20.0)
+    sim = Simulation([road_h, road_v], controllers=[ctrl], dt=0.1, max_dt=5.0)
+    changes = []
+    while sim.time < 60:
+        before = ctrl.state
+        sim.step()
+        if ctrl.state != before:
+            changes.append((ctrl.state, sim.time))
+
+    assert [state for state, _ in changes[:2]] == ["TO_VERTICAL", "V_GREEN"]
+    assert changes[0][1] == pytest.approx(20.1) # Přepne první krok po max_green_time, jako s pevným krokem
+    assert sim.ticks < 200
+
+def _run_crossing(tracks, controllers, seconds, dt=0.25):
+    # Posouvá koleje a řadiče a vrací, kdy se který řadič zavřel a otevřel.
+    changes = []
+    for tick in range(int(round(seconds / dt))):
+        for track in tracks:
+            track.update(dt)
+        for index, ctrl in enumerate(controllers):
+            before = ctrl.state
+            ctrl.update(dt)
+            if ctrl.state != before:
+                changes.append((index, ctrl.state, round((tick + 1) * dt, 1)))
+    return changes
+
+def test_railway_controller_schedules_barrier_from_arrival():
+    # Přejezd se zavře warning_time před příjezdem vlaku a otevře clearance_time po průjezdu jeho konce.
+    track = Road(length=1000, road_type="rail")
+    track_back = Road(length=1000, road_type="rail", reverse=True)
+    light = TrafficLight(370)
+    ctrl = RailwayController([track, track_back], [light], crossing_point=400)
+    assert [(z.start, z.end) for z in (*track.zones, *track_back.zones)] == [(200, 520), (400, 720)]
+
+    track_back.add_vehicle(Train(speed=40, position=200, direction=DIR_RIGHT)) # Přejezd na 600 m
+    assert len(ctrl.events) == 2
+
+    # Čelo na přejezdu za 10 s, konec vlaku (120 m) za 13 s
+    assert _run_crossing([track, track_back], [ctrl], 20.0) == [(0, "CLOSED", 6.0), (0, "OPEN", 14.0)]
+    assert light.is_green and not ctrl.events
+
+def test_railway_controller_waits_for_slowed_train():
+    # Když vlak oproti předpovědi zpomalí, pojistná zóna otevření odloží.
+    track = Road(length=1000, road_type="rail")
+    ctrl = RailwayController([track], [TrafficLight(370)], crossing_point=400)
+    train = Train(speed=40, position=0, direction=DIR_RIGHT)
+    track.add_vehicle(train)
+
+    changes = _run_crossing([track], [ctrl], 7.0)
+    train.speed = 20.0 # Vlak u přejezdu zpomalí na polovinu
+    changes += _run_crossing([track], [ctrl], 15.0)
+
+    # Podle předpovědi by se otevíralo v čase 14 s, vlak ale opustí zónu (520 m) až v 19 s
+    assert changes[0] == (0, "CLOSED", 6.0)
+    assert changes[1][1] == "OPEN" and 12.0 <= changes[1][2] <= 12.5
+    assert len(changes) == 2
+
+def test_railway_line_with_many_crossings():
+    # Každý přejezd na dlouhé trati je zavřený jen kolem průjezdu vlaku.
+    track = Road(length=10000, road_type="rail")
+    crossings = [RailwayController([track], [TrafficLight(100)], crossing_point=1000 * (i + 1)) for i in range(10)]
+    track.add_vehicle(Train(speed=40, position=0, direction=DIR_RIGHT))
+
+    changes = _run_crossing([track], crossings, 260.0, dt=0.5)
+    assert [(index, state) for index, state, _ in changes] == \
+           [(i, state) for i in range(10) for state in ("CLOSED", "OPEN")]
+    assert [time for index, state, time in changes if state == "CLOSED"] == [21.0 + 25 * i for i in range(10)]
+
+# --- TESTY PARALELNÍHO KROKOVÁNÍ ---
+
+def _vehicle_states(sim):
+    sim.sync()
+    return [[(type(v).__name__, v.position, v.speed, v.stopped, v.is_braking, v.current_wait)
+             for v in road.vehicles] for road in sim.roads]
+
+def test_parallel_stepping_matches_serial(capsys):
+    # Paralelní běh musí dát bit po bitu stejný výsledek jako sériový (při stejném seedu).
+    serial = build_demo_simulation(seed=42)
+    serial.run(seconds=40)
+
+    parallel = build_demo_simulation(seed=42)
+    parallel.workers = 3
+    try:
+        parallel.run(seconds=40)
+        assert _vehicle_states(parallel) == _vehicle_states(serial)
+        assert [r.stats_cars_finished for r in parallel.roads] == [r.stats_cars_finished for r in serial.roads]
+        assert [l.is_green for r in parallel.roads for l in r.traffic_lights] == \
+               [l.is_green for r in serial.roads for l in r.traffic_lights]
+    finally:
+        parallel.close()
+
+    # Po ukončení procesů běží simulace dál sériově ze stejného stavu
+    serial.run(seconds=5)
+    parallel.run(seconds=5)
+    assert _vehicle_states(parallel) == _vehicle_states(serial)
+
+def test_adaptive_parallel_matches_serial():
+    # Adaptivní krok vyjde v pracovních procesech stejně jako v sériovém běhu.
+    def build():
+        sim = build_demo_simulation(seed=7, car_interval=(60.0, 120.0))
+        sim.max_dt = 0.5
+        return sim
+
+    serial = build()
+    serial.run(seconds=120)
+    parallel = build()
+    parallel.workers = 2
+    try:
+        parallel.run(seconds=120)
+        assert parallel.ticks == serial.ticks < 120 / 0.016
+        assert _vehicle_states(parallel) == _vehicle_states(serial)
+    finally:
+        parallel.close()
+
+# --- TESTY KLIDU A ADAPTIVNÍHO KROKU ---
+
+def test_empty_road_is_skipped_until_vehicle_arrives():
+    # Prázdná silnice proběhne jednou (chytrý semafor zhasne zelenou) a pak se přeskakuje.
+    road = Road(length=1000)
+    light = SmartTrafficLight(500)
+    road.add_traffic_light(light)
+    light.is_green = True
+    assert road.advance(0.1)
+    assert not light.is_green
+    assert not road.advance(0.1)
+
+    road.add_vehicle(Car(speed=20, position=0, direction=DIR_RIGHT))
+    assert road.advance(0.1)
+    assert road.vehicles[0].position > 0
+
+    # Semafor, který počítá čas sám, silnici uspat nedovolí
+    timed = Road(length=1000)
+    timed.add_traffic_light(CyclicTrafficLight(500, interval=1.0))
+    assert timed.advance(0.6) and timed.advance(0.6)
+    assert timed.traffic_lights[0].is_green is False
+
+def test_adaptive_step_grows_on_free_road_and_shrinks_near_red():
+    # Volná silnice jede velkými vlastními kroky, u červené se krok silnice vrátí na základní dt.
+    # Auto, které na červenou už stojí, zase nic nebrzdí. Globální krok to neomezuje.
+    road = Road(length=2000)
+    light = TrafficLight(1500)
+    light.is_green = False
+    road.add_traffic_light(light)
+    car = Car(speed=20, position=0, direction=DIR_RIGHT)
+    road.add_vehicle(car)
+    sim = Simulation([road], dt=0.05, max_dt=0.5)
+    steps = []
+    update = road.update
+    road.update = lambda dt: (steps.append((car.position, car.stopped, dt)), update(dt))
+
+    sim.run(seconds=200)
+    assert sim.ticks <= 401 # První krok je základní, silnice se ještě neměřila
+    assert steps[5][2] == pytest.approx(0.5)
+    approach = [dt for position, stopped, dt in steps if position > 1400 and not stopped]
+    assert approach and all(dt == pytest.approx(0.05) for dt in approach)
+    assert car.stopped and 1490 < car.position < 1500
+    assert steps[-2][2] == pytest.approx(0.5) # Poslední krok jen dorovná konec běhu
+
+def test_adaptive_step_is_per_road():
+    # Auto u červené zpomalí jen svou silnici; na ostatních a v globálním kroku zůstávají dlouhé kroky.
+    busy, free = Road(length=2000), Road(length=2000)
+    light = TrafficLight(300)
+    light.is_green = False
+    busy.add_traffic_light(light)
+    busy.add_vehicle(Car(speed=20, position=150, direction=DIR_RIGHT))
+    free.add_vehicle(Car(speed=20, position=0, direction=DIR_RIGHT))
+    sim = Simulation([busy, free], dt=0.05, max_dt=0.5)
+    counts = {busy: 0, free: 0}
+    def counted(road, update):
+        def wrapper(dt):
+            counts[road] += 1
+            update(dt)
+        return wrapper
+    for road in counts:
+        road.update = counted(road, road.update)
+    sim.run(seconds=20)
+    assert sim.ticks <= 41
+    assert counts[free] <= 41 < counts[busy]
+    assert busy.vehicles[0].stopped
+
+def test_adaptive_step_matches_fixed_when_nothing_grows():
+    # Když žádná silnice dlouhý krok nedovolí, adaptivní běh je krok po kroku totožný s pevným dt.
+    fixed = build_demo_simulation(seed=4)
+    fixed.run(seconds=30)
+    adaptive = build_demo_simulation(seed=4)
+    adaptive.max_dt = 0.016
+    adaptive.run(seconds=30)
+    assert adaptive.ticks == fixed.ticks
+    assert _vehicle_states(adaptive) == _vehicle_states(fixed)
+
+def test_adaptive_step_on_demo_network():
+    # Ukázková síť s běžnou dopravou: globálních kroků je řádově méně a výsledek zůstává blízko pevného dt.
+    fixed = build_demo_simulation(seed=3)
+    expected = fixed.run(seconds=120)
+    adaptive = build_demo_simulation(seed=3)
+    adaptive.max_dt = 1.0
+    stats = adaptive.run(seconds=120)
+    assert stats["time"] == pytest.approx(120)
+    assert stats["ticks"] < expected["ticks"] / 4
+    assert abs(stats["cars_finished"] - expected["cars_finished"]) <= 2
+
+def test_adaptive_step_waits_for_acceleration():
+    # Vozidlo, které ještě zrychluje, dlouhý krok nedovolí; IDM nepřestřelí maximálku.
+    for road in (Road(length=50000, model=IDMModel()), ArrayRoad(length=50000, model=IDMModel())):
+        car = Car(speed=5, position=0, direction=DIR_RIGHT)
+        car.max_speed = 25.0
+        road.add_vehicle(car)
+        sim = Simulation([road], dt=0.05, max_dt=2.0)
+        sim.step()
+        assert road.free_step(2.0) < 0.1 # Rychlost se za krok smí změnit nejvýš o 2 % maximálky
+        top = 0.0
+        for _ in range(200):
+            sim.step()
+            top = max(top, max(v.speed for v in road.vehicles))
+        assert top <= 25.0
+        assert road.free_step(2.0) == pytest.approx(2.0)
+
+# --- TESTY HODIN SIMULACE ---
+
+def test_simulation_clock_fixed_substeps():
+    # Počet kroků závisí jen na uplynulém čase, ne na počtu snímků.
+    sim = Simulation([], dt=0.01)
+    clock = SimulationClock(sim)
+    assert clock.advance(0.035) == 3
+    assert clock.advance(0.005) == 1 # Zbytek z minula se přičte
+    assert sim.ticks == 4
+    assert sim.time == pytest.approx(0.04)
+
+def test_simulation_clock_time_scale_and_pause():
+    sim = Simulation([], dt=0.01)
+    clock = SimulationClock(sim, time_scale=100)
+    assert clock.advance(0.1) == 1000 # 0.1 s reálně = 10 s simulace
+    clock.paused = True
+    assert clock.advance(1.0) == 0
+    assert sim.ticks == 1000
+
+def test_simulation_clock_caps_backlog():
+    # Když simulace nestíhá, nesmí dluh kroků růst donekonečna.
+    sim = Simulation([], dt=0.01)
+    clock = SimulationClock(sim, time_scale=1000, max_steps=50)
+    assert clock.advance(1.0) == 50
+    assert clock.behind
+    assert clock.accumulator <= 50 * sim.dt
+
+# --- TESTY VIZUALIZACE ---
+
+def test_visualizer_caches_static_layers(monkeypatch):
+    # Statický podklad se kreslí jednou a překreslí se jen při změně silnic.
+    pygame = pytest.importorskip("pygame")
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    sim = build_demo_simulation()
+    app = sim.attach_visualizer(1200, 700)
+    pygame.time.set_timer(pygame.QUIT, 300)
+    app.run()
+    background = app.background
+    assert background is not None and app.static_key == app.road_layout()
+
+    # Bez změny sítě zůstává stejný podklad
+    pygame.time.set_timer(pygame.QUIT, 200)
+    app.run()
+    assert app.background is background
+
+    # Nová silnice -> podklad se postaví znovu
+    app.roads = app.roads + [Road(300, 'V', 900, 0)]
+    pygame.time.set_timer(pygame.QUIT, 200)
+    app.run()
+    assert app.background is not background
+    pygame.quit()
+
+# --- TESTY SWEEPŮ ---
+
+def test_parameter_grid_and_random_search():
+    grid = parameter_grid({"a": [1, 2], "b": [3, 4, 5]})
+    assert len(grid) == 6
+    assert {"a": 2, "b": 5} in grid
+
+    configs = random_search({"a": (1.0, 2.0), "b": ["x", "y"]}, samples=20, seed=1)
+    assert len(configs) == 20
+    assert all(1.0 <= c["a"] <= 2.0 and c["b"] in ("x", "y") for c in configs)
+    assert configs == random_search({"a": (1.0, 2.0), "b": ["x", "y"]}, samples=20, seed=1)
+
+def test_confidence_interval():
+    mean, half = confidence_interval([10, 12, 14])
+    assert mean == 12
+    assert half == pytest.approx(4.303 * 2 / 3 ** 0.5) # t(2) * s / sqrt(n)
+    assert confidence_interval([5, 5, 5, 5]) == (5, 0.0)
+    # df = 11 není v tabulce - bere se t(10) = 2.228, ne menší t(12)
+    values = [0, 1] * 6
+    half = confidence_interval(values)[1]
+    std = (sum((x - 0.5) ** 2 for x in values) / 11) ** 0.5
+    assert half == pytest.approx(2.228 * std / 12 ** 0.5)
+
+def test_sweep_streams_reproducible_runs():
+    configs = [{"min_green_time": 3.0}, {"min_green_time": 8.0}]
+    runs = []
+    for run, results in sweep(build_demo_simulation, configs, replications=2, seconds=20, processes=2):
+        runs.append(run)
+        assert sum(len(r) for r in results.runs) == len(runs) # Průběžné výsledky
+    assert len(runs) == 4
+    assert [row["runs"] for row in results.summary()] == [2, 2]
+
+    # Stejný seed a parametry -> stejný výsledek jako sériový běh
+    first = next(r for r in runs if r["config"] == 0 and r["seed"] == 0)
+    simulation = build_demo_simulation(min_green_time=3.0, seed=0)
+    assert simulation.run(20)["cars_finished"] == first["cars_finished"]
+
+def test_sweep_can_stop_early():
+    configs = parameter_grid({"min_green_time": [3.0, 5.0, 8.0]})
+    for done, (run, results) in enumerate(sweep(build_demo_simulation, configs, replications=3, seconds=5), 1):
+        if done == 2:
+            break
+    assert sum(r["runs"] for r in results.summary()) == 2
+
+# --- TESTY ZÁZNAMU UDÁLOSTÍ ---
+
+def test_event_log_ring_buffer_keeps_latest():
+    log = EventLog(capacity=3)
+    for i in range(5):
+        log.emit("test", None, i=i)
+    assert [e[4]["i"] for e in log.events()] == [2, 3, 4]
+    assert log.dropped == 2
+    log.emit("other", None, INFO)
+    assert len(log.events("other")) == 1
+
+    quiet = EventLog(level=INFO)
+    quiet.emit(EVENT_SPAWN, None) # DEBUG se zahodí
+    assert quiet.total == 0
+
+def test_event_log_flushes_batches_to_file(tmp_path):
+    path = tmp_path / "events.jsonl"
+    log = EventLog(capacity=8, sink=FileSink(path), flush_every=4)
+    for i in range(10):
+        log.emit(EVENT_SPAWN, None, i=i)
+    log.sink.file.flush()
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 8 # Dvě celé dávky
+    log.close() # Dopíše zbytek
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["i"] for line in lines] == list(range(10))
+
+def test_simulation_logs_events_without_printing(capsys):
+    event_log.clear()
+    build_demo_simulation(seed=1).run(seconds=120)
+    assert capsys.readouterr().out == ""
+    assert event_log.events(EVENT_SPAWN)
+    assert event_log.events(EVENT_EXIT)
+    assert event_log.events(EVENT_CROSSING_CLOSE)
+    times = [e[0] for e in event_log.events()]
+    assert times == sorted(times)
+
+# --- TESTY SNAPSHOTŮ ---
+
+def _road_states(sim):
+    return [[(type(v).__name__, v.direction, v.position, v.speed, v.max_speed, v.stopped, v.is_braking,
+              v.current_wait) for v in road.vehicles] for road in sim.roads]
+
+def test_snapshot_restore_continues_identically(tmp_path):
+    path = tmp_path / "warm.snap"
+    original = build_demo_simulation(seed=3)
+    original.run(seconds=60)
+    original.save_snapshot(path)
+    ids = [[v.id for v in r.vehicles] for r in original.roads]
+    original.run(seconds=30)
+
+    restored = build_demo_simulation(seed=99) # Jiný seed - stav včetně náhody přijde ze snapshotu
+    restored.load_snapshot(path)
+    assert restored.time == pytest.approx(60)
+    assert [[v.id for v in r.vehicles] for r in restored.roads] == ids
+    restored.run(seconds=30)
+
+    assert _road_states(restored) == _road_states(original)
+    assert restored.stats() == original.stats()
+    assert [c.get_state() for c in restored.controllers] == [c.get_state() for c in original.controllers]
+    assert [l.is_green for r in restored.roads for l in r.traffic_lights] == \
+           [l.is_green for r in original.roads for l in r.traffic_lights]
+
+def test_snapshot_save_does_not_change_simulation(tmp_path):
+    # Uložení snapshotu nesmí sáhnout do kalendáře - simulace jede dál, jako by se nic nestalo.
+    saved = build_demo_simulation(seed=5)
+    untouched = build_demo_simulation(seed=5)
+    saved.run(seconds=45)
+    untouched.run(seconds=45)
+    calendar = saved.calendar.get_state()
+    saved.save_snapshot(tmp_path / "mid.snap")
+    assert saved.calendar.get_state() == calendar
+    saved.run(seconds=30)
+    untouched.run(seconds=30)
+
+    assert _road_states(saved) == _road_states(untouched)
+    assert [c.get_state() for c in saved.controllers] == [c.get_state() for c in untouched.controllers]
+
+def test_snapshot_keeps_lanes(tmp_path):
+    path = tmp_path / "lanes.snap"
+    road = MultiLaneRoad(length=1000, lanes=3)
+    for position in (0, 10, 20, 30, 40):
+        road.add_vehicle(Car(speed=20, position=position, direction=DIR_RIGHT))
+    Simulation([road]).save_snapshot(path)
+
+    restored = MultiLaneRoad(length=1000, lanes=3)
+    Simulation([restored]).load_snapshot(path)
+    assert [[v.position for v in lane] for lane in restored.lanes] == \
+           [[v.position for v in lane] for lane in road.lanes]
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "other.snap"
+    path.write_bytes(b"not a snapshot" * 10)
+    with pytest.raises(ValueError):
+        build_demo_simulation().load_snapshot(path)
+
+    build_demo_simulation(seed=1).save_snapshot(path)
+    small = Simulation([Road(100)])
+    with pytest.raises(ValueError):
+        small.load_snapshot(path)
+
+def test_sweep_forks_runs_from_snapshot(tmp_path):
+    path = tmp_path / "warm.snap"
+    warm = build_demo_simulation(seed=0)
+    warm.run(seconds=30)
+    warm.save_snapshot(path)
+    finished_at_snapshot = warm.stats()["cars_finished"]
+
+    runs = [run for run, _ in sweep(build_demo_simulation, [{}], replications=2, seconds=5, snapshot=str(path))]
+    assert len(runs) == 2
+    assert all(run["cars_finished"] >= finished_at_snapshot for run in runs)
+
+# --- TESTY ZÁZNAMU TRAJEKTORIÍ ---
+
+def test_recorder_writes_columnar_frames(tmp_path):
+    sim = build_demo_simulation(seed=2)
+    recorder = sim.attach_recorder(tmp_path / "rec", interval=0.5, chunk_rows=64) # Malé dávky -> hodně zápisů
+    expected = []
+    for _ in range(40):
+        sim.run(seconds=0.5)
+        expected.append([(i, v.id, v.position, v.speed) for i, r in enumerate(sim.roads) for v in r.vehicles])
+    recorder.close()
+
+    meta, columns, frames = read_trajectories(tmp_path / "rec")
+    assert len(frames) == 40 and meta["rows"] == sum(len(e) for e in expected)
+    for (tick, time, start, count), rows in zip(frames, expected):
+        recorded = [(columns["road"][k], columns["id"][k], columns["position"][k], columns["speed"][k])
+                    for k in range(start, start + count)]
+        assert recorded == rows
+    assert {meta["types"][code] for code in columns["type"]} <= {"Car", "Bus", "Truck", "Train"}
+    assert len(meta["roads"]) == len(sim.roads)
+
+def test_recorder_memory_is_bounded(tmp_path):
+    sim = build_demo_simulation(seed=2)
+    recorder = sim.attach_recorder(tmp_path / "rec", interval=0.1, chunk_rows=32)
+    sim.run(seconds=60)
+    assert all(len(buffer) == 32 for buffer in recorder.buffers.values())
+    assert recorder.filled < 32
+    assert recorder.rows > 1000 # Většina už je na disku
+
+# --- TESTY PŘEHRÁVÁNÍ ZÁZNAMU ---
+
+def test_recorder_keeps_interval_with_adaptive_step(tmp_path):
+    # I s dlouhými adaptivními kroky vzniká snímek každou periodu simulovaného času.
+    sim = build_demo_simulation(seed=5, car_interval=(60.0, 120.0))
+    sim.max_dt = 2.0
+    recorder = sim.attach_recorder(tmp_path / "rec", interval=1.0)
+    sim.run(seconds=120)
+    recorder.close()
+    _, _, frames = read_trajectories(tmp_path / "rec")
+    times = [time for _, time, _, _ in frames]
+    assert sim.ticks < 0.75 * 120 / 0.016
+    assert len(frames) == 120 // recorder.period
+    assert all(b - a == pytest.approx(recorder.period, abs=0.016) for a, b in zip(times, times[1:]))
+
+def _recorded_demo(path, seconds=40):
+    sim = build_demo_simulation(seed=5)
+    recorder = sim.attach_recorder(path, interval=1.0, chunk_rows=100)
+    states = []
+    for _ in range(seconds):
+        sim.run(seconds=1.0)
+        states.append(([[(v.id, type(v), v.position, v.speed) for v in r.vehicles] for r in sim.roads],
+                       [l.is_green for r in sim.roads for l in r.traffic_lights]))
+    recorder.close()
+    return states
+
+def test_replay_loads_any_frame(tmp_path):
+    states = _recorded_demo(tmp_path / "rec")
+    replay = TrajectoryReplay(tmp_path / "rec")
+    assert replay.frame_count == len(states)
+    for index in (len(states) - 1, 0, 17): # Libovolné pořadí
+        replay.load(index)
+        vehicles, lights = states[index]
+        assert [[(v.id, type(v), v.position, v.speed) for v in r.vehicles] for r in replay.roads] == vehicles
+        assert [l.is_green for l in replay.lights] == lights
+    replay.close()
+
+def test_replay_seek_by_time(tmp_path):
+    _recorded_demo(tmp_path / "rec", seconds=10)
+    replay = TrajectoryReplay(tmp_path / "rec")
+    assert replay.seek(-5) == 0
+    assert replay.seek(4.5) == 3 # Snímky v časech ~1, 2, 3, 4, 5...
+    assert replay.seek(1000) == replay.frame_count - 1
+    replay.close()
+
+def test_replay_keeps_lanes(tmp_path):
+    road = MultiLaneRoad(length=1000, lanes=3)
+    for position in (0, 10, 20, 30, 40):
+        road.add_vehicle(Car(speed=20, position=position, direction=DIR_RIGHT))
+    sim = Simulation([road])
+    recorder = sim.attach_recorder(tmp_path / "rec", interval=0.5)
+    sim.run(seconds=0.5)
+    recorder.close()
+    replay = TrajectoryReplay(tmp_path / "rec")
+    assert replay.meta["roads"][0]["lanes"] == 3
+    replay.load(0)
+    assert [[v.id for v in lane] for lane in replay.roads[0].lanes] == [[v.id for v in lane] for lane in road.lanes]
+    replay.close()
+
+def test_visualizer_replays_recording(tmp_path, monkeypatch):
+    pygame = pytest.importorskip("pygame")
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    _recorded_demo(tmp_path / "rec", seconds=10)
+    replay = TrajectoryReplay(tmp_path / "rec")
+    app = Visualizer(replay.roads, width=1200, height=700)
+    pygame.time.set_timer(pygame.QUIT, 300)
+    app.replay(replay, speed=20)
+    assert replay.current > 0 # Přehrávání se posunulo
+    replay.close()
+    pygame.quit()
+
+# --- TESTY BENCHMARKU ---
+
+def test_benchmark_case_and_compare():
+    import bench_Traffic_Simulation as bench
+    result = bench.run_case(10, 2, 2, 0.5, 1, min_seconds=0.05, max_ticks=50)
+    assert result["ticks"] > 0 and result["ticks_per_sec"] > 0
+    assert result["vehicle_updates_per_sec"] > 0
+
+    old = {"results": [dict(result, ticks_per_sec=100.0)]}
+    slower = {"results": [dict(result, ticks_per_sec=80.0)]}
+    faster = {"results": [dict(result, ticks_per_sec=120.0)]}
+    assert bench.compare(old, slower)[0][5] is True   # -20 % = regrese
+    assert bench.compare(old, faster)[0][5] is False
+    assert bench.compare(old, slower, threshold=0.25)[0][5] is False
+
+# --- TESTY PROFILOVÁNÍ ---
+
+def test_profiler_disabled_records_nothing():
+    profiler.reset()
+    sim = build_demo_simulation(seed=1)
+    sim.run(2.0)
+    assert profiler.samples == {} and len(profiler.trace) == 0
+
+def test_profiler_records_phases_and_percentiles(monkeypatch):
+    monkeypatch.setattr(profiler, "enabled", True)
+    profiler.reset()
+    sim = build_demo_simulation(seed=1)
+    sim.run(2.0)
+    for name in ("sim.step", "sim.generator", "sim.roads", "sim.controllers",
+                 "road.lights", "road.vehicles", "road.order", "road.exit"):
+        assert name in profiler.samples
+    values = profiler.percentiles("sim.step")
+    assert 0 <= values[50] <= values[95] <= values[99]
+    # Fáze silnic jsou vnořené v sim.roads, ten ve sim.step
+    assert profiler.percentiles("sim.roads")[50] <= values[99]
+    profiler.reset()
+
+def test_profiler_chrome_trace_export(tmp_path):
+    prof = Profiler(window=3)
+    t = prof.now()
+    for _ in range(5):
+        t = prof.record("a.b", t)
+    assert len(prof.samples["a.b"]) == 3 # Klouzavé okno
+    prof.export_chrome_trace(tmp_path / "trace.json")
+    data = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))
+    events = data["traceEvents"]
+    assert len(events) == 5
+    assert all(e["ph"] == "X" and e["name"] == "a.b" and e["dur"] >= 0 for e in events)
+    assert events[0]["ts"] <= events[-1]["ts"]
+
+# --- TESTY SCÉNÁŘŮ ---
+
+DEMO_SCENARIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo_scenario.json")
+
+def test_demo_scenario_matches_demo_builder():
+    # Scénář ukázkové scény postaví stejnou síť jako build_demo_simulation (i se stejnou dopravou).
+    built = build_demo_simulation(seed=4)
+    loaded = build_scenario(DEMO_SCENARIO, seed=4)
+
+    assert [[l.position for l in r.traffic_lights] for r in loaded.roads] == \
+           [[l.position for l in r.traffic_lights] for r in built.roads]
+    assert [c.crossing_point for c in loaded.controllers[2:]] == [c.crossing_point for c in built.controllers[2:]]
+    assert loaded.run(seconds=60) == built.run(seconds=60)
+
+def test_scenario_validation_reports_location():
+    data = read_scenario(DEMO_SCENARIO)
+    broken = [
+        ("roads", [{"id": "a", "direction": "H"}], r"roads\[0\]: chybí klíč 'length'"),
+        ("roads", [{"id": "a", "direction": "H", "length": 10, "speed": 3}], "neznámé klíče speed"),
+        ("engine", "gpu", "engine"),
+        ("seed", "42", "seed: očekáváno celé číslo"),
+    ]
+    for key, value, message in broken:
+        with pytest.raises(ScenarioError, match=message):
+            validate_scenario({**data, key: value})
+
+    crossing = dict(data["crossings"][0], at=[800, 360]) # Bod mimo silnici (jen na koleji)
+    with pytest.raises(ScenarioError, match=r"crossings\[0\]\.roads\[0\]"):
+        validate_scenario({**data, "crossings": [crossing]})
+    intersection = dict(data["intersections"][1], h=["rail_h_right"])
+    with pytest.raises(ScenarioError, match="není silnice"):
+        validate_scenario({**data, "intersections": [intersection]})
+    with pytest.raises(ScenarioError, match="neznámé parametry"):
+        build_scenario(data, green_time=3)
+
+def test_scenario_seed_is_default_for_generator():
+    # Seed ze scénáře platí, dokud ho nepřebije parametr (sweep posílá vlastní).
+    data = dict(read_scenario(DEMO_SCENARIO), seed=11)
+    assert build_scenario(data).generator.seed == 11
+    assert build_scenario(data, seed=3).generator.seed == 3
+    assert build_scenario(data).run(30)["cars_on_road"] == build_demo_simulation(seed=11).run(30)["cars_on_road"]
+
+def test_scenario_from_toml_with_overrides(tmp_path):
+    path = tmp_path / "cross.toml"
+    path.write_text("""
+dt = 0.05
+model = "idm"
+
+[[roads]]
+id = "east"
+direction = "H"
+y = 200
+length = 600
+
+[[roads]]
+id = "west"
+direction = "H"
+y = 200
+length = 600
+reverse = true
+
+[[roads]]
+id = "south"
+direction = "V"
+x = 250
+length = 400
+
+[[intersections]]
+id = "center"
+at = [250, 200]
+h = ["east", "west"]
+v = ["south"]
+green_duration = 20
+""", encoding="utf-8")
+    simulation = build_scenario(str(path), seed=1, green_duration=7.0, car_interval=(1.0, 2.0))
+
+    assert simulation.dt == 0.05
+    assert [l.position for r in simulation.roads for l in r.traffic_lights] == [220.0, 320.0, 170.0]
+    assert isinstance(simulation.roads[0].model, IDMModel)
+    assert simulation.controllers[0].green_duration == 7.0
+    assert simulation.generator.car_interval == (1.0, 2.0)
+    simulation.run(seconds=30)
+    assert simulation.stats()["cars_on_road"] > 0